@@ -1,19 +1,25 @@
 import os
+import atexit
 import logging
+import logging.handlers
 import random
+import re
 import calendar
-from datetime import datetime, timedelta
+import csv
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict
-import pandas as pd
+import bson
 import pymongo
-from pymongo import MongoClient
-import pytz
+from pymongo import MongoClient, ReturnDocument, UpdateOne
 import telebot
 from telebot import types
-import schedule
 import time
 import threading
-from io import BytesIO
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, TextIOWrapper
 import openpyxl
 from openpyxl.styles import Border, Side, Alignment, Font
 from openpyxl.utils import get_column_letter
@@ -27,51 +33,60 @@ class LimitedLinesFileHandler(logging.FileHandler):
         super().__init__(filename, mode, encoding, delay)
         self.max_lines = max_lines
         self.filename = filename
-        self.last_schedule_check = None
+        # Running line count so emit() doesn't have to re-read the file
+        self._line_count = self._count_lines()
         self._check_and_rotate()
 
-    def _check_and_rotate(self):
-        """Check if file exceeds max_lines and rotate if needed"""
+    def _open(self):
+        stream = super()._open()
+        # Truncate ('w') only on the first open; reopening after a rotation must append
+        self.mode = 'a'
+        return stream
+
+    def _count_lines(self):
+        """Count lines in the log file once, reading it in binary chunks"""
+        try:
+            with open(self.filename, 'rb') as f:
+                return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(65536), b''))
+        except FileNotFoundError:
+            return 0
+
+    def _check_and_rotate(self, incoming=0):
+        """Rotate the file if the cached line count plus `incoming` lines would exceed max_lines"""
+        if self._line_count + incoming <= self.max_lines:
+            return
         try:
+            if self.stream:
+                self.stream.flush()
+            # Keep the newest half (marker included) without loading the whole file, so the
+            # next rotation is another max_lines / 2 records away instead of one emit away
+            keep = max(self.max_lines // 2 - 1, 0)
             with open(self.filename, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            if len(lines) > self.max_lines:
-                # Keep only the last max_lines lines
-                lines_to_keep = lines[-self.max_lines:]
-                with open(self.filename, 'w', encoding='utf-8') as f:
-                    f.writelines(lines_to_keep)
-                print(f"Log file rotated: kept last {self.max_lines} lines")
+                lines_to_keep = deque(f, maxlen=keep)
+            tmp_filename = f"{self.filename}.tmp"
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                f.writelines(lines_to_keep)
                 # Add a rotation marker to the log file
-                with open(self.filename, 'a', encoding='utf-8') as f:
-                    f.write(f"{datetime.now(IST).strftime('%Y-%m-%d %H:%M:%S IST')} - LOG_ROTATION - INFO - Log file rotated, kept last {self.max_lines} lines\n")
+                f.write(f"{datetime.now(IST).strftime('%Y-%m-%d %H:%M:%S IST')} - LOG_ROTATION - INFO - Log file rotated, kept last {len(lines_to_keep)} lines\n")
+            # The open stream still points at the old file, so close it before swapping
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+            os.replace(tmp_filename, self.filename)
+            self._line_count = len(lines_to_keep) + 1
+            print(f"Log file rotated: kept last {len(lines_to_keep)} lines")
         except FileNotFoundError:
             # File doesn't exist yet, that's fine
-            pass
+            self._line_count = 0
         except Exception as e:
             print(f"Error rotating log file: {e}")
 
     def emit(self, record):
-        # Special handling for schedule check logs
-        if record.msg.startswith('🕰️ Schedule check'):
-            try:
-                with open(self.filename, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                # Filter out old schedule check logs while keeping other logs
-                filtered_lines = []
-                for line in lines:
-                    # Keep the line if it's not a schedule check log
-                    if ' - DEBUG - 🕰️ Schedule check at ' not in line:
-                        filtered_lines.append(line)
-                # Write filtered lines back to file
-                with open(self.filename, 'w', encoding='utf-8') as f:
-                    f.writelines(filtered_lines)
-            except Exception as e:
-                print(f"Error managing schedule check logs: {e}")
-
-        # Check rotation before each emit
-        self._check_and_rotate()
+        # Approximate count (tracebacks aren't included); rotation recounts exactly
+        lines = record.getMessage().count('\n') + 1
+        self._check_and_rotate(lines)
         super().emit(record)
+        self._line_count += lines
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -81,7 +96,25 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 MONGODB_URI = os.getenv('MONGODB_URI')
 DB_NAME = os.getenv('DB_NAME', 'TD')
 OWNER_ID = os.getenv('OWNER_ID') 
+# Handler threads for concurrent updates; handlers block on Mongo, Telegram and RateLimitedBot pacing
+# sleeps, so a few more threads than cores keep one slow chat from stalling the rest
+BOT_WORKER_THREADS = int(os.getenv('BOT_WORKER_THREADS', '16'))
 USER_TIMEOUT = 60
+USER_STATE_TTL = USER_TIMEOUT + 60  # Seconds per-user flow state (callback_data, cancel marks) outlives its prompt
+USER_STATE_MAX_ENTRIES = 20000
+UPLOAD_STATE_TTL = 30 * 60  # Seconds an upload prompt keeps waiting for its file; picking one can take a while
+OWNER_INPUT_ATTEMPTS = 3  # Invalid HH:MM replies allowed before an owner time change is abandoned
+USER_CACHE_TTL = 30  # Seconds a cached user document stays fresh (writes invalidate it immediately)
+USER_SETTINGS_CACHE_TTL = 600  # Longer freshness for rarely-changing settings such as custom_activities and villages
+USER_CACHE_MAX_ENTRIES = 4096  # Cached user documents kept before expired ones are swept
+DAILY_JOB_BATCH_SIZE = 500  # Users fetched per cursor batch by the scheduled jobs
+UI_CACHE_MAX_ENTRIES = 1024  # Rendered keyboards kept before the cache is reset
+TG_CHAT_RATE = 1.0  # Sustained outgoing Telegram calls per second per chat
+TG_CHAT_BURST = 3  # Calls a chat may make back-to-back before pacing kicks in
+TG_GLOBAL_RATE = 30.0  # Sustained outgoing Telegram calls per second across all chats
+TG_BUCKET_SWEEP_INTERVAL = 300  # Seconds between prunes of idle per-chat rate-limit buckets
+DAILY_JOB_SEND_WORKERS = 8  # Threads sending the daily jobs' messages concurrently
+LONG_POLLING_TIMEOUT = 50  # Seconds Telegram may hold a getUpdates request open
 
 # Daily schedule times (IST)
 DAILY_PROMPT_TIME = "19:00"  # 7:00 PM IST - Daily activity prompt
@@ -103,22 +136,52 @@ MAIN_ACTIVITIES_BY_MONTH = {
     12: ["Attended this village to observe seasonal and crop conditions"]
 }
 
+# Fallback for months without main activities, and the per-month lookup with it applied once
+DEFAULT_MAIN_ACTIVITIES = ("survey harvest", "seasonal conditions")
+MONTH_ACTIVITIES = {
+    month: tuple(MAIN_ACTIVITIES_BY_MONTH.get(month) or DEFAULT_MAIN_ACTIVITIES)
+    for month in range(1, 13)
+}
+
+# Valid village names: letters/digits (any script) and spaces, starting with a letter/digit
+VILLAGE_NAME_RE = re.compile(r'[^\W_](?:[^\W_]| )*')
+
+# English month names indexed 1-12, built once instead of per lookup
+MONTH_NAMES = tuple(calendar.month_name)
+
+# DD/MM/YYYY activity dates (single-digit day/month accepted, as strptime did)
+ACTIVITY_DATE_RE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})')
+
+# 24-hour HH:MM schedule times (single-digit hours like 9:30 are accepted, as strptime did)
+TIME_HHMM_RE = re.compile(r'(?:[01]?\d|2[0-3]):[0-5]\d')
+
 
 # MongoDB setup
-client = MongoClient(MONGODB_URI)
+# Pool sized for the handler threads plus the background pools; a few warm sockets spare the first
+# callback after a quiet spell the TCP/TLS handshake, and a bounded wait surfaces pool exhaustion
+# as an error instead of a hung handler
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', str(BOT_WORKER_THREADS * 4)))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '4'))
+client = MongoClient(
+    MONGODB_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=300000,
+    waitQueueTimeoutMS=2000,
+)
 db = client[DB_NAME]
 users_collection = db.users
 main_activities_collection = db.main_activities
 config_collection = db.config
 
-# Timezone
-IST = pytz.timezone('Asia/Kolkata')
+# Timezone: India has no DST, so a fixed +05:30 offset avoids pytz's zone lookups
+IST = timezone(timedelta(hours=5, minutes=30), 'IST')
 
 def load_schedule_times():
     """Load schedule times from MongoDB, or use defaults."""
     global DAILY_PROMPT_TIME, DEFAULT_ACTIVITY_TIME
     try:
-        config = config_collection.find_one({'_id': 'schedule_times'})
+        config = config_collection.find_one({'_id': 'schedule_times'}, {'daily_prompt_time': 1, 'default_activity_time': 1})
         if config:
             DAILY_PROMPT_TIME = config.get('daily_prompt_time', "19:00")
             DEFAULT_ACTIVITY_TIME = config.get('default_activity_time', "20:00")
@@ -128,52 +191,341 @@ def load_schedule_times():
     except Exception as e:
         logger.error(f"Error loading schedule times from DB: {e}. Using default values.")
 
+def normalize_user_ids():
+    """Rewrite any user_id stored as a string to the canonical int Telegram uses."""
+    try:
+        for doc in users_collection.find({'user_id': {'$type': 'string'}}, {'user_id': 1}):
+            try:
+                users_collection.update_one({'_id': doc['_id']}, {'$set': {'user_id': int(doc['user_id'])}})
+                logger.info(f"Normalized string user_id {doc['user_id']!r} to int")
+            except Exception as e:
+                # e.g. a non-numeric id, or an int copy of this user already exists
+                logger.error(f"Could not normalize user_id {doc['user_id']!r}: {e}")
+    except Exception as e:
+        logger.error(f"Error normalizing user ids: {e}")
+
+def normalize_village_names():
+    """Title-case legacy village names and activity villages once, so renders can use the stored form."""
+    try:
+        if config_collection.find_one({'_id': 'village_names_normalized'}, {'_id': 1}):
+            return
+        for user in users_collection.find({}, {'user_id': 1, 'villages': 1, 'activities': 1, '_id': 0}):
+            update = {}
+            villages = user.get('villages') or []
+            titled = [v.title() if isinstance(v, str) else v for v in villages]
+            if titled != villages:
+                update['villages'] = titled
+            activities = user.get('activities') or {}
+            # Legacy flat lists are normalized in place; migrate_activities_structure buckets them later
+            if isinstance(activities, list):
+                buckets = [('activities', activities)]
+            else:
+                buckets = [
+                    (f'activities.{year}.{month}', acts)
+                    for year, months in activities.items() for month, acts in months.items()
+                ]
+            for path, acts in buckets:
+                for i, act in enumerate(acts):
+                    village = act.get('to_village')
+                    if isinstance(village, str) and village != village.title():
+                        update[f'{path}.{i}.to_village'] = village.title()
+            if update:
+                users_collection.update_one({'user_id': user['user_id']}, {'$set': update})
+                logger.info(f"Normalized {len(update)} village name field(s) for user {user['user_id']}")
+        config_collection.update_one({'_id': 'village_names_normalized'}, {'$set': {'done_at': datetime.now(IST)}}, upsert=True)
+    except Exception as e:
+        logger.error(f"Error normalizing village names: {e}")
+
+def ensure_indexes():
+    """Create the indexes the bot's per-user queries rely on, and verify them at startup."""
+    try:
+        users_collection.create_index('user_id', unique=True)
+    except Exception as e:
+        # Typically duplicate user_id documents left over from the old find-then-insert flow
+        logger.error(f"Error creating indexes: {e}")
+        try:
+            duplicates = [
+                doc['_id'] for doc in users_collection.aggregate([
+                    {'$group': {'_id': '$user_id', 'count': {'$sum': 1}}},
+                    {'$match': {'count': {'$gt': 1}}},
+                    {'$limit': 10},
+                ])
+            ]
+            if duplicates:
+                logger.error(f"Duplicate user_id values blocking the unique index (first 10): {duplicates}")
+        except Exception as agg_error:
+            logger.error(f"Error checking for duplicate user_ids: {agg_error}")
+    try:
+        # The daily jobs only scan users with villages; the partial index leaves out users who never set any
+        users_collection.create_index(
+            [('villages', 1)],
+            name='villages_configured',
+            partialFilterExpression={'villages': {'$exists': True}}
+        )
+    except Exception as e:
+        logger.error(f"Error creating villages index: {e}")
+    try:
+        indexes = users_collection.index_information()
+        if any(idx.get('key') == [('user_id', 1)] and idx.get('unique') for idx in indexes.values()):
+            logger.info("Ensured unique index on users.user_id")
+        else:
+            logger.critical("⚠️ users.user_id has no unique index; every user lookup will scan the collection")
+    except Exception as e:
+        logger.error(f"Error verifying indexes: {e}")
+
+def format_numbered_list(items):
+    """Render items as '1. item' lines for settings and purpose messages."""
+    # str.join materializes its argument anyway, so a list comprehension is the fastest input
+    return '\n'.join([f"{i}. {item}" for i, item in enumerate(items, 1)])
+
+def activity_date_iso(date_str):
+    """Convert a DD/MM/YYYY activity date to a sortable YYYY-MM-DD string without strptime"""
+    match = ACTIVITY_DATE_RE.fullmatch(date_str)
+    if not match:
+        raise ValueError(f"invalid activity date: {date_str!r}")
+    day, month, year = match.groups()
+    dt_date(int(year), int(month), int(day))  # Raises ValueError for 31/02, month 13 etc., as strptime did
+    return f"{year}-{int(month):02d}-{int(day):02d}"
+
+def holiday_dates(holidays):
+    """Map each parseable public holiday date to its description (first entry wins)"""
+    dates = {}
+    for h in holidays:
+        try:
+            dates.setdefault(datetime.strptime(h['date'], '%d/%m/%Y').date(), h['desc'])
+        except Exception:
+            continue
+    return dates
+
+def check_bson_extension():
+    """Warn if pymongo is running without its C BSON codec."""
+    if not bson.has_c():
+        logger.warning("bson C extension not available; documents are decoded in pure Python (slower)")
+
 
 # --- Logging setup ---
 LOG_FILENAME = 'logs.txt'
 
-# Delete previous log file on bot restart
-try:
-    if os.path.exists(LOG_FILENAME):
-        os.remove(LOG_FILENAME)
-        print(f"Deleted previous log file: {LOG_FILENAME}")
-except Exception as e:
-    print(f"Error deleting previous log file: {e}")
-
 logger.setLevel(logging.DEBUG)
 
 # Remove any existing handlers to avoid duplicates
 for handler in logger.handlers[:]:
     logger.removeHandler(handler)
 
-# Use custom handler that limits to 6000 lines
-file_handler = LimitedLinesFileHandler(LOG_FILENAME, max_lines=6000, encoding='utf-8')
+# Use custom handler that limits to 6000 lines; mode='w' starts a fresh log on bot restart
+file_handler = LimitedLinesFileHandler(LOG_FILENAME, max_lines=6000, mode='w', encoding='utf-8')
 file_handler.setLevel(logging.DEBUG)
 
 # Create formatter with IST timezone
 class ISTFormatter(logging.Formatter):
+    # IST has a fixed +05:30 offset, so shift the timestamp instead of building a tz-aware datetime
+    IST_OFFSET_SECONDS = int(IST.utcoffset(None).total_seconds())
+
     def formatTime(self, record, datefmt=None):
-        dt = datetime.fromtimestamp(record.created, tz=IST)
-        if datefmt:
-            return dt.strftime(datefmt)
-        else:
-            return dt.strftime('%Y-%m-%d %H:%M:%S IST')
+        ist_time = time.gmtime(record.created + self.IST_OFFSET_SECONDS)
+        return time.strftime(datefmt or '%Y-%m-%d %H:%M:%S IST', ist_time)
 
 formatter = ISTFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+
+# Buffer records in memory so the file is written in batches; errors flush immediately
+buffered_handler = logging.handlers.MemoryHandler(
+    capacity=200,
+    flushLevel=logging.ERROR,
+    target=file_handler,
+    flushOnClose=True
+)
+logger.addHandler(buffered_handler)
+atexit.register(buffered_handler.flush)
+
+def flush_logs_periodically(interval=1):
+    """Flush buffered log records so interactive logs aren't delayed"""
+    while True:
+        time.sleep(interval)
+        buffered_handler.flush()
+
+threading.Thread(target=flush_logs_periodically, daemon=True).start()
 
 # Console handler removed to prevent duplicate logs
 
+class RateLimitedBot:
+    """TeleBot proxy that paces outgoing calls per chat and honours Telegram's 429 retry_after"""
+
+    # Method name -> (positional index, keyword) of the chat_id (or message, for reply_to)
+    _CHAT_ARGS = {
+        'send_message': (0, 'chat_id'),
+        'send_document': (0, 'chat_id'),
+        'delete_message': (0, 'chat_id'),
+        'edit_message_text': (1, 'chat_id'),
+        'edit_message_reply_markup': (0, 'chat_id'),
+        'reply_to': (0, 'message'),
+    }
+
+    def __init__(self, bot, rate=TG_CHAT_RATE, burst=TG_CHAT_BURST, global_rate=TG_GLOBAL_RATE):
+        self._bot = bot
+        self._rate = rate
+        self._burst = burst
+        self._global_rate = global_rate
+        self._buckets = {}  # chat_id -> (tokens, last refill time)
+        self._global_bucket = (global_rate, time.monotonic())  # Shared bucket, one second of burst
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + TG_BUCKET_SWEEP_INTERVAL
+
+    def __getattr__(self, name):
+        attr = getattr(self._bot, name)
+        spec = self._CHAT_ARGS.get(name)
+        if spec is None:
+            return attr
+        index, key = spec
+
+        def call(*args, **kwargs):
+            target = kwargs.get(key, args[index] if len(args) > index else None)
+            self._wait_for_slot(target.chat.id if name == 'reply_to' else target)
+            try:
+                return attr(*args, **kwargs)
+            except telebot.apihelper.ApiTelegramException as e:
+                if e.error_code != 429:
+                    raise
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                logger.warning(f"⏳ Telegram rate limit on {name}, retrying after {retry_after}s")
+                time.sleep(retry_after)
+                return attr(*args, **kwargs)
+        return call
+
+    def _wait_for_slot(self, chat_id):
+        """Take a token from the chat's bucket and the global bucket, sleeping until both allow the call"""
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(chat_id, (self._burst, now))
+            # Reserve a token up front; a negative balance is the wait owed
+            tokens = min(self._burst, tokens + (now - last) * self._rate) - 1
+            self._buckets[chat_id] = (tokens, now)
+            if now >= self._next_sweep:
+                self._sweep_full_buckets(now)
+            global_tokens, global_last = self._global_bucket
+            global_tokens = min(self._global_rate, global_tokens + (now - global_last) * self._global_rate) - 1
+            self._global_bucket = (global_tokens, now)
+        wait = max(-tokens / self._rate, -global_tokens / self._global_rate)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _sweep_full_buckets(self, now):
+        """Drop chat buckets that have refilled to capacity; a missing bucket starts full, so pacing is unchanged"""
+        full = [
+            chat_id for chat_id, (tokens, last) in self._buckets.items()
+            if tokens + (now - last) * self._rate >= self._burst
+        ]
+        for chat_id in full:
+            del self._buckets[chat_id]
+        self._next_sweep = now + TG_BUCKET_SWEEP_INTERVAL
+
+class ExpiringDict:
+    """Mapping that forgets entries `ttl` seconds after they were set.
+
+    Per-user conversation state is normally cleared by the flow that created it,
+    but abandoned flows would otherwise stay for the life of the process. Only the
+    item API is provided (`in`, `[]`, `get`, `pop`, `del`, `set`); each call checks
+    the entry's deadline, so an expired key always reads as absent and is evicted
+    on that read. There is deliberately no iteration, which could hand back stale
+    entries. The rest are swept when the mapping reaches `max_entries`, and if none
+    have expired the oldest ones are evicted so it stays bounded.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._data = {}  # key -> (value, expiry time), in insertion order
+        self._lock = threading.Lock()
+
+    def set(self, key, value, ttl=None):
+        """Store `value`, optionally with a TTL other than the default"""
+        now = time.time()
+        with self._lock:
+            self._data.pop(key, None)
+            if len(self._data) >= self._max_entries:
+                self._sweep(now)
+            self._data[key] = (value, now + (self._ttl if ttl is None else ttl))
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def _live(self, key):
+        """Return the (value, expiry) entry for `key`, evicting it if expired; caller holds the lock"""
+        entry = self._data.get(key)
+        if entry is not None and time.time() >= entry[1]:
+            del self._data[key]
+            return None
+        return entry
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._live(key) is not None
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._live(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry[0]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._live(key)
+        return default if entry is None else entry[0]
+
+    def __delitem__(self, key):
+        with self._lock:
+            if self._live(key) is None:
+                raise KeyError(key)
+            del self._data[key]
+
+    def pop(self, key, *default):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            del self._data[key]
+        return entry[0]
+
+    def _sweep(self, now):
+        expired = [k for k, (_, expires_at) in self._data.items() if now >= expires_at]
+        if not expired:
+            # Everything is fresh: drop the oldest quarter instead
+            expired = list(self._data)[:max(1, self._max_entries // 4)]
+        for k in expired:
+            del self._data[k]
+
+
 class TourDiaryBot:
     def __init__(self):
-        self.bot = telebot.TeleBot(BOT_TOKEN)
-        self.callback_data = {}
-        self.cancelled_users = set()  # Track users who cancelled input
+        # Threaded mode so a slow Mongo/Telegram call in one chat doesn't block the others
+        # Outgoing calls go through a per-chat rate limiter to avoid 429 retry-after stalls
+        self.bot = RateLimitedBot(telebot.TeleBot(BOT_TOKEN, threaded=True, num_threads=BOT_WORKER_THREADS))
+        self.callback_data = ExpiringDict(USER_STATE_TTL, USER_STATE_MAX_ENTRIES)
+        self.cancelled_users = ExpiringDict(USER_STATE_TTL, USER_STATE_MAX_ENTRIES)  # Users who cancelled input
         self.input_prompt_message = {}  # Track prompt message_id per user
         self.pending_prompts = {}  # Track pending prompts for timeout
+        self._timeouts = queue.PriorityQueue()  # (timeout_time, user_id) prompt deadlines
+        self._user_cache = {}  # user_id -> (user document, fetch time)
+        self._user_cache_lock = threading.Lock()  # Handler threads read, fill and sweep the cache concurrently
+        self._user_cache_epoch = 0  # Bumped by every write to the cache; see _cache_user
+        self._purpose_ui_cache = {}  # (prefix, activities) -> (keyboard JSON, text); (prefix, count) -> keyboard JSON
+        self._daily_keyboard_cache = {}  # (headquarters, available villages) -> reply_markup JSON
+        self._settings_menu_cache = {}  # (menu kind, items) -> (list text, keyboard JSON) or keyboard JSON
+        self._user_activities_cache = {}  # (custom activities, month) -> merged purpose options
         self.daily_prompt_message_ids = {}  # Store daily prompt message IDs for deletion
+        self._schedule_changed = threading.Event()  # Wakes the schedule thread after a time change
+        self.owner_input_state = {}  # user_id -> {'kind', 'attempts', 'expires_at'} for owner time input
+        self._tg_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='tg-cleanup')  # Fire-and-forget Telegram calls
+        self._user_locks = {}  # user_id -> [RLock, holder count]; see _user_lock
+        self._user_locks_guard = threading.Lock()
         load_schedule_times()
+        normalize_user_ids()
+        normalize_village_names()
+        ensure_indexes()
+        check_bson_extension()
         self.setup_handlers()
         self.schedule_daily_tasks()
         self.start_prompt_timeout_checker()
@@ -185,48 +537,336 @@ class TourDiaryBot:
         logger.info(f"🔍 Variable values - DAILY_PROMPT_TIME: '{DAILY_PROMPT_TIME}' (type: {type(DAILY_PROMPT_TIME)})")
         logger.info(f"🔍 Variable values - DEFAULT_ACTIVITY_TIME: '{DEFAULT_ACTIVITY_TIME}' (type: {type(DEFAULT_ACTIVITY_TIME)})")
 
+    def _get_user(self, user_id, ttl=USER_CACHE_TTL):
+        """Return the user document without `activities`, served from the in-process cache while fresh.
+
+        Activity history is read per month via _get_month_activities instead.
+        The returned dict is shared with the cache, so callers must not mutate it.
+        """
+        now = time.time()
+        with self._user_cache_lock:
+            cached = self._user_cache.get(user_id)
+            epoch = self._user_cache_epoch
+        if cached and now - cached[1] < ttl:
+            return cached[0]
+        user = users_collection.find_one({'user_id': user_id}, {'activities': 0})
+        if user:
+            self._cache_user(user_id, user, now, epoch)
+        return user
+
+    def _cache_user(self, user_id, user, now=None, epoch=None):
+        """Store a user document (fetched without `activities`) in the cache.
+
+        Documents returned by a write are stored unconditionally. A plain read passes
+        the `epoch` it started at and is dropped if a write landed meanwhile, since
+        it may predate that write.
+        """
+        now = time.time() if now is None else now
+        with self._user_cache_lock:
+            if epoch is None:
+                self._user_cache_epoch += 1
+            elif epoch != self._user_cache_epoch:
+                return
+            if len(self._user_cache) >= USER_CACHE_MAX_ENTRIES:
+                # Sweep entries too old for any caller before growing further
+                expired = [uid for uid, entry in self._user_cache.items() if now - entry[1] >= USER_SETTINGS_CACHE_TTL]
+                for uid in expired:
+                    del self._user_cache[uid]
+            self._user_cache[user_id] = (user, now)
+
+    @contextmanager
+    def _user_lock(self, user_id):
+        """Hold the lock serializing one user's handlers.
+
+        Updates from the same user run in order against their callback_data /
+        input_prompt_message state; every user has their own lock, so unrelated
+        chats never wait on each other. The lock is dropped once no handler holds
+        or waits for it, which keeps the dict as small as the active users.
+        """
+        with self._user_locks_guard:
+            entry = self._user_locks.get(user_id)
+            if entry is None:
+                entry = self._user_locks[user_id] = [threading.RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._user_locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._user_locks[user_id]
+
+    def _get_headquarters(self, user_id):
+        """Return the user's headquarters name title-cased, as the village buttons carry it"""
+        # Headquarters only changes through settings writes, which invalidate the cache
+        user = self._get_user(user_id, ttl=USER_SETTINGS_CACHE_TTL)
+        return ((user or {}).get('headquarters') or 'HQ').title()
+
+    def _invalidate_user(self, user_id):
+        """Drop the cached user document after a write"""
+        with self._user_cache_lock:
+            self._user_cache_epoch += 1
+            self._user_cache.pop(user_id, None)
+
+    def _get_purpose_ui(self, user_activities, prefix='purpose'):
+        """Return the (serialized keyboard, numbered text) for a purpose list, memoized by its contents"""
+        key = (prefix, tuple(user_activities))
+        cached = self._purpose_ui_cache.get(key)
+        if cached:
+            return cached
+        # The buttons only carry indexes, so the keyboard is shared by every list of the same length
+        markup_json = self._purpose_ui_cache.get((prefix, len(user_activities)))
+        if markup_json is None:
+            markup_json = self._build_purpose_keyboard(prefix, len(user_activities))
+            self._purpose_ui_cache[(prefix, len(user_activities))] = markup_json
+        activities_text = format_numbered_list(user_activities)
+        if len(self._purpose_ui_cache) >= UI_CACHE_MAX_ENTRIES:
+            self._purpose_ui_cache.clear()
+        self._purpose_ui_cache[key] = (markup_json, activities_text)
+        return markup_json, activities_text
+
+    @staticmethod
+    def _build_purpose_keyboard(prefix, count):
+        keyboard = types.InlineKeyboardMarkup(row_width=5)
+        # Show numbered activities with numbered buttons, 5 per row
+        keyboard.add(*[
+            types.InlineKeyboardButton(f"{i}", callback_data=f"{prefix}_idx_{i-1}")
+            for i in range(1, count + 1)
+        ])
+        keyboard.add(
+            types.InlineKeyboardButton("📝 Manual Entry", callback_data=f"{prefix}_custom")
+        )
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
+        )
+        return keyboard.to_json()
+
+    def _get_daily_village_keyboard(self, headquarters, available_villages):
+        """Return the daily prompt's serialized village keyboard, memoized by headquarters and villages"""
+        key = (headquarters.title(), tuple(available_villages))
+        cached = self._daily_keyboard_cache.get(key)
+        if cached:
+            return cached
+        keyboard = types.InlineKeyboardMarkup(row_width=2)
+        keyboard.add(
+            types.InlineKeyboardButton(
+                f"🏢 {key[0]} (headquarters)", callback_data=f"daily_village_{key[0]}"
+            )
+        )
+        # One add() call; telebot splits the buttons into rows of row_width
+        keyboard.add(*[
+            types.InlineKeyboardButton(v, callback_data=f"daily_village_{v}")
+            for v in available_villages
+        ])
+        keyboard.add(
+            types.InlineKeyboardButton("✏️ Manual Entry", callback_data="daily_village_manual")
+        )
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
+        )
+        # Telegram accepts the JSON string as reply_markup, so it is serialized only once
+        markup_json = keyboard.to_json()
+        if len(self._daily_keyboard_cache) >= UI_CACHE_MAX_ENTRIES:
+            self._daily_keyboard_cache.clear()
+        self._daily_keyboard_cache[key] = markup_json
+        return markup_json
+
+    def _cache_settings_menu(self, key, value):
+        # Menus are stored with their keyboards already serialized, so a send skips to_json()
+        if len(self._settings_menu_cache) >= UI_CACHE_MAX_ENTRIES:
+            self._settings_menu_cache.clear()
+        self._settings_menu_cache[key] = value
+        return value
+
+    def _get_activities_menu(self, activities):
+        """Return the (list text, keyboard) of the custom activities settings menu, memoized by its contents"""
+        key = ('activities', tuple(activities))
+        cached = self._settings_menu_cache.get(key)
+        if cached:
+            return cached
+        activities_text = format_numbered_list(activities) if activities else 'No custom activities defined.'
+        # Rows are built directly; one button per row
+        rows = [[types.InlineKeyboardButton("➕ Add Activity", callback_data="settings_add_activity")]]
+        if activities:
+            rows.append([types.InlineKeyboardButton("🗑️ Remove Activity", callback_data="settings_remove_activity")])
+        rows.append([types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")])
+        return self._cache_settings_menu(key, (activities_text, types.InlineKeyboardMarkup(keyboard=rows).to_json()))
+
+    def _get_remove_menu(self, kind, items):
+        """Return the one-button-per-item removal keyboard for 'activity' or 'village', memoized by its contents"""
+        key = (f'remove_{kind}', tuple(items))
+        cached = self._settings_menu_cache.get(key)
+        if cached:
+            return cached
+        rows = [
+            [types.InlineKeyboardButton(f"🗑️ {item}", callback_data=f"remove_{kind}_idx_{i}")]
+            for i, item in enumerate(items)
+        ]
+        rows.append([types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")])
+        return self._cache_settings_menu(key, types.InlineKeyboardMarkup(keyboard=rows).to_json())
+
+    def _get_villages_menu(self, villages):
+        """Return the (list text, keyboard) of the villages settings menu, memoized by its contents"""
+        key = ('villages', tuple(villages))
+        cached = self._settings_menu_cache.get(key)
+        if cached:
+            return cached
+        villages_text = format_numbered_list(villages) if villages else 'No villages added yet.'
+        rows = [[types.InlineKeyboardButton("➕ Add Village", callback_data="settings_add_village")]]
+        if villages:
+            rows.append([types.InlineKeyboardButton("🗑️ Remove Village", callback_data="settings_remove_village")])
+        rows.append([types.InlineKeyboardButton("📁 Upload File (Replace All)", callback_data="settings_upload_villages")])
+        rows.append([types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")])
+        return self._cache_settings_menu(key, (villages_text, types.InlineKeyboardMarkup(keyboard=rows).to_json()))
+
+    def _render_settings_menu(self, user):
+        """Return the (text, keyboard) of the /settings menu for a user document"""
+        keyboard = self._settings_menu_cache.get(('settings',))
+        if keyboard is None:
+            # The buttons never change, so the markup is built once
+            keyboard = self._cache_settings_menu(('settings',), types.InlineKeyboardMarkup(keyboard=[
+                [types.InlineKeyboardButton("👤 Set Role", callback_data="settings_setrole")],
+                [types.InlineKeyboardButton("🏢 Set Headquarters", callback_data="settings_sethq")],
+                [types.InlineKeyboardButton("🏘️ Add Villages", callback_data="settings_addvil")],
+                [types.InlineKeyboardButton("📋 Manage Activities", callback_data="settings_activities")],
+                [types.InlineKeyboardButton("🎯 Default Purpose", callback_data="settings_default_purpose")],
+                [types.InlineKeyboardButton("📅 Add Public Holidays", callback_data="settings_upload_holidays")],
+                [types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")],
+            ]).to_json())
+        hq_status = (
+            f"✅ {user.get('headquarters', 'Not set')}"
+            if user.get('headquarters')
+            else "❌ Not set"
+        )
+        role = user.get('role')
+        role_status = f"✅ {role}" if role else "❌ Not set"
+        settings_text = (
+            f"⚙️ **Settings**\n\n"
+            f"**Headquarters:** {hq_status}\n"
+            f"**Role:** {role_status}\n"
+            f"**Villages:** {len(user.get('villages', []))} added\n"
+            f"**Custom Activities:** {len(user.get('custom_activities', []))} defined\n"
+            f"**Default Purpose:** {user.get('default_purpose') or 'Not set'}\n"
+            f"**Public Holidays:** {len(user.get('public_holidays', []))} added\n\n"
+            f"Select an option to configure:"
+        )
+        return settings_text, keyboard
+
+    def _delete_messages_async(self, chat_id, message_ids, user_id):
+        """Delete messages in the background so callers don't wait one Telegram round-trip per delete"""
+        def delete(message_id):
+            try:
+                self.bot.delete_message(chat_id, message_id)
+                logger.debug(f"🗑️ Deleted message {message_id} for user {user_id}")
+            except Exception as e:
+                logger.error(f"Error deleting message {message_id} for user {user_id}: {e}")
+
+        for message_id in message_ids:
+            self._tg_pool.submit(delete, message_id)
+
+    def _pop_daily_prompt_message_id(self, user_id):
+        """Remove and return the tracked daily prompt message id for a user, if any"""
+        msg_info = self.daily_prompt_message_ids.pop(user_id, None)
+        if isinstance(msg_info, dict):
+            return msg_info['message_id']
+        # Handle legacy format where only message_id was stored
+        return msg_info
+
+    def _set_user_field(self, user_id, field, value):
+        """Set one user field, skipping the write (and cache invalidation) when it already holds `value`"""
+        result = users_collection.update_one(
+            {'user_id': user_id, field: {'$ne': value}},
+            {'$set': {field: value}}
+        )
+        if result.matched_count == 0:
+            # Unchanged, or the user doesn't exist yet; $setOnInsert only writes in the latter case.
+            # (Upserting the $ne filter directly would try to insert a duplicate user when unchanged.)
+            result = users_collection.update_one(
+                {'user_id': user_id},
+                {'$setOnInsert': {field: value}},
+                upsert=True
+            )
+        if result.modified_count or result.upserted_id is not None:
+            self._invalidate_user(user_id)
+
+    def _track_pending_prompt(self, user_id, chat_id, message_id, **extra):
+        """Track a prompt for timeout and queue its deadline for the checker thread.
+
+        Extra keyword arguments are stored on the prompt for the callback dispatcher.
+        """
+        timeout_time = time.time() + USER_TIMEOUT
+        self.pending_prompts[user_id] = {
+            'message_id': message_id,
+            'chat_id': chat_id,
+            'timeout_time': timeout_time,
+            'type': 'button',
+            **extra,
+        }
+        self._timeouts.put((timeout_time, user_id))
+
     def start_prompt_timeout_checker(self):
         def check_timeouts():
             while True:
-                now = time.time()
-                to_remove = []
-                for user_id, prompt in list(self.pending_prompts.items()):
-                    if now >= prompt['timeout_time']:
-                        try:
-                            self.bot.delete_message(prompt['chat_id'], prompt['message_id'])
-                        except Exception as e:
-                            logger.error(f"Error deleting timed out prompt for user {user_id}: {e}")
-                        # Clean up any pending state
-                        if user_id in self.callback_data:
-                            del self.callback_data[user_id]
-                        if user_id in self.input_prompt_message:
-                            del self.input_prompt_message[user_id]
-                        self.cancelled_users.add(user_id)
-                        try:
-                            self.bot.send_message(prompt['chat_id'], "⏰ Timed out. Operation cancelled.")
-                        except Exception as e:
-                            logger.error(f"Error sending timeout message to user {user_id}: {e}")
-                        to_remove.append(user_id)
-                for user_id in to_remove:
-                    del self.pending_prompts[user_id]
-                time.sleep(2)
+                # Block until a prompt is queued, then sleep until its deadline.
+                # Every prompt uses USER_TIMEOUT, so later entries never expire sooner.
+                timeout_time, user_id = self._timeouts.get()
+                remaining = timeout_time - time.time()
+                if remaining > 0:
+                    time.sleep(remaining)
+
+                # Skip entries for prompts that were answered or replaced by a newer one
+                prompt = self.pending_prompts.get(user_id)
+                if not prompt or prompt['timeout_time'] != timeout_time:
+                    continue
+                self.pending_prompts.pop(user_id, None)
+
+                try:
+                    self.bot.delete_message(prompt['chat_id'], prompt['message_id'])
+                except Exception as e:
+                    logger.error(f"Error deleting timed out prompt for user {user_id}: {e}")
+                # Clean up any pending state
+                if user_id in self.callback_data:
+                    del self.callback_data[user_id]
+                if user_id in self.input_prompt_message:
+                    del self.input_prompt_message[user_id]
+                self.owner_input_state.pop(user_id, None)
+                # Drop the waiting step handler outright; a leftover one would consume the user's
+                # next message (even a /command) just to discard it
+                try:
+                    self.bot.clear_step_handler_by_chat_id(prompt['chat_id'])
+                except Exception as e:
+                    logger.error(f"Error clearing step handlers for user {user_id}: {e}")
+                    self.cancelled_users[user_id] = True
+                try:
+                    self.bot.send_message(prompt['chat_id'], "⏰ Timed out. Operation cancelled.")
+                except Exception as e:
+                    logger.error(f"Error sending timeout message to user {user_id}: {e}")
         thread = threading.Thread(target=check_timeouts, daemon=True)
         thread.start()
 
+    @staticmethod
+    def _new_user_fields(user_id):
+        """Fields a user document starts with"""
+        return {
+            'user_id': user_id,
+            'headquarters': None,
+            'villages': [],
+            'activities': [],
+            'custom_activities': [],
+            'role': None
+        }
+
     def start_command(self, message):
         """Handle /start command"""
         user_id = message.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
-
-        if not user:
-            users_collection.insert_one({
-                'user_id': user_id,
-                'headquarters': None,
-                'villages': [],
-                'activities': [],
-                'custom_activities': [],
-                'role': None
-            })
+        # Create the user document only if it doesn't exist yet
+        users_collection.update_one(
+            {'user_id': user_id},
+            {'$setOnInsert': self._new_user_fields(user_id)},
+            upsert=True
+        )
+        self._invalidate_user(user_id)
         message_text = "🎉 Welcome to TD Bot!"
         self.bot.reply_to(message, message_text)
 
@@ -246,24 +886,16 @@ class TourDiaryBot:
             file_info = self.bot.get_file(file.file_id)
             downloaded_file = self.bot.download_file(file_info.file_path)
             file_data = BytesIO(downloaded_file)
-            if file_name.endswith('.csv'):
-                df = pd.read_csv(file_data)
-            else:
-                df = pd.read_excel(file_data)
-            village_col = None
-            for col in df.columns:
-                if 'village' in col.lower():
-                    village_col = col
-                    break
-            if village_col is None:
+            raw_villages = self._read_village_column(file_name, file_data)
+            if raw_villages is None:
                 self.bot.reply_to(message, "❌ No 'Village' column found in the file.")
                 return
             seen = set()
             filtered_villages = []
             skipped = []
-            for v in df[village_col].dropna().astype(str).tolist():
+            for v in raw_villages:
                 v_clean = v.strip().title()
-                if not v_clean or v_clean.startswith('/') or not v_clean.replace(' ', '').isalnum():
+                if not v_clean or v_clean.startswith('/') or not VILLAGE_NAME_RE.fullmatch(v_clean):
                     logger.warning(f"Skipping invalid village name: '{v_clean}'")
                     skipped.append(v_clean)
                     continue
@@ -276,11 +908,14 @@ class TourDiaryBot:
                 self.bot.reply_to(message, "❌ No valid villages found in the file.")
                 return
             logger.info(f"User {user_id} uploaded villages: {filtered_villages}")
-            users_collection.update_one(
+            user = users_collection.find_one_and_update(
                 {'user_id': user_id},
                 {'$set': {'villages': filtered_villages}},
-                upsert=True
+                upsert=True,
+                projection={'activities': 0},
+                return_document=ReturnDocument.AFTER
             )
+            self._cache_user(user_id, user)
             reply_msg = (
                 f"✅ Successfully added {len(filtered_villages)} villages!\n\n"
                 f"**Villages added:** {', '.join(filtered_villages[:5])}"
@@ -290,26 +925,8 @@ class TourDiaryBot:
                 reply_msg += f"\n\n⚠️ Skipped invalid names: {', '.join(skipped[:5])}" + (f" and {len(skipped)-5} more..." if len(skipped) > 5 else "")
             self.bot.reply_to(message, reply_msg, parse_mode='Markdown')
             # Refresh the settings UI
-            user = users_collection.find_one({'user_id': user_id})
             villages = user.get('villages', []) if user else []
-            villages_text = (
-                '\n'.join([f"{i+1}. {v}" for i, v in enumerate(villages)])
-                if villages else 'No villages added yet.'
-            )
-            keyboard = types.InlineKeyboardMarkup()
-            keyboard.add(
-                types.InlineKeyboardButton("➕ Add Village", callback_data="settings_add_village")
-            )
-            if villages:
-                keyboard.add(
-                    types.InlineKeyboardButton("🗑️ Remove Village", callback_data="settings_remove_village")
-                )
-            keyboard.add(
-                types.InlineKeyboardButton("📁 Upload File (Replace All)", callback_data="settings_upload_villages")
-            )
-            keyboard.add(
-                types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-            )
+            villages_text, keyboard = self._get_villages_menu(villages)
             self.bot.send_message(
                 message.chat.id,
                 f"🏘️ **Your Villages:**\n\n{villages_text}\n\nYou can add, remove, or upload a new list to replace all.",
@@ -320,10 +937,54 @@ class TourDiaryBot:
             logger.error(f"Error processing file for user {user_id}: {e}")
             self.bot.reply_to(message, f"❌ Error processing file: {str(e)}")
 
+    @staticmethod
+    def _iter_table_rows(file_name, file_data):
+        """Yield the rows (header first) of an uploaded .csv/.xlsx/.xls file; empty cells are None or ''"""
+        if file_name.endswith('.xls'):
+            # Legacy .xls isn't supported by openpyxl; pandas is imported only when one is uploaded
+            import pandas as pd
+            df = pd.read_excel(file_data, header=None)
+            for row in df.itertuples(index=False):
+                yield tuple(None if pd.isna(v) else v for v in row)
+            return
+        if file_name.endswith('.csv'):
+            yield from csv.reader(TextIOWrapper(file_data, encoding='utf-8-sig'))
+            return
+        wb = openpyxl.load_workbook(file_data, read_only=True, data_only=True)
+        try:
+            yield from wb.active.iter_rows(values_only=True)
+        finally:
+            # Read-only workbooks keep the source open until closed
+            wb.close()
+
+    @staticmethod
+    def _find_column(header, name):
+        """Return the index of the first header cell containing `name` (case-insensitive), or None"""
+        return next((i for i, h in enumerate(header) if h and name in str(h).lower()), None)
+
+    @classmethod
+    def _read_village_column(cls, file_name, file_data):
+        """Return the non-empty values of the first 'village' column, or None if there is none"""
+        rows = cls._iter_table_rows(file_name, file_data)
+        try:
+            header = next(rows, None) or ()
+            col_idx = cls._find_column(header, 'village')
+            if col_idx is None:
+                return None
+            values = []
+            for row in rows:
+                v = row[col_idx] if col_idx < len(row) else None
+                if v is None or v == '':
+                    continue
+                values.append(str(v))
+            return values
+        finally:
+            rows.close()
+
     def record_activity_command(self, message):
         """Handle /act command"""
         user_id = message.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
+        user = self._get_user(user_id)
 
         logger.info(f"User {user_id} initiated /act command")
 
@@ -335,7 +996,9 @@ class TourDiaryBot:
             return
 
         args = message.text.split()[1:] if len(message.text.split()) > 1 else []
-        date_str = datetime.now(IST).strftime('%d/%m/%Y')
+        # One clock read for the whole /act invocation, shared with show_village_buttons
+        now = datetime.now(IST)
+        date_str = now.strftime('%d/%m/%Y')
         purpose = None
 
         if args:
@@ -349,39 +1012,23 @@ class TourDiaryBot:
                 logger.info(f"Purpose from args: {purpose}")
 
         logger.info(f"Showing village buttons to user {user_id}")
-        self.show_village_buttons(message, user['villages'])
+        self.show_village_buttons(message, user['villages'], user=user, now=now)
 
-    def show_village_buttons(self, message, villages: List[str]):
+    def show_village_buttons(self, message, villages: List[str], user=None, now=None):
         """Show village selection buttons with filtering and additional options"""
         user_id = message.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
-
-        # Ensure all village names are in proper case for display and comparison
-        villages = [v.title() for v in villages]
+        if user is None:
+            user = self._get_user(user_id)
 
-        current_time = datetime.now(IST)
+        current_time = now or datetime.now(IST)
         current_month = current_time.month
         current_year = current_time.year
-        covered_villages = set()
 
         # Migrate to new structure if needed
         user_id = message.from_user.id
         self.migrate_activities_structure(user_id)
 
-        # Get activities from new structure
-        activities = user.get('activities', {})
-        year_str = str(current_year)
-        month_str = str(current_month)
-
-        if year_str in activities and month_str in activities[year_str]:
-            for activity in activities[year_str][month_str]:
-                try:
-                    activity_date = datetime.strptime(activity['date'], '%d/%m/%Y')
-                    if activity_date.month == current_month and activity_date.year == current_year:
-                        if activity.get('to_village'):
-                            covered_villages.add(activity['to_village'].title())
-                except ValueError:
-                    continue
+        covered_villages = self._get_covered_villages(user_id, str(current_year), str(current_month))
 
         available_villages = [v for v in villages if v not in covered_villages]
 
@@ -397,7 +1044,7 @@ class TourDiaryBot:
                 f"\nVisited: {covered_villages_str}"
             )
 
-        keyboard = types.InlineKeyboardMarkup()
+        keyboard = types.InlineKeyboardMarkup(row_width=2)
         headquarters = user.get('headquarters', 'HQ')
         keyboard.add(
             types.InlineKeyboardButton(
@@ -405,20 +1052,11 @@ class TourDiaryBot:
             )
         )
 
-        for i in range(0, len(available_villages), 2):
-            row = []
-            row.append(
-                types.InlineKeyboardButton(
-                    available_villages[i], callback_data=f"village_{available_villages[i]}"
-                )
-            )
-            if i + 1 < len(available_villages):
-                row.append(
-                    types.InlineKeyboardButton(
-                        available_villages[i + 1], callback_data=f"village_{available_villages[i + 1]}"
-                    )
-                )
-            keyboard.add(*row)
+        # One add() call; telebot splits the buttons into rows of row_width
+        keyboard.add(*[
+            types.InlineKeyboardButton(v, callback_data=f"village_{v}")
+            for v in available_villages
+        ])
 
         keyboard.add(
             types.InlineKeyboardButton("✏️ Manual Entry", callback_data="village_manual")
@@ -434,16 +1072,13 @@ class TourDiaryBot:
             reply_markup=keyboard
         )
         # Track pending prompt for timeout
-        self.pending_prompts[message.from_user.id] = {
-            'message_id': sent.message_id,
-            'chat_id': message.chat.id,
-            'timeout_time': time.time() + USER_TIMEOUT,
-            'type': 'button',
-        }
+        self._track_pending_prompt(message.from_user.id, message.chat.id, sent.message_id)
 
     def handle_village_selection(self, message, temp_activity: Dict, timeout=USER_TIMEOUT):
         """Handle village selection (text input for next step)"""
         logger.info(f"Village selection handler called with text: {message.text}")
+        # Remove pending prompt on user response (before any follow-up prompt is tracked)
+        self.pending_prompts.pop(message.from_user.id, None)
         village = message.text.strip().title()
         temp_activity['to_village'] = village
 
@@ -478,13 +1113,13 @@ class TourDiaryBot:
             # Show purpose buttons with the correct month's default purposes
             self.show_purpose_buttons_with_custom_handler(message, temp_activity, custom_purpose_handler, month=month)
 
-        # Remove pending prompt on user response
-        self.pending_prompts.pop(message.from_user.id, None)
-
     def show_purpose_buttons_with_custom_handler(self, message, temp_activity, custom_purpose_handler, month=None):
         """Show purpose selection buttons with numbered activities, and only register next step handler for custom purpose"""
         user_id = message.from_user.id if hasattr(message, 'from_user') else message.chat.id
 
+        # Read the clock once for both the fallback month and the display date
+        now = datetime.now(IST)
+
         # Get month from temp_activity date if available, otherwise use provided month or current month
         if 'date' in temp_activity:
             activity_date = datetime.strptime(temp_activity['date'], '%d/%m/%Y')
@@ -494,13 +1129,13 @@ class TourDiaryBot:
             month = int(month)
             logger.debug(f"Using provided month: {month}")
         else:
-            month = int(datetime.now(IST).month)
+            month = now.month
             logger.debug(f"Using current month: {month}")
 
         logger.debug(f"Month value: {month} (type: {type(month)})")
 
         # Get current date for display
-        current_date = temp_activity.get('date', datetime.now(IST).strftime('%d/%m/%Y'))
+        current_date = temp_activity.get('date') or now.strftime('%d/%m/%Y')
         logger.debug(f"Using date for display: {current_date}")
 
         # Get all activities for the user and month
@@ -508,35 +1143,13 @@ class TourDiaryBot:
         logger.debug(f"Retrieved activities for user {user_id} and month {month}: {user_activities}")
 
         # Log activity information
-        logger.info(f"User {user_id}: Using activities for date {current_date} (month: {calendar.month_name[month]})")
-        logger.info(f"Activities for {calendar.month_name[month]}: {user_activities}")
-
-        keyboard = types.InlineKeyboardMarkup()
-
-        # Show numbered activities with numbered buttons in rows (side by side)
-        row = []
-        for i, purpose in enumerate(user_activities, 1):
-            row.append(types.InlineKeyboardButton(f"{i}", callback_data=f"purpose_idx_{i-1}"))
-            # Add 5 buttons per row
-            if len(row) == 5:
-                keyboard.add(*row)
-                row = []
-
-        # Add remaining buttons if any
-        if row:
-            keyboard.add(*row)
-
-        keyboard.add(
-            types.InlineKeyboardButton("📝 Manual Entry", callback_data="purpose_custom")
-        )
-        keyboard.add(
-            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-        )
+        logger.info(f"User {user_id}: Using activities for date {current_date} (month: {MONTH_NAMES[month]})")
+        logger.info(f"Activities for {MONTH_NAMES[month]}: {user_activities}")
 
-        # Create numbered list text
-        activities_text = '\n'.join([f"{i}. {purpose}" for i, purpose in enumerate(user_activities, 1)])
+        # Keyboard and numbered list are shared across prompts with the same options
+        keyboard, activities_text = self._get_purpose_ui(user_activities)
 
-        message_text = f"🎯 **Select the purpose of visit for {current_date}**\n\n**Activities for {calendar.month_name[month]}:**\n{activities_text}\n\nClick the number button or use Manual Entry."
+        message_text = f"🎯 **Select the purpose of visit for {current_date}**\n\n**Activities for {MONTH_NAMES[month]}:**\n{activities_text}\n\nClick the number button or use Manual Entry."
 
         sent = self.bot.send_message(
             message.chat.id,
@@ -544,73 +1157,14 @@ class TourDiaryBot:
             reply_markup=keyboard,
             parse_mode='Markdown'
         )
-        self.pending_prompts[message.from_user.id] = {
-            'message_id': sent.message_id,
-            'chat_id': message.chat.id,
-            'timeout_time': time.time() + USER_TIMEOUT,
-            'type': 'button',
-        }
-
-        # Register a callback handler for the purpose buttons
-        @self.bot.callback_query_handler(func=lambda call: call.from_user.id == user_id and call.data.startswith('purpose_'))
-        def purpose_callback(call):
-            if call.data == 'purpose_custom':
-                # Register next step handler for custom purpose text input
-                self.bot.edit_message_text(
-                    "✏️ Please type your custom purpose:",
-                    call.message.chat.id,
-                    call.message.message_id
-                )
-                self.bot.register_next_step_handler(
-                    call.message,
-                    custom_purpose_handler
-                )
-            elif call.data.startswith('purpose_idx_'):
-                # Handle numbered activity selection
-                try:
-                    idx = int(call.data.replace('purpose_idx_', ''))
-                    if 0 <= idx < len(user_activities):
-                        purpose = user_activities[idx]
-                        logger.info(f"Purpose selected by index {idx}: {purpose}")
-                        temp_activity['purpose'] = purpose
-                        temp_activity['user_id'] = user_id
-
-                        # Delete the purpose selection message before saving
-                        try:
-                            self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                            logger.debug(f"Deleted purpose selection message for user {user_id}")
-                        except Exception as e:
-                            logger.error(f"Failed to delete purpose selection message for user {user_id}: {e}")
-
-                        self.save_activity_callback(call, temp_activity)
-                    else:
-                        logger.error(f"Invalid purpose index {idx} for user {user_id}")
-                        self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
-                        return
-                except ValueError:
-                    logger.error(f"Invalid purpose index format: {call.data}")
-                    self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
-                    return
-            else:
-                # Handle legacy purpose selection (fallback)
-                purpose = call.data.replace('purpose_', '')
-                logger.info(f"Purpose selected (legacy): {purpose}")
-                temp_activity['purpose'] = purpose
-                temp_activity['user_id'] = user_id
-
-                # Delete the purpose selection message before saving
-                try:
-                    self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                    logger.debug(f"Deleted purpose selection message for user {user_id}")
-                except Exception as e:
-                    logger.error(f"Failed to delete purpose selection message for user {user_id}: {e}")
-
-                self.save_activity_callback(call, temp_activity)
-
-            if user_id in self.callback_data:
-                del self.callback_data[user_id]
-                logger.info(f"Cleaned up callback_data for user {user_id}")
-                return
+        # The purpose_* callbacks are routed by the global dispatcher in setup_handlers,
+        # which reads the options and handlers stored on this prompt
+        self.callback_data[user_id] = temp_activity
+        self._track_pending_prompt(
+            message.from_user.id, message.chat.id, sent.message_id,
+            purpose_options=user_activities,
+            custom_purpose_handler=custom_purpose_handler
+        )
 
     def show_purpose_buttons(self, message, user_id=None, month=None):
         """Show purpose selection buttons with numbered activities"""
@@ -620,30 +1174,7 @@ class TourDiaryBot:
 
         logger.info(f"show_purpose_buttons called for user {user_id}, got {len(user_activities)} activities: {user_activities}")
 
-        keyboard = types.InlineKeyboardMarkup()
-
-        # Show numbered activities with numbered buttons in rows (side by side)
-        row = []
-        for i, purpose in enumerate(user_activities, 1):
-            row.append(types.InlineKeyboardButton(f"{i}", callback_data=f"purpose_idx_{i-1}"))
-            # Add 5 buttons per row
-            if len(row) == 5:
-                keyboard.add(*row)
-                row = []
-
-        # Add remaining buttons if any
-        if row:
-            keyboard.add(*row)
-
-        keyboard.add(
-            types.InlineKeyboardButton("📝 Manual Entry", callback_data="purpose_custom")
-        )
-        keyboard.add(
-            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-        )
-
-        # Create numbered list text
-        activities_text = '\n'.join([f"{i}. {purpose}" for i, purpose in enumerate(user_activities, 1)])
+        keyboard, activities_text = self._get_purpose_ui(user_activities)
         message_text = f"🎯 **Select the purpose of visit:**\n\n{activities_text}\n\nClick the number button or use Manual Entry."
 
         sent = self.bot.send_message(
@@ -653,42 +1184,14 @@ class TourDiaryBot:
             parse_mode='Markdown'
         )
         # Track pending prompt for timeout
-        self.pending_prompts[message.from_user.id] = {
-            'message_id': sent.message_id,
-            'chat_id': message.chat.id,
-            'timeout_time': time.time() + USER_TIMEOUT,
-            'type': 'button',
-        }
+        self._track_pending_prompt(message.from_user.id, message.chat.id, sent.message_id)
 
     def show_purpose_buttons_edit(self, message):
         """Edit message to show purpose selection buttons with numbered activities"""
         user_id = message.chat.id
         user_activities = self.get_user_activities(user_id)
 
-        keyboard = types.InlineKeyboardMarkup()
-
-        # Show numbered activities with numbered buttons in rows (side by side)
-        row = []
-        for i, purpose in enumerate(user_activities, 1):
-            row.append(types.InlineKeyboardButton(f"{i}", callback_data=f"purpose_idx_{i-1}"))
-            # Add 5 buttons per row
-            if len(row) == 5:
-                keyboard.add(*row)
-                row = []
-
-        # Add remaining buttons if any
-        if row:
-            keyboard.add(*row)
-
-        keyboard.add(
-            types.InlineKeyboardButton("📝 Manual Entry", callback_data="purpose_custom")
-        )
-        keyboard.add(
-            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-        )
-
-        # Create numbered list text
-        activities_text = '\n'.join([f"{i}. {purpose}" for i, purpose in enumerate(user_activities, 1)])
+        keyboard, activities_text = self._get_purpose_ui(user_activities)
         message_text = f"🎯 **Select the purpose of visit:**\n\n{activities_text}\n\nClick the number button or use Manual Entry."
 
         try:
@@ -700,12 +1203,7 @@ class TourDiaryBot:
                 parse_mode='Markdown'
             )
             # Track pending prompt for timeout
-            self.pending_prompts[message.chat.id] = {
-                'message_id': message.message_id,
-                'chat_id': message.chat.id,
-                'timeout_time': time.time() + USER_TIMEOUT,
-                'type': 'button',
-            }
+            self._track_pending_prompt(message.chat.id, message.chat.id, message.message_id)
         except Exception as e:
             logger.error(f"Error editing message for user {user_id}: {e}")
             sent = self.bot.send_message(
@@ -714,12 +1212,7 @@ class TourDiaryBot:
                 reply_markup=keyboard,
                 parse_mode='Markdown'
             )
-            self.pending_prompts[message.chat.id] = {
-                'message_id': sent.message_id,
-                'chat_id': message.chat.id,
-                'timeout_time': time.time() + USER_TIMEOUT,
-                'type': 'button',
-            }
+            self._track_pending_prompt(message.chat.id, message.chat.id, sent.message_id)
 
     def handle_purpose_selection(self, message, temp_activity: Dict, timeout=USER_TIMEOUT):
         """Handle purpose selection (text input for custom purpose)"""
@@ -733,190 +1226,131 @@ class TourDiaryBot:
         # Remove pending prompt on user response
         self.pending_prompts.pop(message.from_user.id, None)
 
+    @staticmethod
+    def _activity_year_month(date_str):
+        """Return the (year, month) activity keys for a DD/MM/YYYY date, or None if it isn't a real date"""
+        try:
+            year, month, _ = activity_date_iso(date_str).split('-')
+        except ValueError:
+            return None
+        # Keys are unpadded, matching str(dt.month) elsewhere
+        return str(int(year)), str(int(month))
+
+    @classmethod
+    def _month_activities(cls, activities, year_str, month_str):
+        """Activities filed under a year/month bucket whose own date is in that month; misfiled ones are skipped"""
+        return [
+            a for a in activities.get(year_str, {}).get(month_str, [])
+            if cls._activity_year_month(a.get('date', '')) == (year_str, month_str)
+        ]
+
+    def _load_user_for_save(self, user_id, year, month):
+        """Fetch headquarters and the month's activity dates in one small query, migrating legacy activities if found.
+
+        Returns (user, set of dates already recorded that month).
+        """
+        projection = {'headquarters': 1, f'activities.{year}.{month}.date': 1, '_id': 0}
+        user = users_collection.find_one({'user_id': user_id}, projection)
+        # A legacy flat list still comes back as a list under this projection
+        if user and isinstance(user.get('activities'), list):
+            self.migrate_activities_structure(user_id)
+            user = users_collection.find_one({'user_id': user_id}, projection)
+        if not user:
+            return None, set()
+        month_activities = user.get('activities', {}).get(year, {}).get(month, [])
+        return user, {a.get('date') for a in month_activities}
+
     def save_activity(self, message, activity_data: Dict):
         """Save activity to database"""
-        user_id = message.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
+        self._persist_activity(
+            user_id=message.from_user.id,
+            chat_id=message.chat.id,
+            activity_data=activity_data,
+            reply=lambda text: self.bot.reply_to(message, text)
+        )
+
+    def save_activity_callback(self, call, temp_activity):
+        """Save activity to database from callback query"""
+        user_id = temp_activity['user_id']
+        logger.debug("Saving activity from callback for user %s", user_id)
+        self._persist_activity(
+            user_id=user_id,
+            chat_id=call.message.chat.id,
+            activity_data=temp_activity,
+            reply=lambda text: self.bot.send_message(call.message.chat.id, text),
+            prompt_message_id=call.message.message_id
+        )
 
-        logger.info(f"Saving activity for user {user_id}: {activity_data}")
+        # Remove pending prompt on user response
+        self.pending_prompts.pop(user_id, None)
 
-        if not user:
-            logger.error(f"User {user_id} not found in database")
-            return
+    def _persist_activity(self, *, user_id: int, chat_id: int, activity_data: Dict, reply, prompt_message_id=None):
+        """Validate, store and confirm an activity; shared by the text and callback save paths.
 
+        `reply` sends error messages back to the user; `prompt_message_id` is the
+        selection prompt to delete along with any daily prompt.
+        """
+        logger.info("Saving activity for user %s: %s", user_id, activity_data)
+
+        year_month = None
         if 'date' not in activity_data:
-            activity_data['date'] = datetime.now(IST).strftime('%d/%m/%Y')
-            logger.info(f"Added default date: {activity_data['date']}")
+            now = datetime.now(IST)
+            activity_data['date'] = now.strftime('%d/%m/%Y')
+            # Freshly generated date: take year/month from the datetime instead of re-parsing it
+            year_month = (str(now.year), str(now.month))
+            logger.debug("Added default date: %s", activity_data['date'])
 
         if 'to_village' not in activity_data:
             logger.error(f"Village information missing for user {user_id}")
-            self.bot.reply_to(
-                message, "❌ Village information is missing. Please try again."
-            )
+            reply("❌ Village information is missing. Please try again.")
             return
 
         if 'purpose' not in activity_data:
             logger.error(f"Purpose information missing for user {user_id}")
-            self.bot.reply_to(
-                message, "❌ Purpose information is missing. Please try again."
-            )
+            reply("❌ Purpose information is missing. Please try again.")
+            return
+
+        # Parse date to get year and month
+        if year_month is None:
+            year_month = self._activity_year_month(activity_data['date'])
+        if year_month is None:
+            logger.error(f"Invalid date format for activity: {activity_data['date']}")
+            reply("❌ Invalid date format. Please try again.")
+            return
+        year, month = year_month
+
+        user, recorded_dates = self._load_user_for_save(user_id, year, month)
+        if not user:
+            logger.error(f"User {user_id} not found in database")
             return
 
         activity = {
             'date': activity_data['date'],
             'from': user['headquarters'] or 'HQ',
-            'to_village': activity_data['to_village'],
+            'to_village': activity_data['to_village'].title(),
             'purpose': activity_data['purpose']
         }
 
-        logger.info(f"Created activity object: {activity}")
-
-        # Migrate to new structure if needed
-        self.migrate_activities_structure(user_id)
-
-        # Parse date to get year and month
-        try:
-            dt = datetime.strptime(activity['date'], '%d/%m/%Y')
-            year = str(dt.year)
-            month = str(dt.month)
-        except Exception as e:
-            logger.error(f"Invalid date format for activity: {activity['date']}")
-            self.bot.reply_to(message, "❌ Invalid date format. Please try again.")
-            return
-
-        # Get current activities structure
-        user = users_collection.find_one({'user_id': user_id})
-        activities = user.get('activities', {})
-
-        # Check if activity for this date already exists
-        existing_activity = None
-        if year in activities and month in activities[year]:
-            for i, act in enumerate(activities[year][month]):
-                if act['date'] == activity['date']:
-                    existing_activity = i
-                    break
-
-        if existing_activity is not None:
-            # Update existing activity
-            users_collection.update_one(
-                {'user_id': user_id},
-                {'$set': {f'activities.{year}.{month}.{existing_activity}': activity}}
-            )
-            message_text = "✅ Activity updated successfully!"
-        else:
-            # Add new activity
-            users_collection.update_one(
-                {'user_id': user_id},
-                {'$push': {f'activities.{year}.{month}': activity}}
-            )
-            message_text = "✅ Activity recorded successfully!"
-
-        activity_summary = (
-            f"**Date:** {activity['date']}\n"
-            f"**From:** {activity['from']}\n"
-            f"**To:** {activity['to_village']}\n"
-            f"**Purpose:** {activity['purpose']}"
-        )
-
-        # Delete the daily prompt message if it exists
-        if user_id in self.daily_prompt_message_ids:
-            try:
-                msg_info = self.daily_prompt_message_ids[user_id]
-                if isinstance(msg_info, dict):
-                    message_id = msg_info['message_id']
-                else:
-                    # Handle legacy format where only message_id was stored
-                    message_id = msg_info
-                self.bot.delete_message(message.chat.id, message_id)
-                logger.info(f"🗑️ Deleted daily prompt message for user {user_id}")
-                del self.daily_prompt_message_ids[user_id]
-            except Exception as e:
-                logger.error(f"Error deleting daily prompt message for user {user_id}: {e}")
-
-        self.bot.send_message(
-            message.chat.id,
-            f"{message_text}\n\n{activity_summary}",
-            parse_mode='Markdown'
-        )
-
-    def save_activity_callback(self, call, temp_activity):
-        """Save activity to database from callback query"""
-        user_id = temp_activity['user_id']
-        logger.info(f"Saving activity from callback for user {user_id}: {temp_activity}")
-        user = users_collection.find_one({'user_id': user_id})
-
-        if not user:
-            logger.error(f"User {user_id} not found in database")
-            return
-
-        if 'date' not in temp_activity:
-            temp_activity['date'] = datetime.now(IST).strftime('%d/%m/%Y')
-            logger.info(f"Added default date: {temp_activity['date']}")
-
-        if 'to_village' not in temp_activity:
-            logger.error(f"Village information missing for user {user_id}")
-            self.bot.send_message(
-                call.message.chat.id,
-                "❌ Village information is missing. Please try again."
-            )
-            return
-
-        if 'purpose' not in temp_activity:
-            logger.error(f"Purpose information missing for user {user_id}")
-            self.bot.send_message(
-                call.message.chat.id,
-                "❌ Purpose information is missing. Please try again."
-            )
-            return
-
-        activity = {
-            'date': temp_activity['date'],
-            'from': user['headquarters'] or 'HQ',
-            'to_village': temp_activity['to_village'],
-            'purpose': temp_activity['purpose']
-        }
-
-        logger.info(f"Created activity object: {activity}")
-
-        # Migrate to new structure if needed
-        self.migrate_activities_structure(user_id)
-
-        # Parse date to get year and month
-        try:
-            dt = datetime.strptime(activity['date'], '%d/%m/%Y')
-            year = str(dt.year)
-            month = str(dt.month)
-        except Exception as e:
-            logger.error(f"Invalid date format for activity: {activity['date']}")
-            self.bot.send_message(call.message.chat.id, "❌ Invalid date format. Please try again.")
-            return
-
-        # Get current activities structure
-        user = users_collection.find_one({'user_id': user_id})
-        activities = user.get('activities', {})
-
-        # Check if activity for this date already exists
-        existing_activity = None
-        if year in activities and month in activities[year]:
-            for i, act in enumerate(activities[year][month]):
-                if act['date'] == activity['date']:
-                    existing_activity = i
-                    break
-
-        if existing_activity is not None:
-            # Update existing activity
-            users_collection.update_one(
-                {'user_id': user_id},
-                {'$set': {f'activities.{year}.{month}.{existing_activity}': activity}}
-            )
-            message_text = "✅ Activity updated successfully!"
-        else:
-            # Add new activity
-            users_collection.update_one(
-                {'user_id': user_id},
-                {'$push': {f'activities.{year}.{month}': activity}}
-            )
-            message_text = "✅ Activity recorded successfully!"
+        logger.debug("Created activity object: %s", activity)
+
+        # One round-trip: replace this date's activity in place if present, otherwise append it.
+        # The $ne guard makes the $push a no-op whenever the positional $set matched.
+        month_path = f'activities.{year}.{month}'
+        users_collection.bulk_write([
+            UpdateOne(
+                {'user_id': user_id, f'{month_path}.date': activity['date']},
+                {'$set': {f'{month_path}.$': activity}}
+            ),
+            UpdateOne(
+                {'user_id': user_id, f'{month_path}.date': {'$ne': activity['date']}},
+                {'$push': {month_path: activity}}
+            ),
+        ], ordered=True)
+        self._invalidate_user(user_id)
+        if activity['date'] in recorded_dates:
+            message_text = "✅ Activity updated successfully!"
+        else:
+            message_text = "✅ Activity recorded successfully!"
 
         activity_summary = (
             f"**Date:** {activity['date']}\n"
@@ -925,89 +1359,38 @@ class TourDiaryBot:
             f"**Purpose:** {activity['purpose']}"
         )
 
-        # Delete the purpose selection prompt before sending confirmation
-        try:
-            self.bot.delete_message(call.message.chat.id, call.message.message_id)
-            logger.debug(f"Deleted purpose selection prompt for user {user_id}")
-        except Exception as e:
-            logger.error(f"Failed to delete purpose selection prompt for user {user_id}: {e}")
-
-        # Delete the daily prompt message if it exists
-        if user_id in self.daily_prompt_message_ids:
-            try:
-                msg_info = self.daily_prompt_message_ids[user_id]
-                if isinstance(msg_info, dict):
-                    message_id = msg_info['message_id']
-                else:
-                    # Handle legacy format where only message_id was stored
-                    message_id = msg_info
-                self.bot.delete_message(call.message.chat.id, message_id)
-                logger.info(f"🗑️ Deleted daily prompt message for user {user_id}")
-                del self.daily_prompt_message_ids[user_id]
-            except Exception as e:
-                logger.error(f"Error deleting daily prompt message for user {user_id}: {e}")
+        # Delete the selection prompt and the daily prompt (if any) without blocking the confirmation
+        message_ids = [prompt_message_id] if prompt_message_id is not None else []
+        daily_prompt_id = self._pop_daily_prompt_message_id(user_id)
+        if daily_prompt_id is not None:
+            message_ids.append(daily_prompt_id)
+        self._delete_messages_async(chat_id, message_ids, user_id)
 
         # Send confirmation message
         self.bot.send_message(
-            call.message.chat.id,
+            chat_id,
             f"{message_text}\n\n{activity_summary}",
             parse_mode='Markdown'
         )
 
-        # Remove pending prompt on user response
-        self.pending_prompts.pop(user_id, None)
-
 
     def settings_command(self, message):
         """Handle /settings command"""
         user_id = message.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
+        user = self._get_user(user_id)
 
         if not user:
-            users_collection.insert_one({
-                'user_id': user_id,
-                'headquarters': None,
-                'villages': [],
-                'activities': [],
-                'custom_activities': [],
-                'role': None
-            })
-            user = users_collection.find_one({'user_id': user_id})
-
-        hq_status = (
-            f"✅ {user.get('headquarters', 'Not set')}"
-            if user.get('headquarters')
-            else "❌ Not set"
-        )
-        role = user.get('role')
-        role_status = f"✅ {role}" if role else "❌ Not set"
-        villages_count = len(user.get('villages', []))
-        custom_activities_count = len(user.get('custom_activities', []))
-        default_purpose = user.get('default_purpose') or 'Not set'
-        holidays_count = len(user.get('public_holidays', []))
-
-        keyboard_buttons = [
-            types.InlineKeyboardButton("👤 Set Role", callback_data="settings_setrole"),
-            types.InlineKeyboardButton("🏢 Set Headquarters", callback_data="settings_sethq"),
-            types.InlineKeyboardButton("🏘️ Add Villages", callback_data="settings_addvil"),
-            types.InlineKeyboardButton("📋 Manage Activities", callback_data="settings_activities"),
-            types.InlineKeyboardButton("🎯 Default Purpose", callback_data="settings_default_purpose"),
-            types.InlineKeyboardButton("📅 Add Public Holidays", callback_data="settings_upload_holidays"),
-            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-        ]
-        keyboard = types.InlineKeyboardMarkup()
-        for btn in keyboard_buttons:
-            keyboard.add(btn)
+            # Create-if-missing and read back in one atomic round-trip
+            user = users_collection.find_one_and_update(
+                {'user_id': user_id},
+                {'$setOnInsert': self._new_user_fields(user_id)},
+                upsert=True,
+                projection={'activities': 0},
+                return_document=ReturnDocument.AFTER
+            )
+            self._invalidate_user(user_id)
 
-        settings_text = (
-            f"⚙️ **Settings**\n\n"
-            f"**Headquarters:** {hq_status}\n"
-            f"**Villages:** {villages_count} added\n"
-            f"**Custom Activities:** {custom_activities_count} defined\n"
-            f"**Default Purpose:** {default_purpose}\n"
-            f"**Public Holidays:** {holidays_count} added\n\n"
-            f"Select an option to configure:"
-        )
+        settings_text, keyboard = self._render_settings_menu(user)
 
         try:
             self.bot.send_message(
@@ -1058,11 +1441,35 @@ class TourDiaryBot:
 
     def _is_valid_time_format(self, time_str):
         """Validate HH:MM format."""
-        try:
-            datetime.strptime(time_str, '%H:%M')
-            return True
-        except ValueError:
-            return False
+        return bool(TIME_HHMM_RE.fullmatch(time_str))
+
+    def _start_owner_time_input(self, user_id, chat_id, message_id, kind):
+        """Open a bounded owner time-input state; the prompt timeout checker expires it"""
+        self.owner_input_state[user_id] = {
+            'kind': kind,
+            'attempts': OWNER_INPUT_ATTEMPTS,
+            'expires_at': time.time() + USER_TIMEOUT
+        }
+        self._track_pending_prompt(user_id, chat_id, message_id)
+
+    def _finish_owner_time_input(self, user_id):
+        """Close the owner time-input state and stop its timeout"""
+        self.owner_input_state.pop(user_id, None)
+        self.pending_prompts.pop(user_id, None)
+
+    def _retry_owner_time_input(self, message, state, handler, example):
+        """Ask again after an invalid time, giving up once attempts run out or the prompt expired"""
+        user_id = message.from_user.id
+        state['attempts'] -= 1
+        if state['attempts'] <= 0 or time.time() > state['expires_at']:
+            self._finish_owner_time_input(user_id)
+            self.bot.reply_to(message, "❌ Too many invalid attempts. Time change cancelled.")
+            return
+        self.bot.reply_to(
+            message,
+            f"❌ Invalid format. Please use HH:MM (e.g., {example}). {state['attempts']} attempt(s) left."
+        )
+        self.bot.register_next_step_handler(message, handler)
 
     def handle_owner_set_prompt_time(self, message, timeout=None):
         """Handle owner input for new daily prompt time."""
@@ -1070,12 +1477,16 @@ class TourDiaryBot:
         if str(user_id) != str(OWNER_ID):
             return
 
+        state = self.owner_input_state.get(user_id)
+        if not state or state['kind'] != 'prompt_time':
+            return
+
         new_time = message.text.strip()
         if not self._is_valid_time_format(new_time):
-            self.bot.reply_to(message, "❌ Invalid format. Please use HH:MM (e.g., 19:30).")
             logger.warning(f"Invalid time format received from user {user_id}: {new_time}")
-            self.bot.register_next_step_handler(message, self.handle_owner_set_prompt_time)
+            self._retry_owner_time_input(message, state, self.handle_owner_set_prompt_time, "19:30")
             return
+        self._finish_owner_time_input(user_id)
 
         try:
             config_collection.update_one(
@@ -1085,22 +1496,15 @@ class TourDiaryBot:
             )
             global DAILY_PROMPT_TIME
             DAILY_PROMPT_TIME = new_time
+            self._schedule_changed.set()
             
-            # Delete the original prompt message if present
+            # Delete the original prompt message (if present) and the user's input message in parallel
+            message_ids = [message.message_id]
             if user_id in self.input_prompt_message:
-                try:
-                    self.bot.delete_message(message.chat.id, self.input_prompt_message[user_id])
-                except Exception as e:
-                    logger.error(f"Error deleting prompt message for user {user_id}: {e}")
-                del self.input_prompt_message[user_id]
-            
-            # Delete the user's input message
-            try:
-                self.bot.delete_message(message.chat.id, message.message_id)
-            except Exception as e:
-                logger.error(f"Error deleting user input message for user {user_id}: {e}")
-                
-            self.bot.send_message(message.chat.id, f"✅ Daily prompt time updated to **{new_time}** IST. The change will take effect on the next schedule check.", parse_mode='Markdown')
+                message_ids.append(self.input_prompt_message.pop(user_id))
+            self._delete_messages_async(message.chat.id, message_ids, user_id)
+
+            self.bot.send_message(message.chat.id, f"✅ Daily prompt time updated to **{new_time}** IST. The change takes effect immediately.", parse_mode='Markdown')
             logger.info(f"Owner updated daily prompt time to {new_time}")
         except Exception as e:
             logger.error(f"Error updating prompt time in DB: {e}")
@@ -1112,11 +1516,15 @@ class TourDiaryBot:
         if str(user_id) != str(OWNER_ID):
             return
 
+        state = self.owner_input_state.get(user_id)
+        if not state or state['kind'] != 'fallback_time':
+            return
+
         new_time = message.text.strip()
         if not self._is_valid_time_format(new_time):
-            self.bot.reply_to(message, "❌ Invalid format. Please use HH:MM (e.g., 20:00).")
-            self.bot.register_next_step_handler(message, self.handle_owner_set_fallback_time)
+            self._retry_owner_time_input(message, state, self.handle_owner_set_fallback_time, "20:00")
             return
+        self._finish_owner_time_input(user_id)
 
         try:
             config_collection.update_one(
@@ -1126,22 +1534,15 @@ class TourDiaryBot:
             )
             global DEFAULT_ACTIVITY_TIME
             DEFAULT_ACTIVITY_TIME = new_time
+            self._schedule_changed.set()
             
-            # Delete the original prompt message if present
+            # Delete the original prompt message (if present) and the user's input message in parallel
+            message_ids = [message.message_id]
             if user_id in self.input_prompt_message:
-                try:
-                    self.bot.delete_message(message.chat.id, self.input_prompt_message[user_id])
-                except Exception as e:
-                    logger.error(f"Error deleting prompt message for user {user_id}: {e}")
-                del self.input_prompt_message[user_id]
-            
-            # Delete the user's input message
-            try:
-                self.bot.delete_message(message.chat.id, message.message_id)
-            except Exception as e:
-                logger.error(f"Error deleting user input message for user {user_id}: {e}")
-                
-            self.bot.send_message(message.chat.id, f"✅ Default activity fallback time updated to **{new_time}** IST. The change will take effect on the next schedule check.", parse_mode='Markdown')
+                message_ids.append(self.input_prompt_message.pop(user_id))
+            self._delete_messages_async(message.chat.id, message_ids, user_id)
+
+            self.bot.send_message(message.chat.id, f"✅ Default activity fallback time updated to **{new_time}** IST. The change takes effect immediately.", parse_mode='Markdown')
             logger.info(f"Owner updated default activity time to {new_time}")
         except Exception as e:
             logger.error(f"Error updating fallback time in DB: {e}")
@@ -1151,7 +1552,7 @@ class TourDiaryBot:
         """Handle headquarters setting from settings"""
         user_id = message.from_user.id
         if user_id in self.cancelled_users:
-            self.cancelled_users.remove(user_id)
+            self.cancelled_users.pop(user_id, None)
             return
         headquarters = message.text.strip().title()
 
@@ -1175,11 +1576,7 @@ class TourDiaryBot:
             return
 
         try:
-            users_collection.update_one(
-                {'user_id': user_id},
-                {'$set': {'headquarters': headquarters}},
-                upsert=True
-            )
+            self._set_user_field(user_id, 'headquarters', headquarters)
         except Exception as e:
             logger.error(f"Error updating headquarters for user {user_id}: {e}")
             self.bot.send_message(
@@ -1208,7 +1605,7 @@ class TourDiaryBot:
         """Handle role setting from settings"""
         user_id = message.from_user.id
         if user_id in self.cancelled_users:
-            self.cancelled_users.remove(user_id)
+            self.cancelled_users.pop(user_id, None)
             return
         role = message.text.strip()  # Preserve case
 
@@ -1232,11 +1629,7 @@ class TourDiaryBot:
             return
 
         try:
-            users_collection.update_one(
-                {'user_id': user_id},
-                {'$set': {'role': role}},
-                upsert=True
-            )
+            self._set_user_field(user_id, 'role', role)
         except Exception as e:
             logger.error(f"Error updating role for user {user_id}: {e}")
             self.bot.send_message(
@@ -1266,7 +1659,7 @@ class TourDiaryBot:
         user_id = message.from_user.id
         logger.info(f"handle_settings_default_purpose called for user {user_id} with text: {repr(message.text)}")
         if user_id in self.cancelled_users:
-            self.cancelled_users.remove(user_id)
+            self.cancelled_users.pop(user_id, None)
             return
         purpose = message.text.strip()
 
@@ -1290,11 +1683,7 @@ class TourDiaryBot:
             return
 
         try:
-            users_collection.update_one(
-                {'user_id': user_id},
-                {'$set': {'default_purpose': purpose}},
-                upsert=True
-            )
+            self._set_user_field(user_id, 'default_purpose', purpose)
         except Exception as e:
             logger.error(f"Error updating default purpose for user {user_id}: {e}")
             self.bot.send_message(
@@ -1326,7 +1715,7 @@ class TourDiaryBot:
         user_id = message.from_user.id
         logger.info(f"handle_settings_add_activity called for user {user_id} with text: {repr(message.text)}")
         if user_id in self.cancelled_users:
-            self.cancelled_users.remove(user_id)
+            self.cancelled_users.pop(user_id, None)
             return
         activity = message.text.strip()
 
@@ -1349,19 +1738,27 @@ class TourDiaryBot:
             )
             return
 
-        try:
-            users_collection.update_one(
-                {'user_id': user_id},
-                {'$addToSet': {'custom_activities': activity}},
-                upsert=True
-            )
-        except Exception as e:
-            logger.error(f"Error adding custom activity for user {user_id}: {e}")
-            self.bot.send_message(
-                message.chat.id,
-                "❌ Error adding activity. Please try again."
-            )
-            return
+        # Skip the write when the activity is already saved (compared case-insensitively)
+        user = self._get_user(user_id, ttl=USER_SETTINGS_CACHE_TTL)
+        already_added = activity.casefold() in {a.casefold() for a in (user or {}).get('custom_activities', [])}
+        if not already_added:
+            try:
+                # Write and read back in one round trip so the settings refresh is served from the cache
+                updated = users_collection.find_one_and_update(
+                    {'user_id': user_id},
+                    {'$addToSet': {'custom_activities': activity}},
+                    upsert=True,
+                    projection={'activities': 0},
+                    return_document=ReturnDocument.AFTER
+                )
+                self._cache_user(user_id, updated)
+            except Exception as e:
+                logger.error(f"Error adding custom activity for user {user_id}: {e}")
+                self.bot.send_message(
+                    message.chat.id,
+                    "❌ Error adding activity. Please try again."
+                )
+                return
 
         # Delete the original prompt message if present
         if user_id in self.input_prompt_message:
@@ -1372,7 +1769,7 @@ class TourDiaryBot:
             del self.input_prompt_message[user_id]
         self.bot.send_message(
             message.chat.id,
-            f"✅ Activity added: **{activity}**",
+            f"ℹ️ Activity already exists: **{activity}**" if already_added else f"✅ Activity added: **{activity}**",
             parse_mode='Markdown'
         )
 
@@ -1381,81 +1778,119 @@ class TourDiaryBot:
 
     def get_user_activities(self, user_id, month=None):
         """Get custom activities for a specific user (for purpose selection)"""
-        logger.debug(f"get_user_activities called with user_id: {user_id}, month: {month} (type: {type(month) if month is not None else None})")
-
-        # Try to find user with the given user_id
-        user = users_collection.find_one({'user_id': user_id})
-
-        # If not found, try with integer conversion (in case user_id is stored as int)
-        if not user and isinstance(user_id, str):
-            try:
-                user = users_collection.find_one({'user_id': int(user_id)})
-                logger.info(f"Found user with integer user_id: {int(user_id)}")
-            except ValueError:
-                pass
-
-        # If still not found, try with string conversion (in case user_id is stored as string)
-        if not user and isinstance(user_id, int):
-            try:
-                user = users_collection.find_one({'user_id': str(user_id)})
-                logger.info(f"Found user with string user_id: {str(user_id)}")
-            except ValueError:
-                pass
+        # user_id is stored as int (see normalize_user_ids); every write invalidates the cache
+        try:
+            user = self._get_user(int(user_id), ttl=USER_SETTINGS_CACHE_TTL)
+        except ValueError:
+            user = None
 
         if not user:
             logger.warning(f"No user found for user_id: {user_id} (type: {type(user_id)})")
             return []
 
-        # Get custom activities from settings
-        custom_activities = user.get('custom_activities', [])
-        logger.debug(f"Retrieved custom activities for user {user_id}: {custom_activities}")
-
         # If month is not provided, use current month
-        if month is None:
-            month = int(datetime.now(IST).month)
-            logger.debug(f"No month provided, using current month: {month} (type: {type(month)})")
-        else:
-            # Ensure month is an integer
-            month = int(month)
-            logger.debug(f"Using provided month: {month} (type: {type(month)})")
+        month = int(datetime.now(IST).month) if month is None else int(month)
+
+        # The merged list only depends on the custom list and the month, so it is memoized on both
+        key = (tuple(user.get('custom_activities', [])), month)
+        activities = self._user_activities_cache.get(key)
+        if activities is None:
+            main_activities = MONTH_ACTIVITIES.get(month, DEFAULT_MAIN_ACTIVITIES)
+            # Combine custom and main activities, with custom activities first; dict keys keep the order stable
+            activities = tuple(dict.fromkeys([*key[0], *main_activities]))
+            if len(self._user_activities_cache) >= UI_CACHE_MAX_ENTRIES:
+                self._user_activities_cache.clear()
+            self._user_activities_cache[key] = activities
+        return list(activities)
+
+    @staticmethod
+    def _second_saturday(day):
+        """Return the date of the second Saturday in `day`'s month"""
+        first_day = day.replace(day=1)
+        return first_day + timedelta(days=(5 - first_day.weekday()) % 7 + 7)
+
+    def _load_daily_job_users(self, year_str, month_str, today_str):
+        """Fetch users with villages and no activity on `today_str` in one projected, batched query for the scheduled jobs"""
+        query = {'villages': {'$exists': True, '$ne': []}}
+        # The month projection needs the nested layout, so migrate any legacy flat lists first
+        for doc in users_collection.find({**query, 'activities': {'$type': 'array'}}, {'user_id': 1}):
+            self.migrate_activities_structure(doc['user_id'])
+        # Let MongoDB skip users who already recorded today instead of scanning their month in Python
+        query[f'activities.{year_str}.{month_str}'] = {'$not': {'$elemMatch': {'date': today_str}}}
+        # Only the fields the jobs read; activity history is limited to the current month
+        projection = {
+            '_id': 0, 'user_id': 1, 'villages': 1, 'headquarters': 1, 'default_purpose': 1,
+            'public_holidays': 1, f'activities.{year_str}.{month_str}': 1,
+        }
+        users = list(users_collection.find(query, projection).batch_size(DAILY_JOB_BATCH_SIZE))
+        # Parse each user's holidays once so the jobs can test today with a dict lookup
+        for user in users:
+            user['_holiday_dates'] = holiday_dates(user.get('public_holidays', []))
+        return users
+
+    def _flush_default_activities(self, pending):
+        """Save queued (user_id, year, month, activity, notice) entries in one bulk_write, then notify each user"""
+        if not pending:
+            return
+        failed = set()
+        try:
+            users_collection.bulk_write([
+                UpdateOne({'user_id': user_id}, {'$push': {f'activities.{year_str}.{month_str}': activity}})
+                for user_id, year_str, month_str, activity, _ in pending
+            ], ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            failed = {err['index'] for err in e.details.get('writeErrors', [])}
+            logger.error(f"Error saving {len(failed)} of {len(pending)} default activities: {e.details.get('writeErrors')}")
+        except Exception as e:
+            logger.error(f"Error saving default activities: {e}")
+            return
 
-        # Get main activities for the specified month
-        logger.debug(f"MAIN_ACTIVITIES_BY_MONTH dictionary: {MAIN_ACTIVITIES_BY_MONTH}")
-        main_activities = MAIN_ACTIVITIES_BY_MONTH.get(month, [])
-        if not main_activities:  # If no activities found for the month, use default
-            main_activities = ["survey harvest", "seasonal conditions"]
-            logger.debug(f"No activities found for month {month}, using default activities")
-        logger.debug(f"Retrieved main activities for month {month}: {main_activities}")
+        def notify(user_id, notice):
+            try:
+                # Delete the daily prompt message if it exists
+                message_id = self._pop_daily_prompt_message_id(user_id)
+                if message_id:
+                    self._delete_messages_async(user_id, [message_id], user_id)
+                self.bot.send_message(user_id, notice, parse_mode='Markdown')
+            except Exception as e:
+                logger.error(f"Error notifying user {user_id} about default activity: {e}")
 
-        # Combine custom and main activities, with custom activities taking precedence
-        activities = list(set(custom_activities + main_activities))
-        logger.debug(f"Returning combined activities for user {user_id}: {activities}")
-        return activities
+        # Fan the notices out like daily_prompt does; RateLimitedBot keeps them within Telegram's limits
+        with ThreadPoolExecutor(max_workers=DAILY_JOB_SEND_WORKERS, thread_name_prefix='default-activity') as pool:
+            for i, (user_id, _, _, _, notice) in enumerate(pending):
+                if i in failed:
+                    continue
+                self._invalidate_user(user_id)
+                pool.submit(notify, user_id, notice)
 
     def daily_prompt(self):
         """Send daily activity prompt to all users"""
         current_time = datetime.now(IST)
+        # Per-run values, computed once instead of for every user
+        today_date = current_time.date()
+        weekday = current_time.weekday()
+        today_str = current_time.strftime('%d/%m/%Y')
         current_date = current_time.strftime('%Y-%m-%d')
+        year_str = str(current_time.year)
+        month_str = str(current_time.month)
+        current_month = current_time.month
         logger.info(f"🕰️ Daily prompt triggered at {current_time.strftime('%H:%M:%S IST')} (scheduled time: {DAILY_PROMPT_TIME})")
 
-        if current_time.weekday() == 6:
+        if weekday == 6:
             logger.info("📅 Sunday detected - skipping daily prompt (public holiday)")
             return
-        if current_time.weekday() == 5:
-            first_day = current_time.replace(day=1)
-            first_saturday = first_day + timedelta(days=(5 - first_day.weekday()) % 7)
-            second_saturday = first_saturday + timedelta(days=7)
-            if current_time.date() == second_saturday.date():
-                logger.info("📅 Second Saturday detected - skipping daily prompt (public holiday)")
-                return
+        if weekday == 5 and today_date == self._second_saturday(today_date):
+            logger.info("📅 Second Saturday detected - skipping daily prompt (public holiday)")
+            return
 
         # Get users with villages configured
-        users = users_collection.find({'villages': {'$exists': True, '$ne': []}})  #Recreate the cursor
-        user_count = users_collection.count_documents({'villages': {'$exists': True, '$ne': []}})
-        logger.info(f"🔍 Found {user_count} users with villages configured")
+        users = self._load_daily_job_users(year_str, month_str, today_str)
+        logger.info(f"🔍 Found {len(users)} users with villages and no activity recorded today")
+        outgoing = []  # (user_id, text, keyboard) prompts, sent concurrently below
+        # Every user shares this month's activity list, so draw all random purposes in one call
+        random_purposes = iter(random.choices(MONTH_ACTIVITIES[current_month], k=len(users)))
         for user in users:
             try:
-                today_str = current_time.strftime('%d/%m/%Y')
                 logger.info(f"👤 Processing user {user['user_id']} for daily prompt")
                 
                 # Check if daily prompt was already sent today for this user
@@ -1466,110 +1901,45 @@ class TourDiaryBot:
                         logger.info(f"Daily prompt already sent today for user {user_id}")
                         continue
 
-                # Migrate to new structure if needed
                 # Check if it's a user-defined public holiday today
-                is_user_holiday = False
-                for h in user.get('public_holidays', []):
-                    try:
-                        if datetime.strptime(h['date'], '%d/%m/%Y').date() == current_time.date():
-                            is_user_holiday = True
-                            logger.info(f"📅 User {user['user_id']} - Skipping daily prompt (user holiday: {h['desc']})")
-                            break
-                    except Exception:
-                        continue
-
-                if is_user_holiday:
-                    logger.info(f"📅 Skipping daily prompt for user {user['user_id']} because today is a user-defined public holiday.")
-                    continue
-
-                self.migrate_activities_structure(user['user_id'])
-
-                # Check if activity exists using new structure
-                activities = user.get('activities', {})
-                year_str = str(current_time.year)
-                month_str = str(current_time.month)
-
-                has_activity = False
-                if year_str in activities and month_str in activities[year_str]:
-                    has_activity = any(
-                        act['date'] == today_str for act in activities[year_str][month_str]
-                    )
-
-                if has_activity:
-                    logger.info(f"✅ User {user['user_id']} already has activity for today, skipping")
+                holiday_desc = user['_holiday_dates'].get(today_date)
+                if holiday_desc is not None:
+                    logger.info(f"📅 User {user['user_id']} - Skipping daily prompt (user holiday: {holiday_desc})")
                     continue
 
+                # Users who already recorded today are filtered out by the query
                 # If user has no default_purpose, select a random activity from MAIN_ACTIVITIES_BY_MONTH
                 if not user.get('default_purpose'):
                     logger.info(f"⚠️ User {user['user_id']} has no default_purpose, selecting random activity")
-                    current_month = current_time.month
                     logger.debug(f"Current month: {current_month}")
 
                     # Get activities for current month
-                    month_activities = MAIN_ACTIVITIES_BY_MONTH.get(current_month, [])
-                    if not month_activities:
-                        month_activities = ["survey harvest", "seasonal conditions"]
+                    month_activities = MONTH_ACTIVITIES[current_month]
                     logger.debug(f"Available activities for month {current_month}: {month_activities}")
 
                     # Select random activity
-                    random_purpose = random.choice(month_activities)
+                    random_purpose = next(random_purposes)
                     logger.info(f"Selected random activity for user {user['user_id']}: {random_purpose}")
 
                     # Save the random purpose as default_purpose temporarily for this activity
                     user['default_purpose'] = random_purpose
 
-                keyboard = types.InlineKeyboardMarkup()
-                # Ensure villages are proper case for display and comparison
-                villages = [v.title() for v in user.get('villages', [])]
-
-                current_month = current_time.month
-                current_year = current_time.year
-                covered_villages = set()
-
                 # Get covered villages from new structure
-                year_str = str(current_year)
-                month_str = str(current_month)
-                activities = user.get('activities', {})
-                if year_str in activities and month_str in activities[year_str]:
-                    for activity in activities[year_str][month_str]:
-                        try:
-                            activity_date = datetime.strptime(activity['date'], '%d/%m/%Y')
-                            if activity_date.month == current_month and activity_date.year == current_year:
-                                if activity.get('to_village'):
-                                    covered_villages.add(activity['to_village'].title())
-                        except ValueError:
-                            continue
+                covered_villages = {
+                    a['to_village'].title()
+                    for a in self._month_activities(user.get('activities', {}), year_str, month_str)
+                    if a.get('to_village')
+                }
 
-                available_villages = [v for v in villages if v not in covered_villages]
+                # Proper-case villages for display and comparison in one ordered pass; dict keys
+                # also drop names that only differed by case, which would otherwise repeat a button
+                available_villages = [
+                    v for v in dict.fromkeys(v.title() for v in user.get('villages', []))
+                    if v not in covered_villages
+                ]
 
                 headquarters = user.get('headquarters', 'HQ')
-                keyboard.add(
-                    types.InlineKeyboardButton(
-                        f"🏢 {headquarters.title()} (headquarters)", callback_data=f"daily_village_{headquarters.title()}"
-                    )
-                )
-
-                for i in range(0, len(available_villages), 2):
-                    row = []
-                    row.append(
-                        types.InlineKeyboardButton(
-                            available_villages[i], callback_data=f"daily_village_{available_villages[i]}"
-                        )
-                    )
-                    if i + 1 < len(available_villages):
-                        row.append(
-                            types.InlineKeyboardButton(
-                                available_villages[i + 1], callback_data=f"daily_village_{available_villages[i + 1]}"
-                            )
-                        )
-                    keyboard.add(*row)
-
-                keyboard.add(
-                    types.InlineKeyboardButton("✏️ Manual Entry", callback_data="daily_village_manual")
-                )
-                keyboard.add(
-                    types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-                )
+                keyboard = self._get_daily_village_keyboard(headquarters, available_villages)
 
                 # Prepare message based on whether purpose was randomly selected
                 purpose_explanation = (
@@ -1577,322 +1947,137 @@ class TourDiaryBot:
                     if not user.get('default_purpose') else ""
                 )
 
-                logger.info(f"📤 Sending daily prompt to user {user['user_id']} with {len(available_villages)} available villages")
-                sent_message = self.bot.send_message(
+                logger.info(f"📤 Queueing daily prompt for user {user['user_id']} with {len(available_villages)} available villages")
+                outgoing.append((
                     user['user_id'],
                     "🕰️ **Daily Activity Reminder**\n\n"
                     "Please record your tour activity for today. Select the village you visited:" +
                     purpose_explanation,
-                    reply_markup=keyboard,
-                    parse_mode='Markdown'
-                )
+                    keyboard
+                ))
+            except Exception as e:
+                logger.error(f"Error preparing daily prompt for user {user['user_id']}: {e}")
+
+        def send_prompt(user_id, text, keyboard):
+            try:
+                sent_message = self.bot.send_message(user_id, text, reply_markup=keyboard, parse_mode='Markdown')
                 # Store the message ID and date for later deletion and duplicate prevention
-                self.daily_prompt_message_ids[user['user_id']] = {
+                self.daily_prompt_message_ids[user_id] = {
                     'message_id': sent_message.message_id,
-                    'date': current_time.strftime('%Y-%m-%d')
+                    'date': current_date
                 }
             except Exception as e:
-                logger.error(f"Error sending daily prompt to user {user['user_id']}: {e}")
+                logger.error(f"Error sending daily prompt to user {user_id}: {e}")
+
+        # Fan the sends out; RateLimitedBot keeps them under Telegram's per-chat and global limits
+        with ThreadPoolExecutor(max_workers=DAILY_JOB_SEND_WORKERS, thread_name_prefix='daily-prompt') as pool:
+            for payload in outgoing:
+                pool.submit(send_prompt, *payload)
 
         logger.info(f"🏁 Daily prompt function completed")
 
     def default_activity_fallback(self):
         """Add default activity for users who didn't respond by {DEFAULT_ACTIVITY_TIME}"""
         current_time = datetime.now(IST)
+        # Per-run values, computed once instead of for every user
+        today_date = current_time.date()
+        weekday = current_time.weekday()
+        is_second_saturday = weekday == 5 and today_date == self._second_saturday(today_date)
+        today_str = current_time.strftime('%d/%m/%Y')
+        date_key = current_time.strftime('%Y%m%d')
+        year_str = str(current_time.year)
+        month_str = str(current_time.month)
+        current_month = current_time.month
         logger.info(f"🤖 Default activity fallback triggered at {current_time.strftime('%H:%M:%S IST')} (scheduled time: {DEFAULT_ACTIVITY_TIME})")
 
-        if current_time.weekday() == 6:
-            # Sunday: public holiday
-            today_str = current_time.strftime('%d/%m/%Y')
-            
+        # Sundays and second Saturdays are public holidays for everyone
+        system_holiday = None
+        if weekday == 6:
+            system_holiday, holiday_id = 'Sunday', f"sunday_{date_key}"
+        elif is_second_saturday:
+            system_holiday, holiday_id = 'Second Saturday', f"second_saturday_{date_key}"
+
+        if system_holiday:
             # First, check if this public holiday is already in the system-wide holidays collection
-            holiday_id = f"sunday_{current_time.strftime('%Y%m%d')}"
-            existing_holiday = config_collection.find_one({'_id': holiday_id})
-            
+            existing_holiday = config_collection.find_one({'_id': holiday_id}, {'_id': 1})  # Existence check only
             if not existing_holiday:
                 # Add to system holidays collection to prevent duplicate processing
                 config_collection.insert_one({
                     '_id': holiday_id,
                     'date': today_str,
-                    'desc': 'Sunday',
+                    'desc': system_holiday,
                     'type': 'system',
                     'processed': False
                 })
             elif existing_holiday.get('processed', False):
                 # Already processed this holiday
-                logger.info(f"📅 Sunday {today_str} already processed, skipping duplicate notifications")
+                logger.info(f"📅 {system_holiday} {today_str} already processed, skipping duplicate notifications")
                 return
-                
-            users = users_collection.find({'villages': {'$exists': True, '$ne': []}})
-            for user in users:
-                # Migrate to new structure if needed
-                self.migrate_activities_structure(user['user_id'])
-
-                # Check if activity exists using new structure
-                activities = user.get('activities', {})
-                year_str = str(current_time.year)
-                month_str = str(current_time.month)
-
-                has_activity = False
-                if year_str in activities and month_str in activities[year_str]:
-                    has_activity = any(
-                        act['date'] == today_str for act in activities[year_str][month_str]
-                    )
 
-                if has_activity:
-                    continue
-
-                # Try to get holiday name from user's public_holidays
-                holiday_name = None
-                for h in user.get('public_holidays', []):
-                    try:
-                        if datetime.strptime(h['date'], '%d/%m/%Y').date() == current_time.date():
-                            holiday_name = h['desc']
-                            break
-                    except Exception:
-                        continue
-
-                if holiday_name:
-                    purpose_str = f"Public holiday ({holiday_name})"
-                elif current_time.weekday() == 6:
-                    purpose_str = "Public holiday (Sunday)"
-                else:
-                    purpose_str = "Public holiday"
-
-                activity = {
-                    'date': today_str,
-                    'from': user['headquarters'] or 'HQ',
-                    'to_village': '',
-                    'purpose': purpose_str
-                }
-
-                # Save using new structure
-                users_collection.update_one(
-                    {'user_id': user['user_id']},
-                    {'$push': {f'activities.{year_str}.{month_str}': activity}}
-                )
-                self.bot.send_message(
-                    user['user_id'],
-                    f"🏖️ **Public Holiday Recorded**\n\n"
-                    f"Today is a public holiday (Sunday).\n"
-                    f"**Date:** {activity['date']}\n"
-                    f"**From:** {activity['from']}\n"
-                    f"**To:** {activity['to_village']}\n"
-                    f"**Purpose:** {activity['purpose']}\n",
-                    parse_mode='Markdown'
-                )
-            
-            # Mark as processed
-            config_collection.update_one(
-                {'_id': holiday_id},
-                {'$set': {'processed': True}}
-            )
-            return
-        if current_time.weekday() == 5:
-            # Check for second Saturday
-            first_day = current_time.replace(day=1)
-            first_saturday = first_day + timedelta(days=(5 - first_day.weekday()) % 7)
-            second_saturday = first_saturday + timedelta(days=7)
-            if current_time.date() == second_saturday.date():
-                today_str = current_time.strftime('%d/%m/%Y')
-                
-                # First, check if this public holiday is already in the system-wide holidays collection
-                holiday_id = f"second_saturday_{current_time.strftime('%Y%m%d')}"
-                existing_holiday = config_collection.find_one({'_id': holiday_id})
-                
-                if not existing_holiday:
-                    # Add to system holidays collection to prevent duplicate processing
-                    config_collection.insert_one({
-                        '_id': holiday_id,
-                        'date': today_str,
-                        'desc': 'Second Saturday',
-                        'type': 'system',
-                        'processed': False
-                    })
-                elif existing_holiday.get('processed', False):
-                    # Already processed this holiday
-                    logger.info(f"📅 Second Saturday {today_str} already processed, skipping duplicate notifications")
-                    return
-                    
-                users = users_collection.find({'villages': {'$exists': True, '$ne': []}})
-                for user in users:
-                    # Migrate to new structure if needed
-                    self.migrate_activities_structure(user['user_id'])
-
-                    # Check if activity exists using new structure
-                    activities = user.get('activities', {})
-                    year_str = str(current_time.year)
-                    month_str = str(current_time.month)
-
-                    has_activity = False
-                    if year_str in activities and month_str in activities[year_str]:
-                        has_activity = any(
-                            act['date'] == today_str for act in activities[year_str][month_str]
-                        )
-
-                    if has_activity:
-                        continue
-
-                    # Try to get holiday name from user's public_holidays
-                    holiday_name = None
-                    for h in user.get('public_holidays', []):
-                        try:
-                            if datetime.strptime(h['date'], '%d/%m/%Y').date() == current_time.date():
-                                holiday_name = h['desc']
-                                break
-                        except Exception:
-                            continue
-
-                    if holiday_name:
-                        purpose_str = f"Public holiday ({holiday_name})"
-                    elif current_time.weekday() == 6:
-                        purpose_str = "Public holiday (Sunday)"
-                    elif current_time.weekday() == 5 and current_time.date() == second_saturday.date():
-                        purpose_str = "Public holiday (Second Saturday)"
-                    else:
-                        purpose_str = "Public holiday"
-
-                    activity = {
-                        'date': today_str,
-                        'from': user['headquarters'] or 'HQ',
-                        'to_village': '',
-                        'purpose': purpose_str
-                    }
-
-                    # Save using new structure
-                    users_collection.update_one(
-                        {'user_id': user['user_id']},
-                        {'$push': {f'activities.{year_str}.{month_str}': activity}}
-                    )
-                    self.bot.send_message(
-                        user['user_id'],
-                        f"🏖️ **Public Holiday Recorded**\n\n"
-                        f"Today is a public holiday (Second Saturday).\n"
-                        f"**Date:** {activity['date']}\n"
-                        f"**From:** {activity['from']}\n"
-                        f"**To:** {activity['to_village']}\n"
-                        f"**Purpose:** {activity['purpose']}\n",
-                        parse_mode='Markdown'
-                    )
-                
-                # Mark as processed
-                config_collection.update_one(
-                    {'_id': holiday_id},
-                    {'$set': {'processed': True}}
-                )
-                return
-
-        # Regular weekday default activity
-        today_str = current_time.strftime('%d/%m/%Y')
-        users = users_collection.find({'villages': {'$exists': True, '$ne': []}})
-        for user in users:
-            try:
-                # Migrate to new structure if needed
-                self.migrate_activities_structure(user['user_id'])
-
-                # Check if activity exists using new structure
-                activities = user.get('activities', {})
-                year_str = str(current_time.year)
-                month_str = str(current_time.month)
-
-                has_activity = False
-                if year_str in activities and month_str in activities[year_str]:
-                    has_activity = any(
-                        act['date'] == today_str for act in activities[year_str][month_str]
-                    )
-
-                if has_activity:
-                    continue
-                    
-                # Check if it's a user-defined public holiday today
-                is_user_holiday = False
-                holiday_desc = None
-                for h in user.get('public_holidays', []):
-                    try:
-                        if datetime.strptime(h['date'], '%d/%m/%Y').date() == current_time.date():
-                            is_user_holiday = True
-                            holiday_desc = h['desc']
-                            logger.info(f"📅 User {user['user_id']} - Checking user holiday: {h['desc']}")
-                            break
-                    except Exception:
-                        continue
-                
-                if is_user_holiday:
-                    # Check if this holiday has already been processed for this user
-                    holiday_id = f"user_{user['user_id']}_holiday_{current_time.strftime('%Y%m%d')}"
-                    existing_holiday = config_collection.find_one({'_id': holiday_id})
-                    
-                    if not existing_holiday:
-                        # Record the holiday in MongoDB to prevent duplicate processing
-                        config_collection.insert_one({
-                            '_id': holiday_id,
-                            'user_id': user['user_id'],
-                            'date': today_str,
-                            'desc': holiday_desc,
-                            'processed': True
-                        })
-                        
-                        # Also record the holiday in the user's activities
-                        purpose_str = f"Public holiday ({holiday_desc})"
-                        activity = {
-                            'date': today_str,
-                            'from': user['headquarters'] or 'HQ',
-                            'to_village': '',
-                            'purpose': purpose_str
-                        }
-                        
-                        # Save using new structure
-                        users_collection.update_one(
-                            {'user_id': user['user_id']},
-                            {'$push': {f'activities.{year_str}.{month_str}': activity}}
-                        )
-                        
-                        # Send notification to user
-                        self.bot.send_message(
-                            user['user_id'],
-                            f"🏖️ **Public Holiday Recorded**\n\n"
-                            f"Today is a public holiday ({holiday_desc}).\n"
-                            f"**Date:** {activity['date']}\n"
-                            f"**From:** {activity['from']}\n"
-                            f"**To:** {activity['to_village']}\n"
-                            f"**Purpose:** {activity['purpose']}\n",
-                            parse_mode='Markdown'
-                        )
-                        
-                        logger.info(f"📅 Recorded public holiday for user {user['user_id']} because today is a user-defined public holiday: {holiday_desc}")
-                    else:
-                        logger.info(f"📅 Already processed holiday {holiday_desc} for user {user['user_id']} today, skipping duplicate notification.")
+        pending = []
+        # Users who already recorded today are filtered out by the query
+        users = self._load_daily_job_users(year_str, month_str, today_str)
+        # Every user shares this month's activity list, so draw all random purposes in one call
+        random_purposes = iter(random.choices(MONTH_ACTIVITIES[current_month], k=len(users)))
+        for user in users:
+            try:
+                # Check if it's a user-defined public holiday today
+                holiday_desc = user['_holiday_dates'].get(today_date)
+                if system_holiday or holiday_desc is not None:
+                    if not system_holiday:
+                        logger.info(f"📅 User {user['user_id']} - Checking user holiday: {holiday_desc}")
+                        # Check if this holiday has already been processed for this user
+                        user_holiday_id = f"user_{user['user_id']}_holiday_{date_key}"
+                        if config_collection.find_one({'_id': user_holiday_id}, {'_id': 1}):
+                            logger.info(f"📅 Already processed holiday {holiday_desc} for user {user['user_id']} today, skipping duplicate notification.")
+                            continue
+                        # Record the holiday in MongoDB to prevent duplicate processing
+                        config_collection.insert_one({
+                            '_id': user_holiday_id,
+                            'user_id': user['user_id'],
+                            'date': today_str,
+                            'desc': holiday_desc,
+                            'processed': True
+                        })
+                        logger.info(f"📅 Recording public holiday for user {user['user_id']} because today is a user-defined public holiday: {holiday_desc}")
+
+                    # A user's own holiday name takes precedence in the purpose
+                    activity = {
+                        'date': today_str,
+                        'from': user['headquarters'] or 'HQ',
+                        'to_village': '',
+                        'purpose': f"Public holiday ({holiday_desc or system_holiday})"
+                    }
+                    # Saved with the other default activities in one bulk_write below
+                    pending.append((
+                        user['user_id'], year_str, month_str, activity,
+                        f"🏖️ **Public Holiday Recorded**\n\n"
+                        f"Today is a public holiday ({system_holiday or holiday_desc}).\n"
+                        f"**Date:** {activity['date']}\n"
+                        f"**From:** {activity['from']}\n"
+                        f"**To:** {activity['to_village']}\n"
+                        f"**Purpose:** {activity['purpose']}\n"
+                    ))
                     continue
 
                 # If user has no default_purpose, select a random activity from MAIN_ACTIVITIES_BY_MONTH
                 if not user.get('default_purpose'):
                     logger.info(f"User {user['user_id']} has no default_purpose at {DEFAULT_ACTIVITY_TIME}, selecting random activity")
-                    current_month = current_time.month
                     logger.debug(f"Current month: {current_month}")
 
                     # Get activities for current month
-                    month_activities = MAIN_ACTIVITIES_BY_MONTH.get(current_month, [])
-                    if not month_activities:
-                        month_activities = ["survey harvest", "seasonal conditions"]
+                    month_activities = MONTH_ACTIVITIES[current_month]
                     logger.debug(f"Available activities for month {current_month}: {month_activities}")
 
                     # Select random activity
-                    default_purpose = random.choice(month_activities)
+                    default_purpose = next(random_purposes)
                     logger.info(f"Selected random activity for user {user['user_id']}: {default_purpose}")
                 else:
                     default_purpose = user['default_purpose']
 
-                current_month = current_time.month
-                current_year = current_time.year
-                used_villages = set()
-                month_activities = []
-
-                # Get used villages and all activities for the month from new structure
-                if year_str in activities and month_str in activities[year_str]:
-                    month_activities = activities[year_str][month_str]
-                    for activity in month_activities:
-                        if activity.get('to_village'):
-                            used_villages.add(activity['to_village'])
+                # Get used villages and all activities for the month from new structure, traversing it once
+                month_activities = user.get('activities', {}).get(year_str, {}).get(month_str, [])
+                used_villages = {a['to_village'] for a in month_activities if a.get('to_village')}
 
                 villages = user.get('villages', [])
                 available_villages = [v for v in villages if v not in used_villages]
@@ -1904,9 +2089,8 @@ class TourDiaryBot:
                     
                     # Try to avoid picking the same village as the last recorded one
                     if month_activities:
-                        # Sort by date to find the most recent activity
-                        sorted_activities = self._sort_activities_by_date(month_activities)
-                        last_village = sorted_activities[-1].get('to_village')
+                        # Only the most recent activity is needed, so a linear max() beats a full sort
+                        last_village = max(month_activities, key=self._activity_date_key).get('to_village')
                         
                         # If there's a last village and more than one village in total
                         if last_village and len(selection_pool) > 1:
@@ -1929,29 +2113,6 @@ class TourDiaryBot:
                     'purpose': default_purpose
                 }
 
-                # Save using new structure
-                users_collection.update_one(
-                    {'user_id': user['user_id']},
-                    {'$push': {f'activities.{year_str}.{month_str}': activity}}
-                )
-
-                # Delete the daily prompt message if it exists
-                if user['user_id'] in self.daily_prompt_message_ids:
-                    try:
-                        msg_info = self.daily_prompt_message_ids[user['user_id']]
-                        if isinstance(msg_info, dict):
-                            message_id = msg_info['message_id']
-                        else:
-                            # Handle legacy format where only message_id was stored
-                            message_id = msg_info
-
-                        self.bot.delete_message(user['user_id'], message_id)
-
-                        logger.info(f"🗑️ Deleted daily prompt message for user {user['user_id']}")
-                        del self.daily_prompt_message_ids[user['user_id']]
-                    except Exception as e:
-                        logger.error(f"Error deleting daily prompt message for user {user['user_id']}: {e}")
-
                 # Prepare message based on whether purpose was randomly selected
                 purpose_explanation = (
                     "Since you havent added activity manually..."
@@ -1959,52 +2120,74 @@ class TourDiaryBot:
                     f"Since you didn't record an activity by {DEFAULT_ACTIVITY_TIME}, I've added a default entry."
                 )
 
-                self.bot.send_message(
-                    user['user_id'],
+                pending.append((
+                    user['user_id'], year_str, month_str, activity,
                     f"🤖 **Default Activity Recorded**\n\n"
                     f"{purpose_explanation}\n\n"
                     f"**Date:** {activity['date']}\n"
                     f"**From:** {activity['from']}\n"
                     f"**To:** {activity['to_village']}\n"
                     f"**Purpose:** {activity['purpose']}\n\n"
-                    f"You can update this using /act command if needed.",
-                    parse_mode='Markdown'
-                )
+                    f"You can update this using /act command if needed."
+                ))
             except Exception as e:
                 logger.error(f"Error adding default activity for user {user['user_id']}: {e}")
 
+        self._flush_default_activities(pending)
+
+        if system_holiday:
+            # Mark as processed
+            config_collection.update_one(
+                {'_id': holiday_id},
+                {'$set': {'processed': True}}
+            )
+
+    @staticmethod
+    def _next_run_time(time_str, now):
+        """Return the next IST datetime after `now` matching HH:MM `time_str`."""
+        hour, minute = map(int, time_str.split(':'))
+        run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if run_at <= now:
+            run_at += timedelta(days=1)
+        return run_at
+
     def schedule_daily_tasks(self):
-        """Schedule daily tasks using the schedule library"""
+        """Run daily tasks from a timer thread that sleeps until the next fire time"""
+        global DAILY_PROMPT_TIME, DEFAULT_ACTIVITY_TIME
         logger.info(f"📅 Setting up schedule: Daily prompt at {DAILY_PROMPT_TIME}, Default activity at {DEFAULT_ACTIVITY_TIME}")
-        try:
-            schedule.every().day.at(DAILY_PROMPT_TIME).do(self.daily_prompt)
-            schedule.every().day.at(DEFAULT_ACTIVITY_TIME).do(self.default_activity_fallback)
-            logger.info("✅ Schedule setup completed successfully")
-        except Exception as e:
-            logger.error(f"❌ Error setting up schedule: {e}")
-            # Fallback to hardcoded times if variables fail
+        if not (self._is_valid_time_format(DAILY_PROMPT_TIME) and self._is_valid_time_format(DEFAULT_ACTIVITY_TIME)):
+            logger.error(f"❌ Invalid schedule times: {DAILY_PROMPT_TIME}, {DEFAULT_ACTIVITY_TIME}")
+            # Fallback to hardcoded times if variables are invalid
             logger.info("🔄 Using fallback hardcoded times")
-            schedule.every().day.at("19:00").do(self.daily_prompt)
-            schedule.every().day.at("20:00").do(self.default_activity_fallback)
+            DAILY_PROMPT_TIME, DEFAULT_ACTIVITY_TIME = "19:00", "20:00"
 
         def run_schedule():
-            logger.info("🔄 Schedule thread started - checking for pending tasks every 30 seconds")
+            logger.info("🔄 Schedule thread started - sleeping until the next scheduled task")
             while True:
                 try:
-                    current_time = datetime.now(IST)
-                    current_time_str = current_time.strftime('%H:%M')
-                    # Ensure consistent format for schedule check messages
-                    logger.debug(f"🕰️ Schedule check at {current_time.strftime('%H:%M:%S IST')}")
-
-                    # Check if current time matches any scheduled times (ignoring seconds)
-                    if current_time_str == DAILY_PROMPT_TIME:
-                        logger.info(f"⏰ Daily prompt time matched: {current_time_str}")
-                        self.daily_prompt()
-                    elif current_time_str == DEFAULT_ACTIVITY_TIME:
-                        logger.info(f"⏰ Default activity time matched: {current_time_str}")
-                        self.default_activity_fallback()
+                    now = datetime.now(IST)
+                    jobs = [
+                        (self._next_run_time(DAILY_PROMPT_TIME, now), "Daily prompt", self.daily_prompt),
+                        (self._next_run_time(DEFAULT_ACTIVITY_TIME, now), "Default activity", self.default_activity_fallback),
+                    ]
+                    run_at = min(job[0] for job in jobs)
+                    # Jobs sharing a fire time run back to back instead of the later one slipping a day
+                    due = [(name, task) for job_time, name, task in jobs if job_time == run_at]
+                    logger.info(f"⏳ Next task: {', '.join(name for name, _ in due)} at {run_at.strftime('%Y-%m-%d %H:%M IST')}")
+
+                    # Woken early when the owner changes a schedule time
+                    if self._schedule_changed.wait((run_at - now).total_seconds()):
+                        self._schedule_changed.clear()
+                        continue
+                    if datetime.now(IST) < run_at:
+                        continue
 
-                    time.sleep(30)
+                    for name, task in due:
+                        logger.info(f"⏰ {name} time reached: {run_at.strftime('%H:%M')}")
+                        try:
+                            task()
+                        except Exception as e:
+                            logger.error(f"Error running {name}: {e}")
                 except Exception as e:
                     logger.error(f"Error in schedule thread: {e}")
                     time.sleep(30)
@@ -2035,15 +2218,17 @@ class TourDiaryBot:
         @self.bot.message_handler(content_types=['document'])
         def handle_docs(message):
             user_id = message.from_user.id
-            if self.callback_data.get(user_id, {}).get('awaiting_holiday_upload'):
+            # Clear the flag before processing: the upload may outlive the state's TTL.
+            # Only the flag check is locked; the download and parse run outside it
+            with self._user_lock(user_id):
+                state = self.callback_data.get(user_id, {})
+                holiday = state.pop('awaiting_holiday_upload', None)
+                village = not holiday and state.pop('awaiting_village_upload', None)
+            if holiday:
                 self.handle_holiday_file_upload(message)
-                self.callback_data[user_id].pop('awaiting_holiday_upload', None)
-            elif self.callback_data.get(user_id, {}).get('awaiting_village_upload'):
+            elif village:
                 self.handle_file_upload(message)
-                self.callback_data[user_id].pop('awaiting_village_upload', None)
-            else:
-                # User is not in a file upload flow, keep silent
-                return
+            # Otherwise the user is not in a file upload flow, keep silent
 
         @self.bot.message_handler(commands=['td'])
         def td_month(message):
@@ -2059,1182 +2244,968 @@ class TourDiaryBot:
             if str(user_id) != str(OWNER_ID):
                 self.bot.reply_to(message, "❌ You are not authorized to access logs.")
                 return
-            try:
-                with open('logs.txt', 'rb') as f:
-                    self.bot.send_document(message.chat.id, f, caption="📝 logs.txt")
-            except FileNotFoundError:
-                self.bot.reply_to(message, "No logs available yet.")
-            except Exception as e:
-                self.bot.reply_to(message, f"❌ Could not send logs.txt: {e}")
+            # The upload can take seconds, so it runs off the handler thread
+            self._tg_pool.submit(self._upload_logs, message)
 
         @self.bot.message_handler(commands=['activities'])
         def activities_cmd(message):
             self.show_activities_years(message)
 
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith(('activities_', 'delete_activity_', 'confirm_delete_')) or (call.data == 'cancel_selection' and hasattr(call.message, 'text') and '📅' in call.message.text))
-        def activities_callback(call):
-            user_id = call.from_user.id
-            if call.data == 'cancel_selection':
-                try:
-                    self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                except Exception as e:
-                    logger.error(f"Error deleting activities message: {e}")
-            elif call.data.startswith('activities_year_'):
-                year = call.data.split('_')[2]
-                self.show_activities_months(call, year)
-            elif call.data.startswith('activities_month_'):
-                _, _, year, month = call.data.split('_')
-                self.show_activities_dates(call, year, month)
-            elif call.data.startswith('delete_activity_'):
-                try:
-                    _, _, year, month, index = call.data.split('_')
-                    index = int(index)
-                    user = users_collection.find_one({'user_id': user_id})
-                    activities = user.get('activities', {})
-                    month_activities = activities.get(year, {}).get(month, [])
-                    if 0 <= index < len(month_activities):
-                        month_activities = sorted(month_activities, key=lambda a: datetime.strptime(a['date'], '%d/%m/%Y'))
-                        activity = month_activities[index]
-                        keyboard = types.InlineKeyboardMarkup(row_width=2)
-                        keyboard.add(
-                            types.InlineKeyboardButton("✅ Yes", callback_data=f"confirm_delete_{year}_{month}_{index}"),
-                            types.InlineKeyboardButton("❌ No", callback_data=f"activities_month_{year}_{month}")
-                        )
-                        msg = f"Are you sure you want to delete this activity?\n\n{activity['date']}: {activity.get('to_village','')} - {activity.get('purpose','')}\n"
-                        self.bot.edit_message_text(msg, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
-                    else:
-                        self.bot.answer_callback_query(call.id, "❌ Invalid activity index")
-                except Exception as e:
-                    logger.error(f"Error preparing delete confirmation: {e}")
-                    self.bot.answer_callback_query(call.id, "❌ Error preparing delete confirmation")
-            elif call.data.startswith('confirm_delete_'):
-                try:
-                    _, _, year, month, index = call.data.split('_')
-                    index = int(index)
-                    user = users_collection.find_one({'user_id': user_id})
-                    activities = user.get('activities', {})
-                    month_activities = activities.get(year, {}).get(month, [])
-                    if 0 <= index < len(month_activities):
-                        month_activities = sorted(month_activities, key=lambda a: datetime.strptime(a['date'], '%d/%m/%Y'))
-                        deleted_activity = month_activities.pop(index)
-                        activities[year][month] = month_activities
-                        if not month_activities:
-                            del activities[year][month]
-                            if not activities[year]:
-                                del activities[year]
-                        users_collection.update_one(
-                            {'user_id': user_id},
-                            {'$set': {'activities': activities}}
-                        )
-                        self.show_activities_dates(call, year, month)
-                        self.bot.answer_callback_query(call.id, f"✅ Activity deleted: {deleted_activity['date']}")
-                    else:
-                        self.bot.answer_callback_query(call.id, "❌ Invalid activity index")
-                except Exception as e:
-                    logger.error(f"Error deleting activity: {e}")
-                    self.bot.answer_callback_query(call.id, "❌ Error deleting activity")
-
-        self.callback_data = {}
+        # Exact callback keys, then the one/two-token prefix families that carry a payload
+        callback_routes = {
+            'settings_cancel': self._cb_cancel,
+            'cancel_selection': self._cb_cancel_selection,
+            'settings_activities': self._cb_settings_activities,
+            'settings_remove_activity': self._cb_settings_remove_activity,
+            'settings_add_activity': self._cb_settings_add_activity,
+            'settings_remove_village': self._cb_settings_remove_village,
+            'settings_setrole': self._cb_settings_setrole,
+            'settings_sethq': self._cb_settings_sethq,
+            'settings_addvil': self._cb_settings_addvil,
+            'settings_add_village': self._cb_settings_add_village,
+            'settings_upload_villages': self._cb_settings_upload_villages,
+            'settings_default_purpose': self._cb_settings_default_purpose,
+            'settings_change_default_purpose': self._cb_settings_change_default_purpose,
+            'owner_set_prompt_time': self._cb_owner_set_prompt_time,
+            'owner_set_fallback_time': self._cb_owner_set_fallback_time,
+            'settings_delete_default_purpose': self._cb_settings_delete_default_purpose,
+            'settings_upload_holidays': self._cb_settings_upload_holidays,
+        }
+        callback_prefix_routes = {
+            'activities_year': self._cb_activities_year,
+            'activities_month': self._cb_activities_month,
+            'delete_activity': self._cb_delete_activity,
+            'confirm_delete': self._cb_confirm_delete,
+            'remove_activity': self._cb_remove_activity_idx,
+            'remove_village': self._cb_remove_village_idx,
+            'purpose': self._cb_purpose,
+            'village': self._cb_village,
+            'daily_village': self._cb_daily_village,
+            'daily_purpose': self._cb_daily_purpose,
+        }
+        # Handlers that answer the query themselves (a toast on errors, a plain acknowledgement otherwise);
+        # every other route is acknowledged up front
+        self_answering = {self._cb_delete_activity, self._cb_confirm_delete, self._cb_purpose, self._cb_daily_purpose}
 
         @self.bot.callback_query_handler(func=lambda call: True)
         def callback_query(call):
             user_id = call.from_user.id
             logger.info(f"Callback query from user {user_id}: {call.data}")
-
-            # Remove the try: line here if it is not followed by except/finally
-            # Unified cancel handling for both settings and selection
-            if call.data in ('settings_cancel', 'cancel_selection'):
-                logger.info(f"User {user_id} cancelled operation via {call.data}")
-                if user_id in self.callback_data:
-                    del self.callback_data[user_id]
-                    logger.info(f"Cleaned up callback_data for user {user_id}")
-                
-                # Store the message ID before clearing input_prompt_message
-                prompt_message_id = None
-                if user_id in self.input_prompt_message:
-                    prompt_message_id = self.input_prompt_message[user_id]
-                    logger.info(f"Storing prompt_message_id {prompt_message_id} for user {user_id} before removal")
-                    del self.input_prompt_message[user_id]
-                
-                self.cancelled_users.add(user_id)  # Mark user as cancelled
-                
-                # Clear any pending next step handlers for this user
-                try:
-                    self.bot.clear_step_handler_by_chat_id(call.message.chat.id)
-                    logger.info(f"Cleared step handlers for user {user_id}")
-                except Exception as e:
-                    logger.error(f"Error clearing step handlers for user {user_id}: {e}")
-                
-                # Try to remove the inline keyboard (buttons) after cancelling
-                try:
-                    self.bot.edit_message_reply_markup(
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=None
-                    )
-                except Exception as e:
-                    logger.error(f"Error removing inline keyboard after cancel for user {user_id}: {e}")
-                
-                # Try to edit the message text, if it fails, send a new message
-                try:
-                    self.bot.edit_message_text(
-                        "❌ Operation cancelled.",
-                        call.message.chat.id,
-                        call.message.message_id
-                    )
-                    logger.info(f"Successfully edited message text to 'Operation cancelled' for user {user_id}")
-                except Exception as e:
-                    logger.error(f"Error editing message text for cancel for user {user_id}: {e}")
-                    # Send a new message if editing fails
-                    self.bot.send_message(
-                        call.message.chat.id,
-                        "❌ Operation cancelled."
-                    )
-                    logger.info(f"Sent new 'Operation cancelled' message for user {user_id}")
-                
-                # If we have a stored prompt message ID and it's different from the current message,
-                # try to delete it to ensure it doesn't remain on screen
-                if prompt_message_id and prompt_message_id != call.message.message_id:
-                    try:
-                        logger.info(f"Attempting to delete prompt message {prompt_message_id} for user {user_id}")
-                        self.bot.delete_message(call.message.chat.id, prompt_message_id)
-                    except Exception as e:
-                        logger.error(f"Error deleting prompt message for user {user_id}: {e}")
+            handler = callback_routes.get(call.data)
+            if handler is None:
+                parts = call.data.split('_', 2)
+                handler = callback_prefix_routes.get('_'.join(parts[:2])) or callback_prefix_routes.get(parts[0])
+            if handler is None:
+                logger.warning(f"Unhandled callback data from user {user_id}: {call.data}")
                 return
-            # --- Store prompt message_id for input requests sent via edit_message_text ---
-            if call.data == 'settings_activities':
-                logger.info(f"settings_activities callback for user {user_id}")
-                user = users_collection.find_one({'user_id': user_id})
-                activities = user.get('custom_activities', []) if user else []
-                activities_text = (
-                    '\n'.join([f"{i+1}. {a}" for i, a in enumerate(activities)])
-                    if activities else 'No custom activities defined.'
-                )
-                keyboard = types.InlineKeyboardMarkup()
+            if handler not in self_answering:
+                # Clear the button's loading spinner right away instead of after the Mongo/UI work
+                self._tg_pool.submit(self._answer_callback, call)
+            with self._user_lock(user_id):
+                handler(call, user_id)
+
+    def _answer_callback(self, call):
+        try:
+            self.bot.answer_callback_query(call.id)
+        except Exception as e:
+            logger.error(f"Error answering callback query for user {call.from_user.id}: {e}")
+
+    def _cb_cancel_selection(self, call, user_id):
+        # Cancel on the /activities browser just closes it; elsewhere it cancels the pending flow
+        text = getattr(call.message, 'text', None)
+        if text and '📅' in text:
+            try:
+                self.bot.delete_message(call.message.chat.id, call.message.message_id)
+            except Exception as e:
+                logger.error(f"Error deleting activities message: {e}")
+            return
+        self._cb_cancel(call, user_id)
+
+    def _cb_activities_year(self, call, user_id):
+        year = call.data.split('_')[2]
+        self.show_activities_months(call, year)
+
+    def _cb_activities_month(self, call, user_id):
+        _, _, year, month = call.data.split('_')
+        self.show_activities_dates(call, year, month)
+
+    def _cb_delete_activity(self, call, user_id):
+        """Ask to confirm deleting the activity picked in the /activities view"""
+        try:
+            _, _, year, month, date_str = call.data.split('_', 4)
+            activity = self._get_activity(user_id, year, month, date_str)
+            if activity:
+                keyboard = types.InlineKeyboardMarkup(row_width=2)
                 keyboard.add(
-                    types.InlineKeyboardButton("➕ Add Activity", callback_data="settings_add_activity")
+                    # The date identifies the activity within its month, so the delete needs no re-read
+                    types.InlineKeyboardButton("✅ Yes", callback_data=f"confirm_delete_{year}_{month}_{activity['date']}"),
+                    types.InlineKeyboardButton("❌ No", callback_data=f"activities_month_{year}_{month}")
                 )
-                if activities:
-                    keyboard.add(
-                        types.InlineKeyboardButton("🗑️ Remove Activity", callback_data="settings_remove_activity")
-                    )
-                keyboard.add(
-                    types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
+                msg = f"Are you sure you want to delete this activity?\n\n{activity['date']}: {activity.get('to_village','')} - {activity.get('purpose','')}\n"
+                self.bot.edit_message_text(msg, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+                self._tg_pool.submit(self._answer_callback, call)
+            else:
+                self.bot.answer_callback_query(call.id, "❌ Activity not found")
+        except Exception as e:
+            logger.error(f"Error preparing delete confirmation: {e}")
+            self.bot.answer_callback_query(call.id, "❌ Error preparing delete confirmation")
+
+    def _cb_confirm_delete(self, call, user_id):
+        """Delete the confirmed activity and redraw its month"""
+        try:
+            _, _, year, month, date_str = call.data.split('_', 4)
+            path = f'activities.{year}.{month}'
+            # Pull the activity server-side and get back only what is left of its month
+            user = users_collection.find_one_and_update(
+                {'user_id': user_id, f'{path}.date': date_str},
+                {'$pull': {path: {'date': date_str}}},
+                projection={path: 1, '_id': 0},
+                return_document=ReturnDocument.AFTER
+            )
+            if user is not None:
+                if not user.get('activities', {}).get(year, {}).get(month):
+                    # Drop the now-empty month, then the year if that was its last month;
+                    # the guards keep a concurrent save from being unset
+                    users_collection.update_one({'user_id': user_id, path: {'$size': 0}}, {'$unset': {path: ''}})
+                    users_collection.update_one({'user_id': user_id, f'activities.{year}': {}}, {'$unset': {f'activities.{year}': ''}})
+                self._invalidate_user(user_id)
+                self.show_activities_dates(call, year, month)
+                self.bot.answer_callback_query(call.id, f"✅ Activity deleted: {date_str}")
+            else:
+                self.bot.answer_callback_query(call.id, "❌ Activity not found")
+        except Exception as e:
+            logger.error(f"Error deleting activity: {e}")
+            self.bot.answer_callback_query(call.id, "❌ Error deleting activity")
+
+    def _cb_cancel(self, call, user_id):
+        """Cancel the pending settings or selection flow"""
+        logger.info(f"User {user_id} cancelled operation via {call.data}")
+        if user_id in self.callback_data:
+            del self.callback_data[user_id]
+            logger.info(f"Cleaned up callback_data for user {user_id}")
+
+        # Store the message ID before clearing input_prompt_message
+        prompt_message_id = None
+        if user_id in self.input_prompt_message:
+            prompt_message_id = self.input_prompt_message[user_id]
+            logger.info(f"Storing prompt_message_id {prompt_message_id} for user {user_id} before removal")
+            del self.input_prompt_message[user_id]
+
+        if user_id in self.owner_input_state:
+            self._finish_owner_time_input(user_id)
+
+        # Clear any pending next step handlers for this user
+        try:
+            self.bot.clear_step_handler_by_chat_id(call.message.chat.id)
+            logger.info(f"Cleared step handlers for user {user_id}")
+        except Exception as e:
+            logger.error(f"Error clearing step handlers for user {user_id}: {e}")
+            # The handler is still waiting; mark the user so it ignores the next reply
+            self.cancelled_users[user_id] = True
+
+        # Replace the text and drop the inline keyboard in a single edit; if it fails, send a new message
+        try:
+            self.bot.edit_message_text(
+                "❌ Operation cancelled.",
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=None
+            )
+            logger.info(f"Successfully edited message text to 'Operation cancelled' for user {user_id}")
+        except Exception as e:
+            logger.error(f"Error editing message text for cancel for user {user_id}: {e}")
+            # Send a new message if editing fails
+            self.bot.send_message(
+                call.message.chat.id,
+                "❌ Operation cancelled."
+            )
+            logger.info(f"Sent new 'Operation cancelled' message for user {user_id}")
+
+        # If we have a stored prompt message ID and it's different from the current message,
+        # try to delete it to ensure it doesn't remain on screen
+        if prompt_message_id and prompt_message_id != call.message.message_id:
+            try:
+                logger.info(f"Attempting to delete prompt message {prompt_message_id} for user {user_id}")
+                self.bot.delete_message(call.message.chat.id, prompt_message_id)
+            except Exception as e:
+                logger.error(f"Error deleting prompt message for user {user_id}: {e}")
+
+    def _cb_settings_activities(self, call, user_id):
+        logger.info(f"settings_activities callback for user {user_id}")
+        user = self._get_user(user_id)
+        activities = user.get('custom_activities', []) if user else []
+        activities_text, keyboard = self._get_activities_menu(activities)
+        self.bot.edit_message_text(
+            f"📝 **Your Custom Activities:**\n\n{activities_text}\n\nYou can add or remove activities.",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard,
+            parse_mode='Markdown'
+        )
+
+    def _cb_settings_remove_activity(self, call, user_id):
+        logger.info(f"settings_remove_activity callback for user {user_id}")
+        user = self._get_user(user_id)
+        activities = user.get('custom_activities', []) if user else []
+        if not activities:
+            self.bot.edit_message_text(
+                "❌ No activities to remove.",
+                call.message.chat.id,
+                call.message.message_id
+            )
+            return
+        keyboard = self._get_remove_menu('activity', activities)
+        try:
+            self.bot.edit_message_text(
+                "🗑️ Select an activity to remove:",
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=keyboard
+            )
+        except Exception as e:
+            logger.error(f"Failed to edit message for remove_activity for user {user_id}: {e}")
+            self.bot.send_message(
+                call.message.chat.id,
+                "🗑️ Select an activity to remove:",
+                reply_markup=keyboard
+            )
+
+    def _cb_remove_activity_idx(self, call, user_id):
+        logger.info(f"Processing remove_activity_idx_ for user {user_id}: callback_data='{call.data}'")
+        try:
+            activity_idx = int(call.data.rpartition('_')[2])
+            logger.info(f"Parsed activity_idx: {activity_idx}")
+            user = self._get_user(user_id)
+            if not user:
+                logger.error(f"No user found for user_id {user_id}")
+                self.bot.edit_message_text(
+                    "❌ User data not found. Please try again.",
+                    call.message.chat.id,
+                    call.message.message_id
                 )
+                return
+            activities = user.get('custom_activities', [])
+            logger.info(f"User activities: {activities}")
+            if not activities:
+                logger.warning(f"No activities to remove for user {user_id}")
                 self.bot.edit_message_text(
-                    f"📝 **Your Custom Activities:**\n\n{activities_text}\n\nYou can add or remove activities.",
+                    "❌ No activities to remove.",
                     call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=keyboard,
-                    parse_mode='Markdown'
+                    call.message.message_id
                 )
                 return
-            if call.data == 'settings_remove_activity':
-                logger.info(f"settings_remove_activity callback for user {user_id}")
-                user = users_collection.find_one({'user_id': user_id})
-                activities = user.get('custom_activities', []) if user else []
-                if not activities:
-                    self.bot.edit_message_text(
-                        "❌ No activities to remove.",
-                        call.message.chat.id,
-                        call.message.message_id
-                    )
-                    return
-                keyboard = types.InlineKeyboardMarkup()
-                for i, a in enumerate(activities):
-                    logger.info(f"Creating button for activity '{a}' at index {i}")
-                    keyboard.add(
-                        types.InlineKeyboardButton(f"🗑️ {a}", callback_data=f"remove_activity_idx_{i}")
-                    )
-                keyboard.add(
-                    types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
+            if 0 <= activity_idx < len(activities):
+                activity = activities[activity_idx]
+                logger.info(f"Attempting to remove activity: '{activity}' at index {activity_idx}")
+                # Pull and read back the updated settings in one round trip
+                updated = users_collection.find_one_and_update(
+                    {'user_id': user_id, 'custom_activities': activity},
+                    {'$pull': {'custom_activities': activity}},
+                    projection={'activities': 0},
+                    return_document=ReturnDocument.AFTER
                 )
-                try:
+                if updated:
+                    self._cache_user(user_id, updated)
+                    logger.info(f"Successfully removed activity '{activity}' for user {user_id}")
+                    # Refresh the activities UI after removal
+                    activities = updated.get('custom_activities', [])
+                    activities_text, keyboard = self._get_activities_menu(activities)
                     self.bot.edit_message_text(
-                        "🗑️ Select an activity to remove:",
+                        f"✅ Activity removed: **{activity}**\n\n📝 **Your Custom Activities:**\n\n{activities_text}\n\nYou can add or remove activities.",
                         call.message.chat.id,
                         call.message.message_id,
-                        reply_markup=keyboard
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to edit message for remove_activity for user {user_id}: {e}")
-                    self.bot.send_message(
-                        call.message.chat.id,
-                        "🗑️ Select an activity to remove:",
-                        reply_markup=keyboard
-                    )
-                return
-            elif call.data.startswith('remove_activity_idx_'):
-                logger.info(f"Processing remove_activity_idx_ for user {user_id}: callback_data='{call.data}'")
-                try:
-                    activity_idx = int(call.data.replace('remove_activity_idx_', ''))
-                    logger.info(f"Parsed activity_idx: {activity_idx}")
-                    user = users_collection.find_one({'user_id': user_id})
-                    if not user:
-                        logger.error(f"No user found for user_id {user_id}")
-                        self.bot.edit_message_text(
-                            "❌ User data not found. Please try again.",
-                            call.message.chat.id,
-                            call.message.message_id
-                        )
-                        return
-                    activities = user.get('custom_activities', [])
-                    logger.info(f"User activities: {activities}")
-                    if not activities:
-                        logger.warning(f"No activities to remove for user {user_id}")
-                        self.bot.edit_message_text(
-                            "❌ No activities to remove.",
-                            call.message.chat.id,
-                            call.message.message_id
-                        )
-                        return
-                    if 0 <= activity_idx < len(activities):
-                        activity = activities[activity_idx]
-                        logger.info(f"Attempting to remove activity: '{activity}' at index {activity_idx}")
-                        result = users_collection.update_one(
-                            {'user_id': user_id},
-                            {'$pull': {'custom_activities': activity}}
-                        )
-                        logger.info(f"Database update result: matched={result.matched_count}, modified={result.modified_count}")
-                        if result.modified_count > 0:
-                            logger.info(f"Successfully removed activity '{activity}' for user {user_id}")
-                            # Refresh the activities UI after removal
-                            user = users_collection.find_one({'user_id': user_id})
-                            activities = user.get('custom_activities', []) if user else []
-                            activities_text = (
-                                '\n'.join([f"{i+1}. {a}" for i, a in enumerate(activities)])
-                                if activities else 'No custom activities defined.'
-                            )
-                            keyboard = types.InlineKeyboardMarkup()
-                            keyboard.add(
-                                types.InlineKeyboardButton("➕ Add Activity", callback_data="settings_add_activity")
-                            )
-                            if activities:
-                                keyboard.add(
-                                    types.InlineKeyboardButton("🗑️ Remove Activity", callback_data="settings_remove_activity")
-                                )
-                            keyboard.add(
-                                types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-                            )
-                            self.bot.edit_message_text(
-                                f"✅ Activity removed: **{activity}**\n\n📝 **Your Custom Activities:**\n\n{activities_text}\n\nYou can add or remove activities.",
-                                call.message.chat.id,
-                                call.message.message_id,
-                                reply_markup=keyboard,
-                                parse_mode='Markdown'
-                            )
-                        else:
-                            logger.error(f"Failed to remove activity '{activity}' for user {user_id}: No documents modified")
-                            self.bot.edit_message_text(
-                                f"❌ Failed to remove activity: **{activity}**. Please try again.",
-                                call.message.chat.id,
-                                call.message.message_id
-                            )
-                    else:
-                        logger.warning(f"Invalid activity index {activity_idx} for user {user_id}, activity count: {len(activities)}")
-                        self.bot.edit_message_text(
-                            f"❌ Invalid activity selection (index {activity_idx}). Please try again.",
-                            call.message.chat.id,
-                            call.message.message_id
-                        )
-                except ValueError as ve:
-                    logger.error(f"Invalid index format in callback_data '{call.data}' for user {user_id}: {ve}")
-                    self.bot.edit_message_text(
-                        f"❌ Invalid activity index. Please try again.",
-                        call.message.chat.id,
-                        call.message.message_id
+                        reply_markup=keyboard,
+                        parse_mode='Markdown'
                     )
-                except Exception as e:
-                    logger.error(f"Error removing activity at index for user {user_id}: {e}")
+                else:
+                    # Cached list was stale; drop it so the next read refetches
+                    self._invalidate_user(user_id)
+                    logger.error(f"Failed to remove activity '{activity}' for user {user_id}: No documents modified")
                     self.bot.edit_message_text(
-                        f"❌ Error removing activity. Please try again.",
+                        f"❌ Failed to remove activity: **{activity}**. Please try again.",
                         call.message.chat.id,
                         call.message.message_id
                     )
-                return
-            elif call.data == 'settings_add_activity':
-                logger.info(f"settings_add_activity callback for user {user_id}")
-                keyboard = types.InlineKeyboardMarkup()
-                keyboard.add(
-                    types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
+            else:
+                logger.warning(f"Invalid activity index {activity_idx} for user {user_id}, activity count: {len(activities)}")
+                self.bot.edit_message_text(
+                    f"❌ Invalid activity selection (index {activity_idx}). Please try again.",
+                    call.message.chat.id,
+                    call.message.message_id
                 )
-                sent = self.bot.edit_message_text(
-                    "📝 Please type the name of the activity to add:",
+        except ValueError as ve:
+            logger.error(f"Invalid index format in callback_data '{call.data}' for user {user_id}: {ve}")
+            self.bot.edit_message_text(
+                f"❌ Invalid activity index. Please try again.",
+                call.message.chat.id,
+                call.message.message_id
+            )
+        except Exception as e:
+            logger.error(f"Error removing activity at index for user {user_id}: {e}")
+            self.bot.edit_message_text(
+                f"❌ Error removing activity. Please try again.",
+                call.message.chat.id,
+                call.message.message_id
+            )
+
+    def _cb_settings_add_activity(self, call, user_id):
+        logger.info(f"settings_add_activity callback for user {user_id}")
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
+        )
+        sent = self.bot.edit_message_text(
+            "📝 Please type the name of the activity to add:",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+        self.input_prompt_message[user_id] = sent.message_id
+        self.bot.register_next_step_handler(
+            call.message,
+            lambda msg: self._handle_settings_add_activity_and_refresh(msg, call.message.chat.id)
+        )
+
+    def _cb_settings_remove_village(self, call, user_id):
+        logger.info(f"settings_remove_village callback for user {user_id}")
+        user = self._get_user(user_id, ttl=USER_SETTINGS_CACHE_TTL)
+        villages = user.get('villages', []) if user else []
+        logger.info(f"Showing remove village options for user {user_id}: villages={villages}")
+        if not villages:
+            self.bot.edit_message_text(
+                "❌ No villages to remove.",
+                call.message.chat.id,
+                call.message.message_id
+            )
+            return
+        keyboard = self._get_remove_menu('village', villages)
+        try:
+            self.bot.edit_message_text(
+                "🗑️ Select a village to remove:",
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=keyboard
+            )
+        except Exception as e:
+            logger.error(f"Failed to edit message for remove_village for user {user_id}: {e}")
+            self.bot.send_message(
+                call.message.chat.id,
+                "🗑️ Select a village to remove:",
+                reply_markup=keyboard
+            )
+
+    def _cb_remove_village_idx(self, call, user_id):
+        logger.info(f"Processing remove_village_idx_ for user {user_id}: callback_data='{call.data}'")
+        try:
+            village_idx = int(call.data.rpartition('_')[2])
+            logger.info(f"Parsed village_idx: {village_idx}")
+            user = self._get_user(user_id, ttl=USER_SETTINGS_CACHE_TTL)
+            if not user:
+                logger.error(f"No user found for user_id {user_id}")
+                self.bot.edit_message_text(
+                    "❌ User data not found. Please try again.",
                     call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=keyboard
+                    call.message.message_id
                 )
-                self.input_prompt_message[user_id] = sent.message_id
-                self.bot.register_next_step_handler(
-                    call.message,
-                    lambda msg: self._handle_settings_add_activity_and_refresh(msg, call.message.chat.id)
+                return
+            villages = user.get('villages', [])
+            logger.info(f"User villages: {villages}")
+            if not villages:
+                logger.warning(f"No villages to remove for user {user_id}")
+                self.bot.edit_message_text(
+                    "❌ No villages to remove.",
+                    call.message.chat.id,
+                    call.message.message_id
                 )
                 return
-            if call.data == 'settings_remove_village':
-                logger.info(f"settings_remove_village callback for user {user_id}")
-                user = users_collection.find_one({'user_id': user_id})
-                villages = user.get('villages', []) if user else []
-                logger.info(f"Showing remove village options for user {user_id}: villages={villages}")
-                if not villages:
-                    self.bot.edit_message_text(
-                        "❌ No villages to remove.",
-                        call.message.chat.id,
-                        call.message.message_id
-                    )
-                    return
-                keyboard = types.InlineKeyboardMarkup()
-                for i, v in enumerate(villages):
-                    logger.info(f"Creating button for village '{v}' at index {i}")
-                    keyboard.add(
-                        types.InlineKeyboardButton(f"🗑️ {v}", callback_data=f"remove_village_idx_{i}")
-                    )
-                keyboard.add(
-                    types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
+            if 0 <= village_idx < len(villages):
+                match = villages[village_idx]
+                logger.info(f"Attempting to remove village: '{match}' at index {village_idx}")
+                # Pull and read back the updated settings in one round trip
+                updated = users_collection.find_one_and_update(
+                    {'user_id': user_id, 'villages': match},
+                    {'$pull': {'villages': match}},
+                    projection={'activities': 0},
+                    return_document=ReturnDocument.AFTER
                 )
-                try:
+                if updated:
+                    self._cache_user(user_id, updated)
+                    logger.info(f"Successfully removed village '{match}' for user {user_id}")
+                    # Redraw the list message from the returned document; editing it in place also
+                    # retires the old index buttons, which no longer match the shortened list
+                    villages_text, keyboard = self._get_villages_menu(updated.get('villages', []))
                     self.bot.edit_message_text(
-                        "🗑️ Select a village to remove:",
+                        f"✅ Village removed: **{match}**\n\n🏘️ **Your Villages:**\n\n{villages_text}\n\nYou can add, remove, or upload a new list to replace all.",
                         call.message.chat.id,
                         call.message.message_id,
-                        reply_markup=keyboard
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to edit message for remove_village for user {user_id}: {e}")
-                    self.bot.send_message(
-                        call.message.chat.id,
-                        "🗑️ Select a village to remove:",
-                        reply_markup=keyboard
-                    )
-                return
-            elif call.data.startswith('remove_village_idx_'):
-                logger.info(f"Processing remove_village_idx_ for user {user_id}: callback_data='{call.data}'")
-                try:
-                    village_idx = int(call.data.replace('remove_village_idx_', ''))
-                    logger.info(f"Parsed village_idx: {village_idx}")
-                    user = users_collection.find_one({'user_id': user_id})
-                    if not user:
-                        logger.error(f"No user found for user_id {user_id}")
-                        self.bot.edit_message_text(
-                            "❌ User data not found. Please try again.",
-                            call.message.chat.id,
-                            call.message.message_id
-                        )
-                        return
-                    villages = user.get('villages', [])
-                    logger.info(f"User villages: {villages}")
-                    if not villages:
-                        logger.warning(f"No villages to remove for user {user_id}")
-                        self.bot.edit_message_text(
-                            "❌ No villages to remove.",
-                            call.message.chat.id,
-                            call.message.message_id
-                        )
-                        return
-                    if 0 <= village_idx < len(villages):
-                        match = villages[village_idx]
-                        logger.info(f"Attempting to remove village: '{match}' at index {village_idx}")
-                        result = users_collection.update_one(
-                            {'user_id': user_id},
-                            {'$pull': {'villages': match}}
-                        )
-                        logger.info(f"Database update result: matched={result.matched_count}, modified={result.modified_count}")
-                        if result.modified_count > 0:
-                            logger.info(f"Successfully removed village '{match}' for user {user_id}")
-                            # Refresh the settings UI after removal
-                            self._refresh_settings_ui(call.message.chat.id, user_id)
-                        else:
-                            logger.error(f"Failed to remove village '{match}' for user {user_id}: No documents modified")
-                            self.bot.edit_message_text(
-                                f"❌ Failed to remove village: **{match}**. Please try again.",
-                                call.message.chat.id,
-                                call.message.message_id
-                            )
-                    else:
-                        logger.warning(f"Invalid village index {village_idx} for user {user_id}, village count: {len(villages)}")
-                        self.bot.edit_message_text(
-                            f"❌ Invalid village selection (index {village_idx}). Please try again.",
-                            call.message.chat.id,
-                            call.message.message_id
-                        )
-                except ValueError as ve:
-                    logger.error(f"Invalid index format in callback_data '{call.data}' for user {user_id}: {ve}")
-                    self.bot.edit_message_text(
-                        f"❌ Invalid village index. Please try again.",
-                        call.message.chat.id,
-                        call.message.message_id
+                        reply_markup=keyboard,
+                        parse_mode='Markdown'
                     )
-                except Exception as e:
-                    logger.error(f"Error removing village at index for user {user_id}: {e}")
+                else:
+                    # Cached list was stale; drop it so the next read refetches
+                    self._invalidate_user(user_id)
+                    logger.error(f"Failed to remove village '{match}' for user {user_id}: No documents modified")
                     self.bot.edit_message_text(
-                        f"❌ Error removing village. Please try again.",
+                        f"❌ Failed to remove village: **{match}**. Please try again.",
                         call.message.chat.id,
                         call.message.message_id
                     )
-                return
-            elif call.data.startswith('purpose_'):
-                temp_activity = self.callback_data.get(user_id, {})
-                logger.info(f"Purpose callback - temp_activity for user {user_id}: {temp_activity}")
+            else:
+                logger.warning(f"Invalid village index {village_idx} for user {user_id}, village count: {len(villages)}")
+                self.bot.edit_message_text(
+                    f"❌ Invalid village selection (index {village_idx}). Please try again.",
+                    call.message.chat.id,
+                    call.message.message_id
+                )
+        except ValueError as ve:
+            logger.error(f"Invalid index format in callback_data '{call.data}' for user {user_id}: {ve}")
+            self.bot.edit_message_text(
+                f"❌ Invalid village index. Please try again.",
+                call.message.chat.id,
+                call.message.message_id
+            )
+        except Exception as e:
+            logger.error(f"Error removing village at index for user {user_id}: {e}")
+            self.bot.edit_message_text(
+                f"❌ Error removing village. Please try again.",
+                call.message.chat.id,
+                call.message.message_id
+            )
 
-                if call.data == 'purpose_custom':
-                    logger.info("Custom purpose selected, requesting text input")
+    def _cb_purpose(self, call, user_id):
+        """Purpose selection for the normal activity flow"""
+        temp_activity = self.callback_data.get(user_id, {})
+        prompt = self.pending_prompts.get(user_id, {})
+        logger.info(f"Purpose callback - temp_activity for user {user_id}: {temp_activity}")
 
-                    # Delete the purpose selection message
-                    try:
-                        self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                        logger.debug(f"Deleted purpose selection message for user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to delete purpose selection message for user {user_id}: {e}")
+        # The route table matched the prefix; slice it off once instead of re-testing it per branch
+        choice = call.data[len('purpose_'):]
+        if choice == 'custom':
+            logger.info("Custom purpose selected, requesting text input")
+            self._tg_pool.submit(self._answer_callback, call)
 
-                    # Send new message for custom purpose input
-                    sent = self.bot.send_message(
-                        call.message.chat.id,
-                        "📝 Please type your custom purpose:"
-                    )
-                    self.bot.register_next_step_handler(
-                        sent,
-                        self.handle_purpose_selection,
-                        temp_activity=temp_activity,
-                        timeout=USER_TIMEOUT
-                    )
-                elif call.data.startswith('purpose_idx_'):
-                    # Handle numbered activity selection
-                    try:
-                        idx = int(call.data.replace('purpose_idx_', ''))
-                        user_activities = self.get_user_activities(user_id)
-
-                        if 0 <= idx < len(user_activities):
-                            purpose = user_activities[idx]
-                            logger.info(f"Purpose selected by index {idx}: {purpose}")
-                            temp_activity['purpose'] = purpose
-                            temp_activity['user_id'] = user_id
-
-                            # Delete the purpose selection message before saving
-                            try:
-                                self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                                logger.debug(f"Deleted purpose selection message for user {user_id}")
-                            except Exception as e:
-                                logger.error(f"Failed to delete purpose selection message for user {user_id}: {e}")
-
-                            self.save_activity_callback(call, temp_activity)
-                        else:
-                            logger.error(f"Invalid purpose index {idx} for user {user_id}")
-                            self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
-                            return
-                    except ValueError:
-                        logger.error(f"Invalid purpose index format: {call.data}")
-                        self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
-                        return
-                else:
-                    # Handle legacy purpose selection (fallback)
-                    purpose = call.data.replace('purpose_', '')
-                    logger.info(f"Purpose selected (legacy): {purpose}")
+            # Delete the purpose selection message
+            self._delete_messages_async(call.message.chat.id, [call.message.message_id], user_id)
+
+            # Send new message for custom purpose input
+            sent = self.bot.send_message(
+                call.message.chat.id,
+                "📝 Please type your custom purpose:"
+            )
+            if prompt.get('custom_purpose_handler'):
+                self.bot.register_next_step_handler(sent, prompt['custom_purpose_handler'])
+            else:
+                self.bot.register_next_step_handler(
+                    sent,
+                    self.handle_purpose_selection,
+                    temp_activity=temp_activity,
+                    timeout=USER_TIMEOUT
+                )
+        elif choice[:4] == 'idx_':
+            # Handle numbered activity selection
+            try:
+                idx = int(choice[4:])
+                # Prefer the exact options shown on the prompt (they depend on its month)
+                user_activities = prompt.get('purpose_options') or self.get_user_activities(user_id)
+
+                if 0 <= idx < len(user_activities):
+                    purpose = user_activities[idx]
+                    logger.info(f"Purpose selected by index {idx}: {purpose}")
+                    self._tg_pool.submit(self._answer_callback, call)
                     temp_activity['purpose'] = purpose
                     temp_activity['user_id'] = user_id
 
-                    # Delete the purpose selection message before saving
-                    try:
-                        self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                        logger.debug(f"Deleted purpose selection message for user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to delete purpose selection message for user {user_id}: {e}")
+                    # Delete the purpose selection message while the activity is saved
+                    self._delete_messages_async(call.message.chat.id, [call.message.message_id], user_id)
 
                     self.save_activity_callback(call, temp_activity)
-
-                if user_id in self.callback_data:
-                    del self.callback_data[user_id]
-                    logger.info(f"Cleaned up callback_data for user {user_id}")
+                else:
+                    logger.error(f"Invalid purpose index {idx} for user {user_id}")
+                    self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
                     return
+            except ValueError:
+                logger.error(f"Invalid purpose index format: {call.data}")
+                self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
+                return
+        else:
+            # Handle legacy purpose selection (fallback)
+            purpose = choice
+            logger.info(f"Purpose selected (legacy): {purpose}")
+            self._tg_pool.submit(self._answer_callback, call)
+            temp_activity['purpose'] = purpose
+            temp_activity['user_id'] = user_id
 
-            elif call.data.startswith('settings_'):
-                if call.data == 'settings_setrole':
-                    logger.info(f"settings_setrole callback for user {user_id}")
-                    keyboard = types.InlineKeyboardMarkup()
-                    keyboard.add(
-                        types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-                    )
-                    self.bot.edit_message_text(
-                        "👤 Please type your role/designation:",
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=keyboard
-                    )
-                    self.input_prompt_message[user_id] = call.message.message_id
-                    self.bot.register_next_step_handler(
-                        call.message,
-                        self.handle_settings_setrole,
-                        timeout=USER_TIMEOUT
-                    )
-                elif call.data == 'settings_sethq':
-                    logger.info(f"settings_sethq callback for user {user_id}")
-                    keyboard = types.InlineKeyboardMarkup()
-                    keyboard.add(
-                        types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-                    )
-                    self.bot.edit_message_text(
-                        "🏢 Please type your headquarters name:",
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=keyboard
-                    )
-                    self.input_prompt_message[user_id] = call.message.message_id
-                    self.bot.register_next_step_handler(
-                        call.message,
-                        self.handle_settings_sethq,
-                        timeout=USER_TIMEOUT
-                    )
-                    return
-                elif call.data == 'settings_addvil':
-                    logger.info(f"settings_addvil callback for user {user_id}")
-                    user = users_collection.find_one({'user_id': user_id})
-                    villages = user.get('villages', []) if user else []
-                    villages_text = (
-                        '\n'.join([f"{i+1}. {v}" for i, v in enumerate(villages)])
-                        if villages else 'No villages added yet.'
-                    )
-                    keyboard = types.InlineKeyboardMarkup()
-                    keyboard.add(
-                        types.InlineKeyboardButton("➕ Add Village", callback_data="settings_add_village")
-                        )
-                    if villages:
-                        keyboard.add(
-                            types.InlineKeyboardButton("🗑️ Remove Village", callback_data="settings_remove_village")
-                        )
-                    keyboard.add(
-                        types.InlineKeyboardButton("📁 Upload File (Replace All)", callback_data="settings_upload_villages")
-                    )
-                    keyboard.add(
-                        types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-                    )
-                    self.bot.edit_message_text(
-                        f"🏘️ **Your Villages:**\n\n{villages_text}\n\nYou can add, remove, or upload a new list to replace all.",
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=keyboard,
-                        parse_mode='Markdown'
-                    )
-                    return
-                elif call.data == 'settings_add_village':
-                    logger.info(f"settings_add_village callback for user {user_id}")
-                    keyboard = types.InlineKeyboardMarkup()
-                    keyboard.add(
-                        types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-                    )
-                    sent = self.bot.edit_message_text(
-                        "🏘️ Please type the name of the village to add:",
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=keyboard
-                    )
-                    self.input_prompt_message[user_id] = sent.message_id
-                    self.bot.register_next_step_handler(
-                        call.message,
-                        self.handle_settings_add_single_village,
-                        timeout=USER_TIMEOUT
-                    )
-                    return
-                elif call.data == 'settings_remove_village':
-                    logger.info(f"settings_remove_village callback for user {user_id}")
-                    user = users_collection.find_one({'user_id': user_id})
-                    villages = user.get('villages', []) if user else []
-                    logger.info(f"Showing remove village options for user {user_id}: villages={villages}")
-                    if not villages:
-                        self.bot.edit_message_text(
-                            "❌ No villages to remove.",
-                            call.message.chat.id,
-                            call.message.message_id
-                        )
-                        return
-                    keyboard = types.InlineKeyboardMarkup()
-                    for i, v in enumerate(villages):
-                        logger.info(f"Creating button for village '{v}' at index {i}")
-                        keyboard.add(
-                            types.InlineKeyboardButton(f"🗑️ {v}", callback_data=f"remove_village_idx_{i}")
-                        )
-                    keyboard.add(
-                        types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-                    )
-                    try:
-                        self.bot.edit_message_text(
-                            "🗑️ Select a village to remove:",
-                            call.message.chat.id,
-                            call.message.message_id,
-                            reply_markup=keyboard
-                        )
-                    except Exception as e:
-                        logger.error(f"Failed to edit message for remove_village for user {user_id}: {e}")
-                        self.bot.send_message(
-                            call.message.chat.id,
-                            "🗑️ Select a village to remove:",
-                            reply_markup=keyboard
-                        )
-                    return
-                elif call.data.startswith('remove_village_idx_'):
-                    logger.info(f"Processing remove_village_idx_ for user {user_id}: callback_data='{call.data}'")
-                    try:
-                        village_idx = int(call.data.replace('remove_village_idx_', ''))
-                        logger.info(f"Parsed village_idx: {village_idx}")
-                        user = users_collection.find_one({'user_id': user_id})
-                        if not user:
-                            logger.error(f"No user found for user_id {user_id}")
-                            self.bot.edit_message_text(
-                                "❌ User data not found. Please try again.",
-                                call.message.chat.id,
-                                call.message.message_id
-                            )
-                            return
-                        villages = user.get('villages', [])
-                        logger.info(f"User villages: {villages}")
-                        if not villages:
-                            logger.warning(f"No villages to remove for user {user_id}")
-                            self.bot.edit_message_text(
-                                "❌ No villages to remove.",
-                                call.message.chat.id,
-                                call.message.message_id
-                            )
-                            return
-                        if 0 <= village_idx < len(villages):
-                            match = villages[village_idx]
-                            logger.info(f"Attempting to remove village: '{match}' at index {village_idx}")
-                            result = users_collection.update_one(
-                                {'user_id': user_id},
-                                {'$pull': {'villages': match}}
-                            )
-                            logger.info(f"Database update result: matched={result.matched_count}, modified={result.modified_count}")
-                            if result.modified_count > 0:
-                                logger.info(f"Successfully removed village '{match}' for user {user_id}")
-                                # Refresh the settings UI after removal
-                                self._refresh_settings_ui(call.message.chat.id, user_id)
-                            else:
-                                logger.error(f"Failed to remove village '{match}' for user {user_id}: No documents modified")
-                                self.bot.edit_message_text(
-                                    f"❌ Failed to remove village: **{match}**. Please try again.",
-                                    call.message.chat.id,
-                                    call.message.message_id
-                                )
-                        else:
-                            logger.warning(f"Invalid village index {village_idx} for user {user_id}, village count: {len(villages)}")
-                            self.bot.edit_message_text(
-                                f"❌ Invalid village selection (index {village_idx}). Please try again.",
-                                call.message.chat.id,
-                                call.message.message_id
-                            )
-                    except ValueError as ve:
-                        logger.error(f"Invalid index format in callback_data '{call.data}' for user {user_id}: {ve}")
-                        self.bot.edit_message_text(
-                            f"❌ Invalid village index. Please try again.",
-                            call.message.chat.id,
-                            call.message.message_id
-                        )
-                    except Exception as e:
-                        logger.error(f"Error removing village at index for user {user_id}: {e}")
-                        self.bot.edit_message_text(
-                            f"❌ Error removing village. Please try again.",
-                            call.message.chat.id,
-                            call.message.message_id
-                        )
-                    return
-                elif call.data == 'settings_upload_villages':
-                    logger.info(f"settings_upload_villages callback for user {user_id}")
-                    keyboard = types.InlineKeyboardMarkup()
-                    keyboard.add(
-                        types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-                    )
-                    sent = self.bot.edit_message_text(
-                        "📁 Please upload an Excel (.xlsx, .xls) or CSV (.csv) file with your villages. The file must have a column named 'Village'.",
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=keyboard
-                    )
-                    self.input_prompt_message[user_id] = sent.message_id
-                    # The next document upload will be handled by handle_file_upload
-                    self.callback_data[user_id] = {'awaiting_village_upload': True}
-                    return
-                elif call.data == 'settings_default_purpose':
-                    logger.info(f"settings_default_purpose callback for user {user_id}")
-
-                    # Check if user has a default purpose set
-                    user = users_collection.find_one({'user_id': user_id})
-                    current_purpose = user.get('default_purpose', None)
-
-                    keyboard = types.InlineKeyboardMarkup()
-
-                    if current_purpose:
-                        # If user has a default purpose, show options to change or delete it
-                        keyboard.add(
-                            types.InlineKeyboardButton("✏️ Change Default Purpose", callback_data="settings_change_default_purpose")
-                        )
-                        keyboard.add(
-                            types.InlineKeyboardButton("🗑️ Delete Default Purpose", callback_data="settings_delete_default_purpose")
-                        )
-                        keyboard.add(
-                            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-                        )
-
-                        self.bot.edit_message_text(
-                            f"🎯 Your current default purpose: *{current_purpose}*\n\nThis purpose is used for {DEFAULT_ACTIVITY_TIME} auto-entries.",
-                            call.message.chat.id,
-                            call.message.message_id,
-                            reply_markup=keyboard,
-                            parse_mode='Markdown'
-                        )
-                    else:
-                        # If no default purpose is set, prompt to set one
-                        keyboard.add(
-                            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-                        )
-
-                        sent = self.bot.edit_message_text(
-                            f"🎯 Please type your default purpose for {DEFAULT_ACTIVITY_TIME} auto-entries:",
-                            call.message.chat.id,
-                            call.message.message_id,
-                            reply_markup=keyboard
-                        )
-                        self.input_prompt_message[user_id] = sent.message_id
-                        self.bot.register_next_step_handler(
-                            call.message,
-                            self.handle_settings_default_purpose,
-                            timeout=USER_TIMEOUT
-                        )
-                    return
-                elif call.data == 'settings_change_default_purpose':
-                    logger.info(f"settings_change_default_purpose callback for user {user_id}")
-                    keyboard = types.InlineKeyboardMarkup()
-                    keyboard.add(
-                        types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-                    )
-                    sent = self.bot.edit_message_text(
-                        f"🎯 Please type your new default purpose for {DEFAULT_ACTIVITY_TIME} auto-entries:",
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=keyboard
-                    )
-                    self.input_prompt_message[user_id] = sent.message_id
-                    self.bot.register_next_step_handler(
-                        call.message,
-                        self.handle_settings_default_purpose,
-                        timeout=USER_TIMEOUT,
-                    )
-                    return
+            # Delete the purpose selection message while the activity is saved
+            self._delete_messages_async(call.message.chat.id, [call.message.message_id], user_id)
 
-            elif call.data.startswith('owner_'):
-                if call.data == 'owner_set_prompt_time':
-                    logger.info(f"owner_set_prompt_time callback for user {user_id}")
-                    keyboard = types.InlineKeyboardMarkup()
-                    keyboard.add(
-                        types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-                    )
-                    sent = self.bot.edit_message_text(
-                        "⏰ Please type the new daily prompt time (HH:MM):",
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=keyboard
-                    )
-                    self.input_prompt_message[user_id] = sent.message_id
-                    self.bot.register_next_step_handler(
-                        call.message,
-                        self.handle_owner_set_prompt_time,
-                        timeout=USER_TIMEOUT
-                    )
-                    return
-                elif call.data == 'owner_set_fallback_time':
-                    logger.info(f"owner_set_fallback_time callback for user {user_id}")
-                    keyboard = types.InlineKeyboardMarkup()
-                    keyboard.add(
-                        types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-                    )
-                    sent = self.bot.edit_message_text(
-                        "🤖 Please type the new default activity fallback time (HH:MM):",
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=keyboard
-                    )
-                    self.input_prompt_message[user_id] = sent.message_id
-                    self.bot.register_next_step_handler(
-                        call.message,
-                        self.handle_owner_set_fallback_time,
-                        timeout=USER_TIMEOUT,
-                    )
+            self.save_activity_callback(call, temp_activity)
 
+        if user_id in self.callback_data:
+            del self.callback_data[user_id]
+            logger.info(f"Cleaned up callback_data for user {user_id}")
+            return
 
-                    return
+    def _cb_settings_setrole(self, call, user_id):
+        logger.info(f"settings_setrole callback for user {user_id}")
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
+        )
+        self.bot.edit_message_text(
+            "👤 Please type your role/designation:",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+        self.input_prompt_message[user_id] = call.message.message_id
+        self.bot.register_next_step_handler(
+            call.message,
+            self.handle_settings_setrole,
+            timeout=USER_TIMEOUT
+        )
 
-                elif call.data == 'settings_delete_default_purpose':
-                    logger.info(f"settings_delete_default_purpose callback for user {user_id}")
-                    try:
-                        # Get current default purpose
-                        user = users_collection.find_one({'user_id': user_id})
-                        current_purpose = user.get('default_purpose', None)
-
-                        if not current_purpose:
-                            self.bot.edit_message_text(
-                                "❌ No default purpose is currently set.",
-                                call.message.chat.id,
-                                call.message.message_id
-                            )
-                            return
-
-                        # Remove default purpose
-                        result = users_collection.update_one(
-                            {'user_id': user_id},
-                            {'$unset': {'default_purpose': ""}}
-                        )
-
-                        if result.modified_count > 0:
-                            logger.info(f"Successfully deleted default purpose for user {user_id}")
-                            self.bot.edit_message_text(
-                                f"✅ Default purpose deleted successfully. Auto-entries at {DEFAULT_ACTIVITY_TIME} will be disabled.",
-                                call.message.chat.id,
-                                call.message.message_id
-                            )
-                        else:
-                            logger.error(f"Failed to delete default purpose for user {user_id}")
-                            self.bot.edit_message_text(
-                                "❌ Failed to delete default purpose. Please try again.",
-                                call.message.chat.id,
-                                call.message.message_id
-                            )
-                    except Exception as e:
-                        logger.error(f"Error deleting default purpose for user {user_id}: {e}")
-                        self.bot.edit_message_text(
-                            "❌ An error occurred while deleting default purpose. Please try again.",
-                            call.message.chat.id,
-                            call.message.message_id
-                        )
-                    return
-                elif call.data == 'settings_upload_holidays':
-                    logger.info(f"settings_upload_holidays callback for user {user_id}")
-                    keyboard = types.InlineKeyboardMarkup()
-                    keyboard.add(
-                        types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-                    )
-                    help_text = (
-                        "📅 Please upload an Excel (.xlsx, .xls) or CSV (.csv) file with your public holidays.\n\n"
-                        "The file must have two columns: 'Date' (A, DD/MM/YYYY) and 'Holiday' (B, description).\n\n"
-                        "**Example:**\n"
-                        "| Date        | Holiday            |\n"
-                        "|-------------|--------------------|\n"
-                        "| 15/08/2024  | Independence Day   |\n"
-                        "| 02/10/2024  | Gandhi Jayanti     |\n"
-                    )
-                    sent = self.bot.edit_message_text(
-                        help_text,
-                        call.message.chat.id,
-                        call.message.message_id,
-                    disable_web_page_preview=True,
-                        reply_markup=keyboard,
-                        parse_mode='Markdown'
-                    )
-                    self.input_prompt_message[user_id] = sent.message_id
-                    self.callback_data[user_id] = {'awaiting_holiday_upload': True}
-                    return
+    def _cb_settings_sethq(self, call, user_id):
+        logger.info(f"settings_sethq callback for user {user_id}")
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
+        )
+        self.bot.edit_message_text(
+            "🏢 Please type your headquarters name:",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+        self.input_prompt_message[user_id] = call.message.message_id
+        self.bot.register_next_step_handler(
+            call.message,
+            self.handle_settings_sethq,
+            timeout=USER_TIMEOUT
+        )
 
-            elif call.data.startswith('purpose_'):
-                temp_activity = self.callback_data.get(user_id, {})
-                logger.info(f"Purpose callback - temp_activity for user {user_id}: {temp_activity}")
+    def _cb_settings_addvil(self, call, user_id):
+        logger.info(f"settings_addvil callback for user {user_id}")
+        user = self._get_user(user_id, ttl=USER_SETTINGS_CACHE_TTL)
+        villages = user.get('villages', []) if user else []
+        villages_text, keyboard = self._get_villages_menu(villages)
+        self.bot.edit_message_text(
+            f"🏘️ **Your Villages:**\n\n{villages_text}\n\nYou can add, remove, or upload a new list to replace all.",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard,
+            parse_mode='Markdown'
+        )
 
-                if call.data == 'purpose_custom':
-                    logger.info("Custom purpose selected, requesting text input")
+    def _cb_settings_add_village(self, call, user_id):
+        logger.info(f"settings_add_village callback for user {user_id}")
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
+        )
+        sent = self.bot.edit_message_text(
+            "🏘️ Please type the name of the village to add:",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+        self.input_prompt_message[user_id] = sent.message_id
+        self.bot.register_next_step_handler(
+            call.message,
+            self.handle_settings_add_single_village,
+            timeout=USER_TIMEOUT
+        )
 
-                    # Delete the purpose selection message
-                    try:
-                        self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                        logger.debug(f"Deleted purpose selection message for user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to delete purpose selection message for user {user_id}: {e}")
+    def _cb_settings_upload_villages(self, call, user_id):
+        logger.info(f"settings_upload_villages callback for user {user_id}")
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
+        )
+        sent = self.bot.edit_message_text(
+            "📁 Please upload an Excel (.xlsx, .xls) or CSV (.csv) file with your villages. The file must have a column named 'Village'.",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+        self.input_prompt_message[user_id] = sent.message_id
+        # The next document upload will be handled by handle_file_upload
+        self.callback_data.set(user_id, {'awaiting_village_upload': True}, ttl=UPLOAD_STATE_TTL)
 
-                    # Send new message for custom purpose input
-                    sent = self.bot.send_message(
-                        call.message.chat.id,
-                        "📝 Please type your custom purpose:"
-                    )
-                    self.bot.register_next_step_handler(
-                        sent,
-                        self.handle_purpose_selection,
-                        temp_activity=temp_activity,
-                        timeout=USER_TIMEOUT
-                    )
-                elif call.data.startswith('purpose_idx_'):
-                    # Handle numbered activity selection
-                    try:
-                        idx = int(call.data.replace('purpose_idx_', ''))
-                        user_activities = self.get_user_activities(user_id)
-
-                        if 0 <= idx < len(user_activities):
-                            purpose = user_activities[idx]
-                            logger.info(f"Purpose selected by index {idx}: {purpose}")
-                            temp_activity['purpose'] = purpose
-                            temp_activity['user_id'] = user_id
-
-                            # Delete the purpose selection message before saving
-                            try:
-                                self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                                logger.debug(f"Deleted purpose selection message for user {user_id}")
-                            except Exception as e:
-                                logger.error(f"Failed to delete purpose selection message for user {user_id}: {e}")
-
-                            self.save_activity_callback(call, temp_activity)
-                        else:
-                            logger.error(f"Invalid purpose index {idx} for user {user_id}")
-                            self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
-                            return
-                    except ValueError:
-                        logger.error(f"Invalid purpose index format: {call.data}")
-                        self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
-                        return
-                elif call.data.startswith('purpose_'):
-                    # Handle legacy purpose selection (fallback)
-                    purpose = call.data.replace('purpose_', '')
-                    logger.info(f"Purpose selected (legacy): {purpose}")
-                    temp_activity['purpose'] = purpose
-                    temp_activity['user_id'] = user_id
+    def _cb_settings_default_purpose(self, call, user_id):
+        logger.info(f"settings_default_purpose callback for user {user_id}")
 
-                    # Delete the purpose selection message before saving
-                    try:
-                        self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                        logger.debug(f"Deleted purpose selection message for user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to delete purpose selection message for user {user_id}: {e}")
+        # Check if user has a default purpose set
+        user = self._get_user(user_id)
+        current_purpose = user.get('default_purpose', None)
 
-                    self.save_activity_callback(call, temp_activity)
+        keyboard = types.InlineKeyboardMarkup()
 
-                if user_id in self.callback_data:
-                    del self.callback_data[user_id]
-                    logger.info(f"Cleaned up callback_data for user {user_id}")
-                return
+        if current_purpose:
+            # If user has a default purpose, show options to change or delete it
+            keyboard.add(
+                types.InlineKeyboardButton("✏️ Change Default Purpose", callback_data="settings_change_default_purpose")
+            )
+            keyboard.add(
+                types.InlineKeyboardButton("🗑️ Delete Default Purpose", callback_data="settings_delete_default_purpose")
+            )
+            keyboard.add(
+                types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
+            )
+
+            self.bot.edit_message_text(
+                f"🎯 Your current default purpose: *{current_purpose}*\n\nThis purpose is used for {DEFAULT_ACTIVITY_TIME} auto-entries.",
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=keyboard,
+                parse_mode='Markdown'
+            )
+        else:
+            # If no default purpose is set, prompt to set one
+            keyboard.add(
+                types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
+            )
 
-            # --- Village selection (normal, daily, or editact) ---
-            if call.data.startswith('village_'):
-                headquarters = users_collection.find_one({'user_id': user_id}).get('headquarters', 'HQ').title()
-                if call.data == f'village_{headquarters}':
-                    # User clicked headquarters button: no journey
-                    date_str = self.callback_data.get(user_id, {}).get('date')
-                    if not date_str:
-                        date_str = datetime.now(IST).strftime('%d/%m/%Y')
-                    temp_activity = {
-                        'date': date_str,
-                        'to_village': '',
-                        'purpose': 'Attended office work',
-                        'user_id': user_id
-                    }
-                    logger.info(f"User {user_id} selected headquarters for date {date_str}")
-                    self.save_activity_callback(call, temp_activity)
-                    if user_id in self.callback_data:
-                        del self.callback_data[user_id]
-                    return
-                if call.data == 'village_manual':
-                    logger.info(f"User {user_id} selected manual village entry")
-                    date_str = self.callback_data.get(user_id, {}).get('date')
-                    if not date_str:
-                        date_str = datetime.now(IST).strftime('%d/%m/%Y')
-                    temp_activity = {'date': date_str}
-                    self.callback_data[user_id] = temp_activity
-
-                    # Delete the village selection message
-                    try:
-                        self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                        logger.debug(f"Deleted village selection message for user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to delete village selection message for user {user_id}: {e}")
+            sent = self.bot.edit_message_text(
+                f"🎯 Please type your default purpose for {DEFAULT_ACTIVITY_TIME} auto-entries:",
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=keyboard
+            )
+            self.input_prompt_message[user_id] = sent.message_id
+            self.bot.register_next_step_handler(
+                call.message,
+                self.handle_settings_default_purpose,
+                timeout=USER_TIMEOUT
+            )
 
-                    # Send new message for manual entry
-                    sent = self.bot.send_message(
-                        call.message.chat.id,
-                        "✏️ Please type the village name:"
-                    )
-                    self.bot.register_next_step_handler(
-                        sent,
-                        self.handle_village_selection,
-                        temp_activity=temp_activity,
-                        timeout=USER_TIMEOUT
-                    )
-                    return
-                village = call.data.replace('village_', '')
-                logger.info(f"User {user_id} selected village: {village}")
-                date_str = self.callback_data.get(user_id, {}).get('date')
-                if not date_str:
-                    date_str = datetime.now(IST).strftime('%d/%m/%Y')
-                temp_activity = {
-                    'to_village': village,
-                    'date': date_str,
-                    'user_id': user_id
-                }
-                self.callback_data[user_id] = temp_activity
-                logger.info(f"Stored temp_activity for user {user_id}: {temp_activity}")
+    def _cb_settings_change_default_purpose(self, call, user_id):
+        logger.info(f"settings_change_default_purpose callback for user {user_id}")
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
+        )
+        sent = self.bot.edit_message_text(
+            f"🎯 Please type your new default purpose for {DEFAULT_ACTIVITY_TIME} auto-entries:",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+        self.input_prompt_message[user_id] = sent.message_id
+        self.bot.register_next_step_handler(
+            call.message,
+            self.handle_settings_default_purpose,
+            timeout=USER_TIMEOUT,
+        )
 
-                # Delete the village selection message before showing purpose buttons
-                try:
-                    self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                    logger.debug(f"Deleted village selection message for user {user_id}")
-                except Exception as e:
-                    logger.error(f"Failed to delete village selection message for user {user_id}: {e}")
+    def _cb_owner_set_prompt_time(self, call, user_id):
+        logger.info(f"owner_set_prompt_time callback for user {user_id}")
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
+        )
+        sent = self.bot.edit_message_text(
+            "⏰ Please type the new daily prompt time (HH:MM):",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+        self.input_prompt_message[user_id] = sent.message_id
+        self._start_owner_time_input(user_id, call.message.chat.id, sent.message_id, 'prompt_time')
+        self.bot.register_next_step_handler(
+            call.message,
+            self.handle_owner_set_prompt_time,
+            timeout=USER_TIMEOUT
+        )
 
-                # Extract month from date_str
-                try:
-                    selected_date = datetime.strptime(date_str, '%d/%m/%Y')
-                    month = selected_date.month
-                    logger.debug(f"Extracted month {month} from date {date_str} for purpose buttons")
-                except Exception as e:
-                    logger.error(f"Failed to extract month from date {date_str}: {e}")
-                    month = datetime.now(IST).month
-                    logger.debug(f"Using current month {month} for purpose buttons")
+    def _cb_owner_set_fallback_time(self, call, user_id):
+        logger.info(f"owner_set_fallback_time callback for user {user_id}")
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
+        )
+        sent = self.bot.edit_message_text(
+            "🤖 Please type the new default activity fallback time (HH:MM):",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+        self.input_prompt_message[user_id] = sent.message_id
+        self._start_owner_time_input(user_id, call.message.chat.id, sent.message_id, 'fallback_time')
+        self.bot.register_next_step_handler(
+            call.message,
+            self.handle_owner_set_fallback_time,
+            timeout=USER_TIMEOUT,
+        )
+
+    def _cb_settings_delete_default_purpose(self, call, user_id):
+        logger.info(f"settings_delete_default_purpose callback for user {user_id}")
+        try:
+            # Get current default purpose
+            user = self._get_user(user_id)
+            current_purpose = (user or {}).get('default_purpose')
 
-                self.show_purpose_buttons(call.message, user_id, month=month)
+            if not current_purpose:
+                self.bot.edit_message_text(
+                    "❌ No default purpose is currently set.",
+                    call.message.chat.id,
+                    call.message.message_id
+                )
                 return
 
-            # --- Daily village selection ---
-            elif call.data.startswith('daily_village_'):
-                headquarters = users_collection.find_one({'user_id': user_id}).get('headquarters', 'HQ').title()
-                if call.data == f'daily_village_{headquarters}':
-                    # User clicked headquarters button: no journey
-                    temp_activity = {
-                        'date': datetime.now(IST).strftime('%d/%m/%Y'),
-                        'to_village': '',
-                        'purpose': 'Attended office work',
-                        'user_id': user_id
-                    }
-                    logger.info(f"User {user_id} selected headquarters for daily activity")
-                    self.save_activity_callback(call, temp_activity)
-                    if user_id in self.callback_data:
-                        del self.callback_data[user_id]
-                    return
-                if call.data == 'daily_village_manual':
-                    logger.info(f"User {user_id} selected daily manual village entry")
-                    temp_activity = {'date': datetime.now(IST).strftime('%d/%m/%Y')}
-                    self.callback_data[user_id] = temp_activity
+            # Remove default purpose; the returned document refreshes the cache without another read
+            updated = users_collection.find_one_and_update(
+                {'user_id': user_id, 'default_purpose': {'$exists': True}},
+                {'$unset': {'default_purpose': ""}},
+                projection={'activities': 0},
+                return_document=ReturnDocument.AFTER
+            )
 
-                    # Delete the daily village selection message
-                    try:
-                        self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                        logger.debug(f"Deleted daily village selection message for user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to delete daily village selection message for user {user_id}: {e}")
+            if updated:
+                self._cache_user(user_id, updated)
+                logger.info(f"Successfully deleted default purpose for user {user_id}")
+                self.bot.edit_message_text(
+                    f"✅ Default purpose deleted successfully. Auto-entries at {DEFAULT_ACTIVITY_TIME} will be disabled.",
+                    call.message.chat.id,
+                    call.message.message_id
+                )
+            else:
+                self._invalidate_user(user_id)
+                logger.error(f"Failed to delete default purpose for user {user_id}")
+                self.bot.edit_message_text(
+                    "❌ Failed to delete default purpose. Please try again.",
+                    call.message.chat.id,
+                    call.message.message_id
+                )
+        except Exception as e:
+            logger.error(f"Error deleting default purpose for user {user_id}: {e}")
+            self.bot.edit_message_text(
+                "❌ An error occurred while deleting default purpose. Please try again.",
+                call.message.chat.id,
+                call.message.message_id
+            )
 
-                    # Send new message for manual entry
-                    sent = self.bot.send_message(
-                        call.message.chat.id,
-                        "✏️ Please type the village name:"
-                    )
-                    self.bot.register_next_step_handler(
-                        sent,
-                        self.handle_village_selection,
-                        temp_activity=temp_activity,
-                        timeout=USER_TIMEOUT
-                    )
-                    return
-                village = call.data.replace('daily_village_', '')
-                logger.info(f"User {user_id} selected daily village: {village}")
-                temp_activity = {
-                    'to_village': village,
-                    'date': datetime.now(IST).strftime('%d/%m/%Y'),
-                    'user_id': user_id
-                }
-                self.callback_data[user_id] = temp_activity
-                logger.info(f"Stored daily temp_activity for user {user_id}: {temp_activity}")
+    def _cb_settings_upload_holidays(self, call, user_id):
+        logger.info(f"settings_upload_holidays callback for user {user_id}")
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(
+            types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
+        )
+        help_text = (
+            "📅 Please upload an Excel (.xlsx, .xls) or CSV (.csv) file with your public holidays.\n\n"
+            "The file must have two columns: 'Date' (A, DD/MM/YYYY) and 'Holiday' (B, description).\n\n"
+            "**Example:**\n"
+            "| Date        | Holiday            |\n"
+            "|-------------|--------------------|\n"
+            "| 15/08/2024  | Independence Day   |\n"
+            "| 02/10/2024  | Gandhi Jayanti     |\n"
+        )
+        sent = self.bot.edit_message_text(
+            help_text,
+            call.message.chat.id,
+            call.message.message_id,
+        disable_web_page_preview=True,
+            reply_markup=keyboard,
+            parse_mode='Markdown'
+        )
+        self.input_prompt_message[user_id] = sent.message_id
+        self.callback_data.set(user_id, {'awaiting_holiday_upload': True}, ttl=UPLOAD_STATE_TTL)
+
+    def _cb_village(self, call, user_id):
+        """Village selection (normal, daily, or editact)"""
+        village = call.data[len('village_'):]
+        headquarters = self._get_headquarters(user_id)
+        if village == headquarters:
+            # User clicked headquarters button: no journey
+            date_str = self.callback_data.get(user_id, {}).get('date')
+            if not date_str:
+                date_str = datetime.now(IST).strftime('%d/%m/%Y')
+            temp_activity = {
+                'date': date_str,
+                'to_village': '',
+                'purpose': 'Attended office work',
+                'user_id': user_id
+            }
+            logger.info(f"User {user_id} selected headquarters for date {date_str}")
+            self.save_activity_callback(call, temp_activity)
+            if user_id in self.callback_data:
+                del self.callback_data[user_id]
+            return
+        if village == 'manual':
+            logger.info(f"User {user_id} selected manual village entry")
+            date_str = self.callback_data.get(user_id, {}).get('date')
+            if not date_str:
+                date_str = datetime.now(IST).strftime('%d/%m/%Y')
+            temp_activity = {'date': date_str}
+            self.callback_data[user_id] = temp_activity
+
+            # Delete the village selection message
+            self._delete_messages_async(call.message.chat.id, [call.message.message_id], user_id)
+
+            # Send new message for manual entry
+            sent = self.bot.send_message(
+                call.message.chat.id,
+                "✏️ Please type the village name:"
+            )
+            self.bot.register_next_step_handler(
+                sent,
+                self.handle_village_selection,
+                temp_activity=temp_activity,
+                timeout=USER_TIMEOUT
+            )
+            return
+        logger.info(f"User {user_id} selected village: {village}")
+        date_str = self.callback_data.get(user_id, {}).get('date')
+        if not date_str:
+            date_str = datetime.now(IST).strftime('%d/%m/%Y')
+        temp_activity = {
+            'to_village': village,
+            'date': date_str,
+            'user_id': user_id
+        }
+        self.callback_data[user_id] = temp_activity
+        logger.info(f"Stored temp_activity for user {user_id}: {temp_activity}")
 
-                # Delete the daily village selection message before showing purpose buttons
-                try:
-                    self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                    logger.debug(f"Deleted daily village selection message for user {user_id}")
-                except Exception as e:
-                    logger.error(f"Failed to delete daily village selection message for user {user_id}: {e}")
+        # Delete the village selection message while the purpose buttons are prepared
+        self._delete_messages_async(call.message.chat.id, [call.message.message_id], user_id)
 
-                # Show purpose buttons for daily activity
-                user_activities = self.get_user_activities(user_id)
-                keyboard = types.InlineKeyboardMarkup()
+        # Extract month from date_str
+        try:
+            selected_date = datetime.strptime(date_str, '%d/%m/%Y')
+            month = selected_date.month
+            logger.debug(f"Extracted month {month} from date {date_str} for purpose buttons")
+        except Exception as e:
+            logger.error(f"Failed to extract month from date {date_str}: {e}")
+            month = datetime.now(IST).month
+            logger.debug(f"Using current month {month} for purpose buttons")
+
+        self.show_purpose_buttons(call.message, user_id, month=month)
+
+    def _cb_daily_village(self, call, user_id):
+        """Daily village selection"""
+        village = call.data[len('daily_village_'):]
+        headquarters = self._get_headquarters(user_id)
+        if village == headquarters:
+            # User clicked headquarters button: no journey
+            temp_activity = {
+                'date': datetime.now(IST).strftime('%d/%m/%Y'),
+                'to_village': '',
+                'purpose': 'Attended office work',
+                'user_id': user_id
+            }
+            logger.info(f"User {user_id} selected headquarters for daily activity")
+            self.save_activity_callback(call, temp_activity)
+            if user_id in self.callback_data:
+                del self.callback_data[user_id]
+            return
+        if village == 'manual':
+            logger.info(f"User {user_id} selected daily manual village entry")
+            temp_activity = {'date': datetime.now(IST).strftime('%d/%m/%Y')}
+            self.callback_data[user_id] = temp_activity
 
-                # Show numbered activities with numbered buttons in rows (side by side)
-                row = []
-                for i, purpose in enumerate(user_activities, 1):
-                    row.append(types.InlineKeyboardButton(f"{i}", callback_data=f"daily_purpose_idx_{i-1}"))
-                    # Add 5 buttons per row
-                    if len(row) == 5:
-                        keyboard.add(*row)
-                        row = []
+            # Delete the daily village selection message
+            self._delete_messages_async(call.message.chat.id, [call.message.message_id], user_id)
 
-                # Add remaining buttons if any
-                if row:
-                    keyboard.add(*row)
+            # Send new message for manual entry
+            sent = self.bot.send_message(
+                call.message.chat.id,
+                "✏️ Please type the village name:"
+            )
+            self.bot.register_next_step_handler(
+                sent,
+                self.handle_village_selection,
+                temp_activity=temp_activity,
+                timeout=USER_TIMEOUT
+            )
+            return
+        logger.info(f"User {user_id} selected daily village: {village}")
+        temp_activity = {
+            'to_village': village,
+            'date': datetime.now(IST).strftime('%d/%m/%Y'),
+            'user_id': user_id
+        }
+        self.callback_data[user_id] = temp_activity
+        logger.info(f"Stored daily temp_activity for user {user_id}: {temp_activity}")
 
-                keyboard.add(
-                    types.InlineKeyboardButton("📝 Manual Entry", callback_data="daily_purpose_custom")
-                )
-                keyboard.add(
-                    types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-                )
+        # Delete the daily village selection message while the purpose buttons are prepared
+        self._delete_messages_async(call.message.chat.id, [call.message.message_id], user_id)
 
-                # Create numbered list text
-                activities_text = '\n'.join([f"{i}. {purpose}" for i, purpose in enumerate(user_activities, 1)])
-                message_text = f"🎯 **Select the purpose of visit:**\n\n{activities_text}\n\nClick the number button or use Manual Entry."
+        # Show purpose buttons for daily activity
+        user_activities = self.get_user_activities(user_id)
+        keyboard, activities_text = self._get_purpose_ui(user_activities, prefix='daily_purpose')
+        message_text = f"🎯 **Select the purpose of visit:**\n\n{activities_text}\n\nClick the number button or use Manual Entry."
 
-                sent = self.bot.send_message(
-                    call.message.chat.id,
-                    message_text,
-                    reply_markup=keyboard,
-                    parse_mode='Markdown'
-                )
-                return
+        sent = self.bot.send_message(
+            call.message.chat.id,
+            message_text,
+            reply_markup=keyboard,
+            parse_mode='Markdown'
+        )
 
-            # --- Daily purpose selection ---
-            elif call.data.startswith('daily_purpose_'):
-                temp_activity = self.callback_data.get(user_id, {})
-                logger.info(f"Daily purpose callback - temp_activity for user {user_id}: {temp_activity}")
+    def _cb_daily_purpose(self, call, user_id):
+        """Daily purpose selection"""
+        temp_activity = self.callback_data.get(user_id, {})
+        logger.info(f"Daily purpose callback - temp_activity for user {user_id}: {temp_activity}")
 
-                if call.data == 'daily_purpose_custom':
-                    logger.info("Daily custom purpose selected, requesting text input")
-                    self.bot.edit_message_text(
-                        "📝 Please type your custom purpose:",
-                        call.message.chat.id,
-                        call.message.message_id
-                    )
-                    self.bot.register_next_step_handler(
-                        call.message,
-                        self.handle_purpose_selection,
-                        temp_activity=temp_activity,
-                        timeout=USER_TIMEOUT
-                    )
-                elif call.data.startswith('daily_purpose_idx_'):
-                    # Handle numbered activity selection for daily
-                    try:
-                        idx = int(call.data.replace('daily_purpose_idx_', ''))
-                        user_activities = self.get_user_activities(user_id)
-
-                        if 0 <= idx < len(user_activities):
-                            purpose = user_activities[idx]
-                            logger.info(f"Daily purpose selected by index {idx}: {purpose}")
-                            temp_activity['purpose'] = purpose
-                            temp_activity['user_id'] = user_id
-                            self.save_activity_callback(call, temp_activity)
-                        else:
-                            logger.error(f"Invalid daily purpose index {idx} for user {user_id}")
-                            self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
-                            return
-                    except ValueError:
-                        logger.error(f"Invalid daily purpose index format: {call.data}")
-                        self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
-                        return
-                else:
-                    # Handle legacy daily purpose selection (fallback)
-                    purpose = call.data.replace('daily_purpose_', '')
-                    logger.info(f"Daily purpose selected (legacy): {purpose}")
+        # The route table matched the prefix; slice it off once instead of re-testing it per branch
+        choice = call.data[len('daily_purpose_'):]
+        if choice == 'custom':
+            logger.info("Daily custom purpose selected, requesting text input")
+            self._tg_pool.submit(self._answer_callback, call)
+            self.bot.edit_message_text(
+                "📝 Please type your custom purpose:",
+                call.message.chat.id,
+                call.message.message_id
+            )
+            self.bot.register_next_step_handler(
+                call.message,
+                self.handle_purpose_selection,
+                temp_activity=temp_activity,
+                timeout=USER_TIMEOUT
+            )
+        elif choice[:4] == 'idx_':
+            # Handle numbered activity selection for daily
+            try:
+                idx = int(choice[4:])
+                user_activities = self.get_user_activities(user_id)
+
+                if 0 <= idx < len(user_activities):
+                    purpose = user_activities[idx]
+                    logger.info(f"Daily purpose selected by index {idx}: {purpose}")
+                    self._tg_pool.submit(self._answer_callback, call)
                     temp_activity['purpose'] = purpose
                     temp_activity['user_id'] = user_id
                     self.save_activity_callback(call, temp_activity)
-
-                if user_id in self.callback_data:
-                    del self.callback_data[user_id]
-                    logger.info(f"Cleaned up callback_data for user {user_id}")
+                else:
+                    logger.error(f"Invalid daily purpose index {idx} for user {user_id}")
+                    self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
+                    return
+            except ValueError:
+                logger.error(f"Invalid daily purpose index format: {call.data}")
+                self.bot.answer_callback_query(call.id, "❌ Invalid selection. Please try again.")
                 return
+        else:
+            # Handle legacy daily purpose selection (fallback)
+            purpose = choice
+            logger.info(f"Daily purpose selected (legacy): {purpose}")
+            self._tg_pool.submit(self._answer_callback, call)
+            temp_activity['purpose'] = purpose
+            temp_activity['user_id'] = user_id
+            self.save_activity_callback(call, temp_activity)
+
+        if user_id in self.callback_data:
+            del self.callback_data[user_id]
+            logger.info(f"Cleaned up callback_data for user {user_id}")
 
     def edit_activity_command(self, message):
         """Handle /editact command for editing/adding activity for a specific date"""
         user_id = message.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
+        user = self._get_user(user_id)
 
         logger.info(f"User {user_id} initiated /editact command")
 
         # Clear any previous cancelled state for this user
         if user_id in self.cancelled_users:
-            self.cancelled_users.remove(user_id)
+            self.cancelled_users.pop(user_id, None)
             logger.info(f"Cleared cancelled state for user {user_id} in edit_activity_command")
 
         if not user or not user.get('villages'):
@@ -3279,7 +3250,7 @@ class TourDiaryBot:
         user_id = message.from_user.id
         # Remove user from cancelled_users regardless of whether they were in it
         if user_id in self.cancelled_users:
-            self.cancelled_users.remove(user_id)
+            self.cancelled_users.pop(user_id, None)
             # Don't return here, continue processing the date
             
         date_str = message.text.strip()
@@ -3317,7 +3288,7 @@ reply_markup=keyboard
 
     def _start_activity_flow_for_date(self, message, date_str):
         user_id = message.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
+        user = self._get_user(user_id)
         logger.info(f"Starting activity flow for user {user_id} for date {date_str}")
         # Store the date in callback_data for this user
         self.callback_data[user_id] = {'date': date_str}
@@ -3326,10 +3297,7 @@ reply_markup=keyboard
     def show_village_buttons_for_date(self, message, villages: List[str], date_str: str):
         """Show village selection buttons for a specific date, filtering out already visited villages for that month/year and notifying the user."""
         user_id = message.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
-
-        # Ensure all village names are in proper case for display and comparison
-        villages = [v.title() for v in villages]
+        user = self._get_user(user_id)
 
         # Parse the month and year from the date_str
         try:
@@ -3349,23 +3317,10 @@ reply_markup=keyboard
             # Migrate to new structure if needed
             self.migrate_activities_structure(user_id)
 
-            # Get activities from new structure
-            activities = user.get('activities', {})
-            year_str = str(selected_year)
-            month_str = str(selected_month)
-
-            if year_str in activities and month_str in activities[year_str]:
-                for activity in activities[year_str][month_str]:
-                    try:
-                        activity_date = datetime.strptime(activity['date'], '%d/%m/%Y')
-                        if activity_date.month == selected_month and activity_date.year == selected_year:
-                            if activity.get('to_village'):
-                                covered_villages.add(activity['to_village'].title())
-                    except Exception:
-                        continue
+            covered_villages = self._get_covered_villages(user_id, str(selected_year), str(selected_month))
         available_villages = [v for v in villages if v not in covered_villages]
 
-        keyboard = types.InlineKeyboardMarkup()
+        keyboard = types.InlineKeyboardMarkup(row_width=2)
         headquarters = user.get('headquarters', 'HQ')
         hq_title = headquarters.title()
         keyboard.add(
@@ -3373,20 +3328,11 @@ reply_markup=keyboard
                 f"🏢 {hq_title} (headquarters)", callback_data=f"village_{hq_title}"
             )
         )
-        for i in range(0, len(available_villages), 2):
-            row = []
-            row.append(
-                types.InlineKeyboardButton(
-                    available_villages[i], callback_data=f"village_{available_villages[i]}"
-                )
-            )
-            if i + 1 < len(available_villages):
-                row.append(
-                    types.InlineKeyboardButton(
-                        available_villages[i + 1], callback_data=f"village_{available_villages[i + 1]}"
-                    )
-                )
-            keyboard.add(*row)
+        # One add() call; telebot splits the buttons into rows of row_width
+        keyboard.add(*[
+            types.InlineKeyboardButton(v, callback_data=f"village_{v}")
+            for v in available_villages
+        ])
         keyboard.add(
             types.InlineKeyboardButton("✏️ Manual Entry", callback_data="village_manual")
         )
@@ -3403,20 +3349,11 @@ reply_markup=keyboard
             reply_markup=keyboard
         )
         # Track pending prompt for timeout
-        self.pending_prompts[message.from_user.id] = {
-            'message_id': sent.message_id,
-            'chat_id': message.chat.id,
-            'timeout_time': time.time() + USER_TIMEOUT,
-            'type': 'button',
-        }
+        self._track_pending_prompt(message.from_user.id, message.chat.id, sent.message_id)
 
     def td_month_command(self, message):
         """Handle /td <month_number> <year> command: send beautiful Excel of the month's tour diary"""
         user_id = message.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
-        if not user:
-            self.bot.reply_to(message, "❌ No activities found.")
-            return
         args = message.text.split()[1:] if len(message.text.split()) > 1 else []
         if len(args) < 2:
             self.bot.reply_to(
@@ -3439,13 +3376,22 @@ reply_markup=keyboard
         # Migrate to new structure if needed
         self.migrate_activities_structure(user_id)
 
+        year_str = str(year_filter)
+        month_str = str(month_filter)
+        # Fetch only the requested month's activities, not the user's whole history
+        user = users_collection.find_one(
+            {'user_id': user_id},
+            {'headquarters': 1, 'role': 1, 'public_holidays': 1, f'activities.{year_str}.{month_str}': 1, '_id': 0}
+        )
+        if not user:
+            self.bot.reply_to(message, "❌ No activities found.")
+            return
+
         headquarters = user.get('headquarters', 'HQ')
         role = user.get('role')
         # Prepare a map of activities by date
         activities_by_date = {}
         activities = user.get('activities', {})
-        year_str = str(year_filter)
-        month_str = str(month_filter)
 
         if year_str in activities and month_str in activities[year_str]:
             for act in activities[year_str][month_str]:
@@ -3458,14 +3404,10 @@ reply_markup=keyboard
         num_days = calendar.monthrange(year_filter, month_filter)[1]
         all_dates = [datetime(year_filter, month_filter, day).date() for day in range(1, num_days+1)]
         # Get user public holidays (now a list of dicts)
-        user_holidays = {}
-        for h in user.get('public_holidays', []):
-            try:
-                dt = datetime.strptime(h['date'], '%d/%m/%Y').date()
-                if dt.month == month_filter and dt.year == year_filter:
-                    user_holidays[dt] = h['desc']
-            except Exception:
-                continue
+        user_holidays = {
+            dt: desc for dt, desc in holiday_dates(user.get('public_holidays', [])).items()
+            if dt.month == month_filter and dt.year == year_filter
+        }
         # Find all Sundays and second Saturday
         sundays = set()
         second_saturday = None
@@ -3494,7 +3436,7 @@ reply_markup=keyboard
             user_name = username.lstrip('@')
         else:
             user_name = 'User'
-        month_name = calendar.month_name[month_filter]
+        month_name = MONTH_NAMES[month_filter]
         
         user_name_upper = user_name.upper()
         month_name_upper = month_name.upper()
@@ -3605,7 +3547,7 @@ reply_markup=keyboard
         user_id = message.from_user.id
         village = message.text.strip().title()
         # Validate village name: reject empty, commands, or invalid characters
-        if not village or village.startswith('/') or not village.replace(' ', '').isalnum():
+        if not village or village.startswith('/') or not VILLAGE_NAME_RE.fullmatch(village):
             self.bot.send_message(
                 message.chat.id,
 "❌ Invalid village name. Village names must be non-empty, not start with '/', and contain only letters, numbers, or spaces."
@@ -3618,26 +3560,9 @@ reply_markup=keyboard
                     logger.error(f"Error deleting prompt message for user {user_id}: {e}")
                 del self.input_prompt_message[user_id]
             # Re-show the village settings menu
-            user = users_collection.find_one({'user_id': user_id})
+            user = self._get_user(user_id)
             villages = user.get('villages', []) if user else []
-            villages_text = (
-                '\n'.join([f"{i+1}. {v}" for i, v in enumerate(villages)])
-                if villages else 'No villages added yet.'
-            )
-            keyboard = types.InlineKeyboardMarkup()
-            keyboard.add(
-                types.InlineKeyboardButton("➕ Add Village", callback_data="settings_add_village")
-                )
-            if villages:
-                keyboard.add(
-                    types.InlineKeyboardButton("🗑️ Remove Village", callback_data="settings_remove_village")
-                )
-            keyboard.add(
-                types.InlineKeyboardButton("📁 Upload File (Replace All)", callback_data="settings_upload_villages")
-            )
-            keyboard.add(
-                types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-            )
+            villages_text, keyboard = self._get_villages_menu(villages)
             self.bot.send_message(
                 message.chat.id,
                 f"🏘️ **Your Villages:**\n\n{villages_text}\n\nYou can add, remove, or upload a new list to replace all.",
@@ -3645,11 +3570,15 @@ reply_markup=keyboard
                 parse_mode='Markdown'
             )
             return
-        users_collection.update_one(
+        # Write and read back in one round trip; the returned document refreshes the cache and the menu
+        user = users_collection.find_one_and_update(
             {'user_id': user_id},
             {'$addToSet': {'villages': village}},
-            upsert=True
+            upsert=True,
+            projection={'activities': 0},
+            return_document=ReturnDocument.AFTER
         )
+        self._cache_user(user_id, user)
         # Delete the prompt message if present
         if user_id in self.input_prompt_message:
             try:
@@ -3658,26 +3587,8 @@ reply_markup=keyboard
                 logger.error(f"Error deleting prompt message for user {user_id}: {e}")
             del self.input_prompt_message[user_id]
         # Refresh the village list UI after adding
-        user = users_collection.find_one({'user_id': user_id})
         villages = user.get('villages', []) if user else []
-        villages_text = (
-            '\n'.join([f"{i+1}. {v}" for i, v in enumerate(villages)])
-            if villages else 'No villages added yet.'
-        )
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(
-            types.InlineKeyboardButton("➕ Add Village", callback_data="settings_add_village")
-        )
-        if villages:
-            keyboard.add(
-                types.InlineKeyboardButton("🗑️ Remove Village", callback_data="settings_remove_village")
-            )
-        keyboard.add(
-            types.InlineKeyboardButton("📁 Upload File (Replace All)", callback_data="settings_upload_villages")
-        )
-        keyboard.add(
-            types.InlineKeyboardButton("❌ Cancel", callback_data="settings_cancel")
-        )
+        villages_text, keyboard = self._get_villages_menu(villages)
         self.bot.send_message(
             message.chat.id,
             f"✅ Village added: **{village}**\n\n🏘️ **Your Villages:**\n\n{villages_text}\n\nYou can add, remove, or upload a new list to replace all.",
@@ -3685,62 +3596,45 @@ reply_markup=keyboard,
             parse_mode='Markdown'
         )
 
-    def clean_invalid_villages(self):
-        """One-time admin function to remove invalid village names from all users."""
-        for user in users_collection.find({}):
-            villages = user.get('villages', [])
-            cleaned = [v for v in villages if v and not v.startswith('/') and v.replace(' ', '').isalnum()]
-            if len(cleaned) != len(villages):
-                users_collection.update_one({'user_id': user['user_id']}, {'$set': {'villages': cleaned}})
-                logger.info(f"Cleaned villages for user {user['user_id']}: {cleaned}")
-
     def run(self):
         """Run the bot"""
         logger.info("Bot started successfully!")
         logger.info(f"Logging configured: logs.txt with max 6000 lines")
         try:
-            self.bot.polling(none_stop=True)
+            # Long polling: Telegram holds getUpdates open until an update arrives instead of
+            # answering empty every few seconds; the HTTP timeout must outlast that wait
+            self.bot.polling(
+                none_stop=True,
+                timeout=LONG_POLLING_TIMEOUT + 10,
+                long_polling_timeout=LONG_POLLING_TIMEOUT
+            )
         except Exception as e:
             logger.error(f"Bot polling error: {e}")
             time.sleep(15)
             self.run()
 
-    def _refresh_settings_ui(self, chat_id, user_id):
-        user = users_collection.find_one({'user_id': user_id})
-        hq_status = (
-            f"✅ {user.get('headquarters', 'Not set')}"
-            if user.get('headquarters')
-            else "❌ Not set"
-        )
-        villages_count = len(user.get('villages', []))
-        custom_activities_count = len(user.get('custom_activities', []))
-        default_purpose = user.get('default_purpose') or 'Not set'
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(
-            types.InlineKeyboardButton("🏢 Set Headquarters", callback_data="settings_sethq")
-        )
-        keyboard.add(
-            types.InlineKeyboardButton("🏘️ Add Villages", callback_data="settings_addvil")
-        )
-        keyboard.add(
-            types.InlineKeyboardButton("📋 Manage Activities", callback_data="settings_activities")
-        )
-        keyboard.add(
-            types.InlineKeyboardButton("🎯 Set Default Purpose", callback_data="settings_default_purpose")
-        )
-        keyboard.add(
-            types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection")
-        )
-        settings_text = (
-            f"⚙️ **Settings**\n\n"
-            f"**Headquarters:** {hq_status}\n"
-            f"**Role:** {role_status}\n"
-            f"**Villages:** {villages_count} added\n"
-            f"**Custom Activities:** {custom_activities_count} defined\n"
-            f"**Default Purpose:** {default_purpose}\n"
-            f"**Public Holidays:** {holidays_count} added\n\n"
-            f"Select an option to configure:"
-        )
+    def _upload_logs(self, message):
+        """Send logs.txt to the requesting chat (runs on the background Telegram pool)"""
+        # Make sure buffered records are on disk before sending the file
+        buffered_handler.flush()
+        try:
+            with open(LOG_FILENAME, 'rb', buffering=1 << 20) as f:
+                self.bot.send_document(message.chat.id, f, caption=f"📝 {LOG_FILENAME}")
+        except FileNotFoundError:
+            self.bot.reply_to(message, "No logs available yet.")
+        except Exception as e:
+            logger.error(f"Error sending logs to {message.chat.id}: {e}")
+            try:
+                self.bot.reply_to(message, f"❌ Could not send {LOG_FILENAME}: {e}")
+            except Exception:
+                pass
+
+    def _refresh_settings_ui(self, chat_id, user_id, user=None):
+        """Send the settings menu; pass the user document when the caller already has it"""
+        user = user or self._get_user(user_id)
+        if not user:
+            return
+        settings_text, keyboard = self._render_settings_menu(user)
         self.bot.send_message(
             chat_id,
             settings_text,
@@ -3769,26 +3663,21 @@ reply_markup=keyboard,
             file_info = self.bot.get_file(file.file_id)
             downloaded_file = self.bot.download_file(file_info.file_path)
             file_data = BytesIO(downloaded_file)
-            if file_name.endswith('.csv'):
-                df = pd.read_csv(file_data)
-            else:
-                df = pd.read_excel(file_data)
-            date_col = None
-            desc_col = None
-            for col in df.columns:
-                if 'date' in col.lower():
-                    date_col = col
-                if 'holiday' in col.lower():
-                    desc_col = col
+            # CSV and .xlsx are read with the stdlib/openpyxl; only legacy .xls goes through pandas
+            rows = list(self._iter_table_rows(file_name, file_data))
+            header = rows[0] if rows else ()
+            date_col = self._find_column(header, 'date')
+            desc_col = self._find_column(header, 'holiday')
             if date_col is None or desc_col is None:
                 self.bot.reply_to(message, "❌ File must have both 'Date' and 'Holiday' columns.")
                 return
             holidays = []
             skipped = []
             accepted_formats = ['%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d', '%Y/%m/%d']
-            for i, row in df.iterrows():
-                d_raw = row[date_col]
-                desc = str(row[desc_col]).strip()
+            for i, row in enumerate(rows[1:]):
+                d_raw = row[date_col] if date_col < len(row) else None
+                desc_raw = row[desc_col] if desc_col < len(row) else None
+                desc = str(desc_raw).strip() if desc_raw is not None else ''
                 if not d_raw or not desc:
                     reason = "Missing date or description"
                     skipped.append(f"Row {i+2}: '{d_raw}' - '{desc}' ({reason})")
@@ -3827,11 +3716,14 @@ reply_markup=keyboard,
                     error_msg += "No valid rows detected."
                 self.bot.reply_to(message, error_msg)
                 return
-            users_collection.update_one(
+            updated = users_collection.find_one_and_update(
                 {'user_id': user_id},
                 {'$set': {'public_holidays': holidays}},
-                upsert=True
+                upsert=True,
+                projection={'activities': 0},
+                return_document=ReturnDocument.AFTER
             )
+            self._cache_user(user_id, updated)
             reply_msg = (
                 f"✅ Successfully added {len(holidays)} public holidays!\n\n"
                 f"**Holidays added:** {', '.join([h['date'] + ' - ' + h['desc'] for h in holidays[:5]])}"
@@ -3840,20 +3732,21 @@ reply_markup=keyboard,
             if skipped:
                 reply_msg += f"\n\n⚠️ Skipped invalid rows: {', '.join(skipped[:5])}" + (f" and {len(skipped)-5} more..." if len(skipped) > 5 else "")
             self.bot.reply_to(message, reply_msg, parse_mode='Markdown')
-            self._refresh_settings_ui(message.chat.id, user_id)
+            self._refresh_settings_ui(message.chat.id, user_id, updated)
         except Exception as e:
             logger.error(f"Error processing holiday file for user {user_id}: {e}")
             self.bot.reply_to(message, f"❌ Error processing file: {str(e)}")
 
     def migrate_activities_structure(self, user_id):
         """Migrate flat activities list to nested year->month->list structure if needed."""
-        user = users_collection.find_one({'user_id': user_id})
+        # Only documents still holding the legacy flat list match, so migrated users cost no transfer
+        user = users_collection.find_one(
+            {'user_id': user_id, 'activities': {'$type': 'array'}},
+            {'activities': 1, '_id': 0}
+        )
         if not user:
             return
-        activities = user.get('activities', [])
-        # If already in new structure, do nothing
-        if isinstance(activities, dict):
-            return
+        activities = user['activities']
         # Otherwise, migrate
         new_activities = {}
         for act in activities:
@@ -3869,20 +3762,63 @@ reply_markup=keyboard,
             except Exception as e:
                 logger.error(f"Migration: Skipping activity {act} for user {user_id}: {e}")
         users_collection.update_one({'user_id': user_id}, {'$set': {'activities': new_activities}})
+        self._invalidate_user(user_id)
+
+    def _get_month_activities(self, user_id, year_str, month_str):
+        """Fetch one month's activity list, projecting away the rest of the user document."""
+        path = f'activities.{year_str}.{month_str}'
+        user = users_collection.find_one({'user_id': user_id}, {path: 1, '_id': 0})
+        return (user or {}).get('activities', {}).get(year_str, {}).get(month_str, [])
+
+    def _get_activity(self, user_id, year_str, month_str, date_str):
+        """Fetch the single activity logged on date_str, or None; the positional projection returns only that element."""
+        path = f'activities.{year_str}.{month_str}'
+        user = users_collection.find_one({'user_id': user_id, f'{path}.date': date_str}, {f'{path}.$': 1, '_id': 0})
+        acts = (user or {}).get('activities', {}).get(year_str, {}).get(month_str, [])
+        return acts[0] if acts else None
+
+    def _get_covered_villages(self, user_id, year_str, month_str):
+        """Return the set of villages visited in a month, fetching only that month's dates and villages."""
+        month_path = f'activities.{year_str}.{month_str}'
+        user = users_collection.find_one(
+            {'user_id': user_id},
+            {f'{month_path}.date': 1, f'{month_path}.to_village': 1, '_id': 0}
+        ) or {}
+        # Holidays/HQ days may store an empty village name
+        return {
+            a['to_village']
+            for a in self._month_activities(user.get('activities', {}), year_str, month_str)
+            if a.get('to_village')
+        }
+
+    def _get_year_activities(self, user_id, year_str):
+        """Fetch one year's {month: activities} dict for a user."""
+        user = users_collection.find_one({'user_id': user_id}, {f'activities.{year_str}': 1, '_id': 0})
+        return (user or {}).get('activities', {}).get(year_str, {})
 
     @staticmethod
-    def _sort_activities_by_date(acts):
-        return sorted(acts, key=lambda a: datetime.strptime(a['date'], '%d/%m/%Y'))
+    def _activity_date_key(act):
+        return activity_date_iso(act['date'])
+
+    @classmethod
+    def _sort_activities_by_date(cls, acts):
+        return sorted(acts, key=cls._activity_date_key)
 
     def show_activities_years(self, message):
         user_id = message.from_user.id
         self.migrate_activities_structure(user_id)
-        user = users_collection.find_one({'user_id': user_id})
-        activities = user.get('activities', {})
-        if not activities:
+        # Only the year keys are needed, so let MongoDB list them instead of sending every activity
+        result = next(users_collection.aggregate([
+            {'$match': {'user_id': user_id}},
+            {'$project': {'_id': 0, 'years': {'$map': {
+                'input': {'$objectToArray': {'$ifNull': ['$activities', {}]}},
+                'in': '$$this.k'
+            }}}}
+        ]), None)
+        years = sorted(result['years']) if result else []
+        if not years:
             self.bot.reply_to(message, "❌ No activities found.")
             return
-        years = sorted(activities.keys())
         keyboard = types.InlineKeyboardMarkup()
         for y in years:
             keyboard.add(types.InlineKeyboardButton(y, callback_data=f"activities_year_{y}"))
@@ -3890,34 +3826,30 @@ reply_markup=keyboard,
 
     def show_activities_months(self, call, year):
         user_id = call.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
-        activities = user.get('activities', {})
-        months = sorted(activities.get(year, {}).keys(), key=lambda m: int(m))
+        months = sorted(self._get_year_activities(user_id, year).keys(), key=lambda m: int(m))
         keyboard = types.InlineKeyboardMarkup()
         for m in months:
-            month_name = calendar.month_name[int(m)]
+            month_name = MONTH_NAMES[int(m)]
             keyboard.add(types.InlineKeyboardButton(month_name, callback_data=f"activities_month_{year}_{m}"))
         keyboard.add(types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection"))
         self.bot.edit_message_text(f"📅 Year: {year}\nSelect a month:", call.message.chat.id, call.message.message_id, reply_markup=keyboard)
 
     def show_activities_dates(self, call, year, month):
         user_id = call.from_user.id
-        user = users_collection.find_one({'user_id': user_id})
-        acts = user.get('activities', {}).get(year, {}).get(month, [])
-        acts = sorted(acts, key=lambda a: datetime.strptime(a['date'], '%d/%m/%Y'))
+        acts = self._get_month_activities(user_id, year, month)
+        acts = self._sort_activities_by_date(acts)
         if not acts:
-            self.bot.edit_message_text(f"❌ No activities for {calendar.month_name[int(month)]} {year}.", call.message.chat.id, call.message.message_id)
+            self.bot.edit_message_text(f"❌ No activities for {MONTH_NAMES[int(month)]} {year}.", call.message.chat.id, call.message.message_id)
             return
-        msg = f"📅 Activities for {calendar.month_name[int(month)]} {year}:\n\n"
-        for i, act in enumerate(acts, 1):
-            msg += f"{i}. {act['date']}: {act.get('to_village','')} - {act.get('purpose','')}\n"
+        msg = f"📅 Activities for {MONTH_NAMES[int(month)]} {year}:\n\n" + format_numbered_list(
+            f"{act['date']}: {act.get('to_village','')} - {act.get('purpose','')}" for act in acts
+        )
         keyboard = types.InlineKeyboardMarkup(row_width=5)
-        delete_buttons = []
-        for i in range(1, len(acts) + 1):
-            delete_buttons.append(types.InlineKeyboardButton(f"🗑️ {i}", callback_data=f"delete_activity_{year}_{month}_{i-1}"))
-            if len(delete_buttons) == 5 or i == len(acts):
-                keyboard.add(*delete_buttons)
-                delete_buttons = []
+        keyboard.add(*[
+            # Buttons carry the activity's date so the delete steps don't need to re-sort the month
+            types.InlineKeyboardButton(f"🗑️ {i}", callback_data=f"delete_activity_{year}_{month}_{act['date']}")
+            for i, act in enumerate(acts, 1)
+        ])
         keyboard.add(types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_selection"))
         self.bot.edit_message_text(msg, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
 